@@ -0,0 +1,393 @@
+# aggregates.py
+import numpy as np
+import pandas as pd
+from calculate_ranking import (
+    rankings_from_matrices, build_outcome_matrices, replay_elo,
+    METRIC_KEYS, TIE_LABEL, ELO_INITIAL, ELO_K, ELO_SCALE
+)
+from calculate_agreement import (
+    agreements_from_matrices, pairwise_agreements_from_codes, build_task_ids, build_label_count_matrices
+)
+from models import (
+    db, Annotation, PairwiseCount, TaskLabelCount, ModelRating, AnnotatorTotal, ResultCube,
+    dialect_insert, select_annotation_rows, WINNER_LO, WINNER_HI, DEFAULT_CAMPAIGN
+)
+
+# 语料中没有类别信息的病例归入该类别
+UNKNOWN_CATEGORY = 'N/A'
+
+# (campaign, case_id) -> 类别，由 app 通过 set_category_resolver 设置（按需加载对应活动的语料）
+_category_resolver = None
+
+def set_category_resolver(resolver):
+    """resolver(campaign, case_id) 返回病例的类别（未知时返回 None）"""
+    global _category_resolver
+    _category_resolver = resolver
+
+def case_category(case_id, campaign=DEFAULT_CAMPAIGN):
+    category = _category_resolver(campaign, str(case_id)) if _category_resolver is not None else None
+    return category if category else UNKNOWN_CATEGORY
+
+
+def get_data_as_dataframe(db_session, campaign=None):
+    """Queries the annotations (decoded back to model / winner names) of one campaign, or of all campaigns, as a Pandas DataFrame."""
+    stmt = select_annotation_rows()
+    if campaign is not None:
+        stmt = stmt.where(Annotation.campaign == campaign)
+    df = pd.read_sql(stmt, db_session.connection())
+    return df
+
+
+def _upsert_increment(model, keys, increments):
+    """对汇总表执行“插入或累加”，PostgreSQL 和 SQLite 使用 ON CONFLICT 原子完成"""
+    insert = dialect_insert(model)
+    if insert is not None:
+        stmt = insert.values(**keys, **increments)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={col: getattr(model, col) + stmt.excluded[col] for col in increments}
+        )
+        db.session.execute(stmt)
+        return
+    updated = db.session.query(model).filter_by(**keys).update(
+        {getattr(model, col): getattr(model, col) + value for col, value in increments.items()},
+        synchronize_session=False
+    )
+    if not updated:
+        db.session.add(model(**keys, **increments))
+
+
+def _upsert_increments(model, key_columns, rows):
+    """
+    把 {键元组: {列: 增量}} 一次写入汇总表：PostgreSQL 和 SQLite 用一条 executemany 的 ON CONFLICT 语句完成。
+    按键排序后执行，使并发事务以相同的顺序加锁。
+    """
+    if not rows:
+        return
+    insert = dialect_insert(model)
+    if insert is None:
+        for key, increments in sorted(rows.items()):
+            _upsert_increment(model, dict(zip(key_columns, key)), increments)
+        return
+    params = [{**dict(zip(key_columns, key)), **increments} for key, increments in sorted(rows.items())]
+    increment_columns = list(params[0].keys() - set(key_columns))
+    stmt = insert.on_conflict_do_update(
+        index_elements=list(key_columns),
+        set_={col: getattr(model, col) + insert.excluded[col] for col in increment_columns}
+    )
+    db.session.execute(stmt, params)
+
+
+def _add_increments(rows, key, increments):
+    current = rows.setdefault(key, dict.fromkeys(increments, 0))
+    for col, value in increments.items():
+        current[col] += value
+
+
+def update_aggregates(annotation, sign=1, update_elo=True):
+    """
+    在当前事务中把一条标注累加到汇总表（sign=-1 时从汇总表中减去）。
+    每个标注员对每个任务只有一条标注，因此 rater_count 与 count 同步变化。
+    Elo 无法撤销已进行的对局，修改已有标注时应传入 update_elo=False；需精确值时请重建汇总表。
+    """
+    update_aggregates_batch([(annotation, sign, update_elo)])
+
+
+def update_aggregates_batch(changes):
+    """
+    update_aggregates 的批量版本：changes 为按提交顺序排列的 (annotation, sign, update_elo)。
+    增量先在内存中按键合并，每张汇总表只执行一条批量 upsert；Elo 对局按顺序依次计算。
+    """
+    pair_rows, cube_rows, label_rows, total_rows = {}, {}, {}, {}
+    games = []
+    for annotation, sign, update_elo in changes:
+        campaign = annotation.campaign
+        model_a, model_b = annotation.model_a, annotation.model_b
+        model_x, model_y = sorted((model_a, model_b))
+        task_id = f"{annotation.case_id}_{model_x}_vs_{model_y}"
+        category = case_category(annotation.case_id, campaign)
+        for metric_key in METRIC_KEYS:
+            winner = annotation.winner_label(metric_key)
+            pair_counts = {
+                "x_wins": sign * int(winner == model_x),
+                "y_wins": sign * int(winner == model_y),
+                "ties": sign * int(winner == TIE_LABEL),
+                "comparisons": sign,
+            }
+            if model_x != model_y:
+                # 与 rebuild_aggregates / build_cube_rows 一致：模型与自身的比较不计入两两计数
+                _add_increments(pair_rows, (campaign, metric_key, model_x, model_y), pair_counts)
+                _add_increments(cube_rows, (campaign, metric_key, category, annotation.annotator_id, model_x, model_y),
+                                pair_counts)
+            _add_increments(label_rows, (campaign, metric_key, task_id, winner), {"count": sign, "rater_count": sign})
+            if update_elo:
+                games.append((campaign, metric_key, model_a, model_b, winner))
+        _add_increments(total_rows, (campaign, annotation.annotator_id), {"annotations": sign})
+
+    def changed(rows):
+        # 同一批中先减后加相互抵消的键不需要写入
+        return {key: increments for key, increments in rows.items() if any(increments.values())}
+
+    _upsert_increments(PairwiseCount, ("campaign", "metric", "model_x", "model_y"), changed(pair_rows))
+    _upsert_increments(ResultCube, ("campaign", "metric", "category", "annotator_id", "model_x", "model_y"),
+                       changed(cube_rows))
+    _upsert_increments(TaskLabelCount, ("campaign", "metric", "task_id", "label"), changed(label_rows))
+    _upsert_increments(AnnotatorTotal, ("campaign", "annotator_id"), changed(total_rows))
+    _update_elo(games)
+
+
+def _update_elo(games):
+    """按顺序进行一批 (campaign, metric_key, model_a, model_b, winner) 对局，涉及的评分只读取、加锁一次"""
+    if not games:
+        return
+    campaigns = {game[0] for game in games}
+    metric_keys = {game[1] for game in games}
+    models = {model for game in games for model in game[2:4]}
+    ratings = {
+        (r.campaign, r.metric, r.model): r for r in db.session.query(ModelRating).filter(
+            ModelRating.campaign.in_(campaigns), ModelRating.metric.in_(metric_keys), ModelRating.model.in_(models)
+        ).order_by(ModelRating.campaign, ModelRating.metric, ModelRating.model).with_for_update()
+    }
+    for campaign, metric_key, model_a, model_b, winner in games:
+        if winner == model_a:
+            score = 1.0
+        elif winner == model_b:
+            score = 0.0
+        elif winner == TIE_LABEL:
+            score = 0.5
+        else:
+            continue
+        for model in (model_a, model_b):
+            if (campaign, metric_key, model) not in ratings:
+                rating = ModelRating(campaign=campaign, metric=metric_key, model=model, elo=ELO_INITIAL)
+                ratings[(campaign, metric_key, model)] = rating
+                db.session.add(rating)
+        rating_a, rating_b = ratings[(campaign, metric_key, model_a)], ratings[(campaign, metric_key, model_b)]
+        expected = 1.0 / (1.0 + 10 ** ((rating_b.elo - rating_a.elo) / ELO_SCALE))
+        delta = ELO_K * (score - expected)
+        rating_a.elo += delta
+        rating_b.elo -= delta
+
+
+def _matrices_from_pair_rows(pair_rows):
+    """
+    由 (metric, model_x, model_y, x_wins, y_wins, ties, comparisons) 行构造各指标的计数矩阵。
+    返回 (models, comparisons, matrices)，models 按字典序排列。
+    """
+    models = sorted({r.model_x for r in pair_rows} | {r.model_y for r in pair_rows})
+    index = {m: i for i, m in enumerate(models)}
+    n = len(models)
+
+    matrices = {}
+    comparisons = np.zeros(n, dtype=np.int64)
+    for metric_key in METRIC_KEYS:
+        wins = np.zeros((n, n), dtype=np.int64)
+        ties = np.zeros((n, n), dtype=np.int64)
+        metric_comparisons = np.zeros(n, dtype=np.int64)
+        for r in pair_rows:
+            if r.metric != metric_key:
+                continue
+            x, y = index[r.model_x], index[r.model_y]
+            wins[x, y] += r.x_wins
+            wins[y, x] += r.y_wins
+            ties[x, y] += r.ties
+            ties[y, x] += r.ties
+            metric_comparisons[x] += r.comparisons
+            metric_comparisons[y] += r.comparisons
+        matrices[metric_key] = {'wins': wins, 'ties': ties}
+        comparisons = metric_comparisons
+    return models, comparisons, matrices
+
+
+def rankings_from_aggregates(db_session, campaign=DEFAULT_CAMPAIGN):
+    """Builds the leaderboards of a campaign from the PairwiseCount / ModelRating summary tables."""
+    pair_rows = db_session.query(PairwiseCount).filter(PairwiseCount.campaign == campaign).all()
+    if not pair_rows:
+        return {}
+    models, comparisons, matrices = _matrices_from_pair_rows(pair_rows)
+    index = {m: i for i, m in enumerate(models)}
+    n = len(models)
+
+    elo_ratings = {metric_key: np.full(n, ELO_INITIAL) for metric_key in METRIC_KEYS}
+    for r in db_session.query(ModelRating).filter(ModelRating.campaign == campaign):
+        if r.metric in elo_ratings and r.model in index:
+            elo_ratings[r.metric][index[r.model]] = r.elo
+
+    return rankings_from_matrices(models, comparisons, matrices, elo_ratings)
+
+
+def rankings_from_cube(db_session, campaign=DEFAULT_CAMPAIGN, category=None, annotator_id=None):
+    """
+    Builds the leaderboards of one slice of a campaign's ResultCube (filtered by
+    category and/or annotator). Elo is order dependent and only kept globally, so slice
+    leaderboards carry win rates and Bradley-Terry strengths only.
+    """
+    query = db_session.query(
+        ResultCube.metric, ResultCube.model_x, ResultCube.model_y,
+        db.func.sum(ResultCube.x_wins).label('x_wins'),
+        db.func.sum(ResultCube.y_wins).label('y_wins'),
+        db.func.sum(ResultCube.ties).label('ties'),
+        db.func.sum(ResultCube.comparisons).label('comparisons'),
+    ).filter(ResultCube.campaign == campaign)
+    if category:
+        query = query.filter(ResultCube.category == category)
+    if annotator_id:
+        query = query.filter(ResultCube.annotator_id == annotator_id)
+    pair_rows = query.group_by(ResultCube.metric, ResultCube.model_x, ResultCube.model_y).all()
+    pair_rows = [r for r in pair_rows if r.comparisons > 0]
+    if not pair_rows:
+        return {}
+    models, comparisons, matrices = _matrices_from_pair_rows(pair_rows)
+    return rankings_from_matrices(models, comparisons, matrices)
+
+
+def cube_dimensions(db_session, campaign=DEFAULT_CAMPAIGN):
+    """Returns the categories and annotators present in a campaign's ResultCube."""
+    present = (ResultCube.campaign == campaign, ResultCube.comparisons > 0)
+    categories = db_session.query(ResultCube.category).filter(*present).distinct().all()
+    annotators = db_session.query(ResultCube.annotator_id).filter(*present).distinct().all()
+    return {
+        'categories': sorted(r[0] for r in categories),
+        'annotators': sorted(r[0] for r in annotators),
+    }
+
+
+def agreement_from_aggregates(db_session, campaign=DEFAULT_CAMPAIGN):
+    """Builds the agreement scores of a campaign from the TaskLabelCount / AnnotatorTotal summary tables."""
+    n_annotators = db_session.query(AnnotatorTotal).filter(
+        AnnotatorTotal.campaign == campaign, AnnotatorTotal.annotations > 0
+    ).count()
+    rows = db_session.query(
+        TaskLabelCount.metric, TaskLabelCount.task_id, TaskLabelCount.label,
+        TaskLabelCount.count, TaskLabelCount.rater_count
+    ).filter(TaskLabelCount.campaign == campaign).all()
+    label_df = pd.DataFrame(rows, columns=['metric', 'task_id', 'label', 'count', 'rater_count'])
+
+    matrices = {}
+    for metric_key, group in label_df.groupby('metric'):
+        counts = group.pivot_table(index='task_id', columns='label', values='count', aggfunc='sum', fill_value=0)
+        rater_counts = group.pivot_table(index='task_id', columns='label', values='rater_count', aggfunc='sum', fill_value=0)
+        rater_counts = rater_counts.reindex(index=counts.index, columns=counts.columns, fill_value=0)
+        matrices[metric_key] = (counts.to_numpy(), rater_counts.to_numpy())
+
+    return agreements_from_matrices(n_annotators, matrices)
+
+
+def pairwise_agreement_from_db(db_session, campaign=DEFAULT_CAMPAIGN):
+    """
+    某个活动的标注员两两一致性矩阵。只读取编码后的列（不关联模型名称表），
+    标签取胜者的模型编号（平局为 -1），与按模型名称计算的结果一致。
+    """
+    columns = [Annotation.annotator_id, Annotation.case_id, Annotation.model_lo, Annotation.model_hi]
+    columns += [getattr(Annotation, metric_key) for metric_key in METRIC_KEYS]
+    df = pd.read_sql(db.select(*columns).where(Annotation.campaign == campaign), db_session.connection())
+    if df['annotator_id'].nunique() < 2:
+        return {"error": "Insufficient data or annotators for agreement calculation."}
+
+    task_codes = df.groupby(['case_id', 'model_lo', 'model_hi'], sort=False).ngroup().to_numpy()
+    annotator_codes, annotators = pd.factorize(df['annotator_id'], sort=True)
+    labels_by_metric = {
+        metric_key: np.select(
+            [df[metric_key] == WINNER_LO, df[metric_key] == WINNER_HI], [df['model_lo'], df['model_hi']], -1
+        )
+        for metric_key in METRIC_KEYS
+    }
+    return pairwise_agreements_from_codes(task_codes, annotator_codes, annotators, labels_by_metric)
+
+
+def rebuild_aggregates():
+    """Recomputes every summary table from the raw Annotation rows, campaign by campaign."""
+    df = get_data_as_dataframe(db.session)
+    for model in (PairwiseCount, TaskLabelCount, ModelRating, AnnotatorTotal, ResultCube):
+        db.session.query(model).delete()
+
+    for campaign, group in df.groupby('campaign', sort=True):
+        _insert_campaign_aggregates(campaign, group.sort_values(['timestamp', 'id'], kind='stable'))
+    db.session.commit()
+    return len(df)
+
+
+def _insert_campaign_aggregates(campaign, df):
+    """写入一个活动的全部汇总行，df 为该活动按时间排序的标注"""
+    models, a_idx, b_idx, _, matrices = build_outcome_matrices(df)
+    task_ids = build_task_ids(df)
+    x_idx, y_idx = np.minimum(a_idx, b_idx), np.maximum(a_idx, b_idx)
+
+    pair_comparisons = pd.Series(1, index=pd.MultiIndex.from_arrays([x_idx, y_idx])).groupby(level=[0, 1]).sum()
+
+    pair_rows, label_rows, rating_rows = [], [], []
+    for metric_key, counts in matrices.items():
+        wins, ties = counts['wins'], counts['ties']
+        for (i, j), n_cmp in pair_comparisons.items():
+            if i == j:
+                continue
+            x, y = (i, j) if models[i] < models[j] else (j, i)
+            pair_rows.append(dict(
+                campaign=campaign, metric=metric_key, model_x=models[x], model_y=models[y],
+                x_wins=int(wins[x, y]), y_wins=int(wins[y, x]),
+                ties=int(ties[x, y]), comparisons=int(n_cmp)
+            ))
+
+        elo = replay_elo(a_idx, b_idx, counts['outcome'], len(models))
+        rating_rows.extend(
+            dict(campaign=campaign, metric=metric_key, model=m, elo=float(elo[i])) for i, m in enumerate(models)
+        )
+
+        valid = df[metric_key].notna().to_numpy()
+        tasks, categories, label_counts, rater_counts = build_label_count_matrices(
+            task_ids.to_numpy()[valid], df['annotator_id'].to_numpy()[valid], df[metric_key].to_numpy()[valid]
+        )
+        t_idx, c_idx = np.nonzero(label_counts)
+        label_rows.extend(
+            dict(campaign=campaign, metric=metric_key, task_id=tasks[t], label=categories[c],
+                 count=int(label_counts[t, c]), rater_count=int(rater_counts[t, c]))
+            for t, c in zip(t_idx, c_idx)
+        )
+
+    cube_rows = build_cube_rows(df, campaign)
+
+    annotator_rows = [
+        dict(campaign=campaign, annotator_id=a, annotations=int(n))
+        for a, n in df['annotator_id'].value_counts().items()
+    ]
+    db.session.bulk_insert_mappings(PairwiseCount, pair_rows)
+    db.session.bulk_insert_mappings(TaskLabelCount, label_rows)
+    db.session.bulk_insert_mappings(ModelRating, rating_rows)
+    db.session.bulk_insert_mappings(AnnotatorTotal, annotator_rows)
+    db.session.bulk_insert_mappings(ResultCube, cube_rows)
+
+
+def build_cube_rows(df, campaign=DEFAULT_CAMPAIGN):
+    """一次向量化分组得到一个活动的 ResultCube 全部行（与 update_aggregates 的增量结果一致）"""
+    model_a = df['model_a'].astype(str).to_numpy()
+    model_b = df['model_b'].astype(str).to_numpy()
+    keep = model_a != model_b
+    a_first = model_a <= model_b
+    case_ids = df['case_id'].astype(str)
+    categories = {case_id: case_category(case_id, campaign) for case_id in case_ids.unique()}
+    keys = pd.DataFrame({
+        'category': case_ids.map(categories).to_numpy(),
+        'annotator_id': df['annotator_id'].to_numpy(),
+        'model_x': np.where(a_first, model_a, model_b),
+        'model_y': np.where(a_first, model_b, model_a),
+    })[keep]
+
+    rows = []
+    for metric_key in METRIC_KEYS:
+        if metric_key not in df.columns:
+            continue
+        winner = df[metric_key].to_numpy()[keep]
+        frame = keys.assign(
+            x_wins=(winner == keys['model_x'].to_numpy()).astype(np.int64),
+            y_wins=(winner == keys['model_y'].to_numpy()).astype(np.int64),
+            ties=(winner == TIE_LABEL).astype(np.int64),
+            comparisons=1,
+        )
+        grouped = frame.groupby(['category', 'annotator_id', 'model_x', 'model_y'], sort=False).sum().reset_index()
+        grouped['campaign'] = campaign
+        grouped['metric'] = metric_key
+        rows.extend(grouped.to_dict('records'))
+    for row in rows:
+        for col in ('x_wins', 'y_wins', 'ties', 'comparisons'):
+            row[col] = int(row[col])
+    return rows
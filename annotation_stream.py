@@ -0,0 +1,380 @@
+# annotation_stream.py
+"""
+Out-of-core input for the calculate_ranking and calculate_agreement CLIs.
+
+Annotation dumps (JSONL, CSV, Parquet or the legacy {"annotation": [...]}
+JSON) are read in fixed-size chunks, and each chunk is folded into running
+sufficient statistics instead of being kept as a DataFrame:
+
+- RankingStats: per-metric win / tie count matrices and per-model comparison
+  counts, plus a compact integer log (timestamp, model codes, outcome) so that
+  Elo, which depends on submission order, can be replayed at the end.
+- AgreementStats: per-metric (task x label) count matrices, plus a compact
+  (task, annotator, label) log per metric used to count each annotator once
+  per task (Krippendorff's alpha) and for the pairwise agreement matrices.
+
+The logs cost a few bytes per row, far less than a DataFrame of strings.
+Codes are assigned in order of first appearance, exactly like the in-memory
+functions, so the results are identical to loading every file into one
+DataFrame. Files can be reduced in separate processes; the partial
+statistics are then merged in file order.
+"""
+import os
+import glob
+import json
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet input is optional
+    pq = None
+from calculate_ranking import METRIC_KEYS, complete_pairs, outcome_codes, replay_elo, rankings_from_matrices
+from calculate_agreement import build_task_ids, agreements_from_matrices, pairwise_agreement, pairwise_result
+
+DEFAULT_CHUNK_ROWS = 50000
+INSUFFICIENT_ANNOTATORS = "Insufficient data or annotators for agreement calculation."
+
+
+def expand_inputs(patterns):
+    """Expands paths and glob patterns, keeping the given order and dropping duplicates."""
+    paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        if not matches:
+            print(f"Warning: '{pattern}' matched no files.")
+        for path in matches:
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def read_chunks(path, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """
+    Yields the annotations of one file as DataFrames of at most chunk_rows rows.
+    Rows without a model_a or model_b are dropped (with a warning), so that the
+    streaming and in-memory modes see the same rows.
+    """
+    for chunk in _read_raw_chunks(path, chunk_rows):
+        if 'model_a' in chunk.columns and 'model_b' in chunk.columns:
+            complete = complete_pairs(chunk)
+            if len(complete) < len(chunk):
+                print(f"Warning: Skipping {len(chunk) - len(complete)} row(s) without model_a / model_b in '{path}'.")
+            chunk = complete
+        yield chunk
+
+
+def _read_raw_chunks(path, chunk_rows):
+    """
+    Legacy .json files cannot be parsed incrementally and are loaded whole
+    before being split; export them as JSONL for bounded memory.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext in ('.jsonl', '.ndjson'):
+        with pd.read_json(path, lines=True, chunksize=chunk_rows) as reader:
+            yield from reader
+    elif ext == '.csv':
+        with pd.read_csv(path, chunksize=chunk_rows) as reader:
+            yield from reader
+    elif ext == '.parquet':
+        if pq is None:
+            raise ValueError("Reading Parquet files requires pyarrow.")
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    elif ext == '.json':
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        records = data['annotation'] if isinstance(data, dict) else data
+        for start in range(0, len(records), chunk_rows):
+            yield pd.DataFrame(records[start:start + chunk_rows])
+    else:
+        raise ValueError(f"Unsupported input format: '{path}'")
+
+
+def load_dataframe(paths, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Reads every file into one DataFrame (in-memory mode, e.g. for the bootstrap)."""
+    chunks = [chunk for path in paths for chunk in read_chunks(path, chunk_rows)]
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+
+class _Codes:
+    """Assigns integer codes to values in order of first appearance."""
+
+    def __init__(self):
+        self.values = []
+        self._index = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def _code(self, value):
+        code = self._index.get(value)
+        if code is None:
+            code = self._index[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def encode(self, values):
+        codes, uniques = pd.factorize(values)
+        if (codes < 0).any():
+            # factorize marks missing values with -1, which would index the last code
+            raise ValueError("Cannot encode missing values; drop incomplete rows first.")
+        mapping = np.array([self._code(value) for value in uniques], dtype=np.int64)
+        return mapping[codes]
+
+    def merge(self, other):
+        """Adds the other's values and returns the array mapping its codes to ours."""
+        return np.array([self._code(value) for value in other.values], dtype=np.int64)
+
+
+def _grow(matrix, shape):
+    """Zero-pads a count matrix to at least the given shape."""
+    if matrix.shape[0] >= shape[0] and matrix.shape[1] >= shape[1]:
+        return matrix
+    grown = np.zeros((max(matrix.shape[0], shape[0]), max(matrix.shape[1], shape[1])), dtype=matrix.dtype)
+    grown[:matrix.shape[0], :matrix.shape[1]] = matrix
+    return grown
+
+
+def _bincount_2d(rows, cols, shape):
+    return np.bincount(rows * shape[1] + cols, minlength=shape[0] * shape[1]).reshape(shape)
+
+
+class RankingStats:
+    """Running statistics for calculate_win_rates_from_df; keep_elo=False drops the Elo log."""
+
+    def __init__(self, keep_elo=True):
+        self.keep_elo = keep_elo
+        self.rows = 0
+        self.models = _Codes()
+        self.comparisons = np.zeros(0, dtype=np.int64)
+        self.wins = {metric_key: np.zeros((0, 0), dtype=np.int64) for metric_key in METRIC_KEYS}
+        self.ties = {metric_key: np.zeros((0, 0), dtype=np.int64) for metric_key in METRIC_KEYS}
+        self.present = set()
+        self.has_timestamp = False
+        # Elo log, one array per chunk
+        self._timestamps, self._a, self._b = [], [], []
+        self._outcomes = {metric_key: [] for metric_key in METRIC_KEYS}
+
+    def _resize(self, n):
+        self.comparisons = np.pad(self.comparisons, (0, n - len(self.comparisons)))
+        for counts in (self.wins, self.ties):
+            for metric_key in counts:
+                counts[metric_key] = _grow(counts[metric_key], (n, n))
+
+    def update(self, df):
+        if df.empty:
+            return
+        self.rows += len(df)
+        interleaved = np.column_stack([df['model_a'].to_numpy(), df['model_b'].to_numpy()]).ravel()
+        codes = self.models.encode(interleaved)
+        a_idx, b_idx = codes[0::2], codes[1::2]
+        n = len(self.models)
+        self._resize(n)
+        self.comparisons += np.bincount(a_idx, minlength=n) + np.bincount(b_idx, minlength=n)
+
+        for metric_key in METRIC_KEYS:
+            if metric_key in df.columns:
+                self.present.add(metric_key)
+                outcome = outcome_codes(df, metric_key)
+            else:
+                outcome = np.full(len(df), np.nan)
+            a_won, b_won, tied = outcome == 1, outcome == -1, outcome == 0
+            self.wins[metric_key] += _bincount_2d(a_idx[a_won], b_idx[a_won], (n, n))
+            self.wins[metric_key] += _bincount_2d(b_idx[b_won], a_idx[b_won], (n, n))
+            self.ties[metric_key] += _bincount_2d(a_idx[tied], b_idx[tied], (n, n))
+            if self.keep_elo:
+                self._outcomes[metric_key].append(outcome.astype(np.float32))
+
+        if self.keep_elo:
+            if 'timestamp' in df.columns:
+                self.has_timestamp = True
+                timestamps = pd.to_datetime(df['timestamp'], errors='coerce')
+            else:
+                timestamps = pd.Series(pd.NaT, index=df.index, dtype='datetime64[ns]')
+            self._timestamps.append(timestamps.to_numpy().astype('datetime64[ns]'))
+            self._a.append(a_idx.astype(np.int32))
+            self._b.append(b_idx.astype(np.int32))
+
+    def merge(self, other):
+        """Appends another partial result (e.g. of a later file)."""
+        self.rows += other.rows
+        mapping = self.models.merge(other.models)
+        self._resize(len(self.models))
+        self.comparisons[mapping] += other.comparisons
+        for counts, other_counts in ((self.wins, other.wins), (self.ties, other.ties)):
+            for metric_key in METRIC_KEYS:
+                counts[metric_key][np.ix_(mapping, mapping)] += other_counts[metric_key]
+        self.present |= other.present
+        self.has_timestamp |= other.has_timestamp
+        if self.keep_elo:
+            self._timestamps.extend(other._timestamps)
+            self._a.extend(mapping[a].astype(np.int32) for a in other._a)
+            self._b.extend(mapping[b].astype(np.int32) for b in other._b)
+            for metric_key in METRIC_KEYS:
+                self._outcomes[metric_key].extend(other._outcomes[metric_key])
+
+    def rankings(self):
+        """Same result as calculate_win_rates_from_df on the concatenated input."""
+        if not len(self.models):
+            return {}
+        models = np.asarray(self.models.values, dtype=object)
+        matrices = {
+            metric_key: {'wins': self.wins[metric_key], 'ties': self.ties[metric_key] + self.ties[metric_key].T}
+            for metric_key in METRIC_KEYS if metric_key in self.present
+        }
+        elo_ratings = None
+        if self.keep_elo:
+            a_idx, b_idx = np.concatenate(self._a), np.concatenate(self._b)
+            order = np.arange(len(a_idx))
+            if self.has_timestamp:
+                order = np.argsort(np.concatenate(self._timestamps), kind='stable')
+            elo_ratings = {
+                metric_key: replay_elo(
+                    a_idx[order], b_idx[order], np.concatenate(self._outcomes[metric_key])[order].astype(float), len(models)
+                )
+                for metric_key in matrices
+            }
+        return rankings_from_matrices(models, self.comparisons, matrices, elo_ratings)
+
+
+class AgreementStats:
+    """Running statistics for calculate_agreements_from_df and calculate_pairwise_agreements_from_df."""
+
+    def __init__(self):
+        self.rows = 0
+        self.tasks = _Codes()
+        self.annotators = _Codes()
+        self.missing_annotator = False
+        self.labels = {metric_key: _Codes() for metric_key in METRIC_KEYS}
+        self.counts = {metric_key: np.zeros((0, 0), dtype=np.int64) for metric_key in METRIC_KEYS}
+        self.present = set()
+        # (task, annotator, label) codes of every valid row, one array triple per chunk
+        self._log = {metric_key: [] for metric_key in METRIC_KEYS}
+
+    def update(self, df):
+        if df.empty:
+            return
+        self.rows += len(df)
+        if 'annotator_id' in df.columns:
+            annotator_ids = df['annotator_id']
+        else:
+            annotator_ids = pd.Series(None, index=df.index, dtype=object)
+        has_annotator = annotator_ids.notna().to_numpy()
+        self.missing_annotator |= not has_annotator.all()
+        task_codes = self.tasks.encode(build_task_ids(df).to_numpy())
+        annotator_codes = np.full(len(df), -1, dtype=np.int64)
+        annotator_codes[has_annotator] = self.annotators.encode(annotator_ids.to_numpy()[has_annotator])
+
+        for metric_key in METRIC_KEYS:
+            if metric_key not in df.columns:
+                continue
+            self.present.add(metric_key)
+            valid = df[metric_key].notna().to_numpy() & has_annotator
+            t, a = task_codes[valid], annotator_codes[valid]
+            label_codes = self.labels[metric_key].encode(df[metric_key].to_numpy()[valid])
+            shape = (len(self.tasks), len(self.labels[metric_key]))
+            self.counts[metric_key] = _grow(self.counts[metric_key], shape)
+            self.counts[metric_key][:shape[0], :shape[1]] += _bincount_2d(t, label_codes, shape)
+            self._log[metric_key].append((t.astype(np.int32), a.astype(np.int32), label_codes.astype(np.int16)))
+
+    def merge(self, other):
+        """Appends another partial result (e.g. of a later file)."""
+        self.rows += other.rows
+        task_map = self.tasks.merge(other.tasks)
+        annotator_map = self.annotators.merge(other.annotators)
+        self.missing_annotator |= other.missing_annotator
+        self.present |= other.present
+        for metric_key in METRIC_KEYS:
+            label_map = self.labels[metric_key].merge(other.labels[metric_key])
+            shape = (len(self.tasks), len(self.labels[metric_key]))
+            self.counts[metric_key] = _grow(self.counts[metric_key], shape)
+            other_counts = other.counts[metric_key]
+            self.counts[metric_key][np.ix_(task_map[:other_counts.shape[0]], label_map[:other_counts.shape[1]])] += other_counts
+            self._log[metric_key].extend(
+                (task_map[t].astype(np.int32), annotator_map[a].astype(np.int32), label_map[c].astype(np.int16))
+                for t, a, c in other._log[metric_key]
+            )
+
+    def _metric_log(self, metric_key):
+        parts = self._log[metric_key]
+        if not parts:
+            return (np.zeros(0, dtype=np.int64),) * 3
+        return tuple(np.concatenate([part[i] for part in parts]).astype(np.int64) for i in range(3))
+
+    def _sorted_labels(self, metric_key):
+        """Label codes remapped to sorted label order, as pd.factorize(sort=True) numbers them."""
+        order = np.argsort(np.asarray(self.labels[metric_key].values, dtype=object), kind='stable')
+        return order, np.argsort(order)
+
+    def n_annotators(self):
+        return len(self.annotators) + int(self.missing_annotator)
+
+    def agreement(self):
+        """Same result as calculate_agreements_from_df on the concatenated input."""
+        if self.n_annotators() < 2:
+            return {"error": INSUFFICIENT_ANNOTATORS}
+        matrices = {}
+        for metric_key in METRIC_KEYS:
+            if metric_key not in self.present:
+                continue
+            t, a, c = self._metric_log(metric_key)
+            shape = self.counts[metric_key].shape
+            # Tasks in order of their first labelled row, labels sorted
+            task_order = pd.unique(t)
+            label_order, _ = self._sorted_labels(metric_key)
+            first = ~pd.DataFrame({'t': t, 'a': a}).duplicated().to_numpy()
+            rater_counts = _bincount_2d(t[first], c[first], shape)
+            matrices[metric_key] = (
+                self.counts[metric_key][np.ix_(task_order, label_order)],
+                rater_counts[np.ix_(task_order, label_order)],
+            )
+        return agreements_from_matrices(self.n_annotators(), matrices)
+
+    def pairwise(self):
+        """Same result as calculate_pairwise_agreements_from_df on the concatenated input."""
+        if len(self.annotators) < 2:
+            return {"error": INSUFFICIENT_ANNOTATORS}
+        names = np.asarray([str(value) for value in self.annotators.values], dtype=object)
+        annotator_order = np.argsort(names, kind='stable')
+        annotator_rank = np.argsort(annotator_order)
+        scores_by_metric = {}
+        for metric_key in METRIC_KEYS:
+            if metric_key not in self.present:
+                continue
+            t, a, c = self._metric_log(metric_key)
+            _, label_rank = self._sorted_labels(metric_key)
+            scores_by_metric[metric_key] = pairwise_agreement(
+                t, annotator_rank[a], label_rank[c], len(self.tasks), len(names), len(label_rank)
+            )
+        return pairwise_result(names[annotator_order], scores_by_metric)
+
+
+def _reduce_file(path, make_stats, chunk_rows):
+    stats = make_stats()
+    for chunk in read_chunks(path, chunk_rows):
+        stats.update(chunk)
+    return stats
+
+
+def reduce_files(paths, make_stats, chunk_rows=DEFAULT_CHUNK_ROWS, workers=None):
+    """
+    Streams every file through a fresh make_stats() accumulator. With workers > 1
+    each file is reduced in its own process and the partial results are merged
+    in file order, which gives the same statistics as the sequential pass.
+    make_stats must be picklable (a class or a functools.partial of one).
+    """
+    if workers and workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+            parts = list(pool.map(_reduce_file, paths, repeat(make_stats), repeat(chunk_rows)))
+        stats = parts[0]
+        for part in parts[1:]:
+            stats.merge(part)
+        return stats
+
+    stats = make_stats()
+    for path in paths:
+        for chunk in read_chunks(path, chunk_rows):
+            stats.update(chunk)
+    return stats
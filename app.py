@@ -1,115 +1,232 @@
 # app.py
 import os
+import io
+import base64
+import csv
 import json
+import time
 import random
+import tempfile
+import itertools
+from functools import partial
 from datetime import datetime
-from flask import Flask, render_template, request, jsonify
-from flask_sqlalchemy import SQLAlchemy
-import pandas as pd
-from calculate_ranking import calculate_win_rates_from_df
-from calculate_agreement import calculate_agreements_from_df
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, url_for
+from sqlalchemy import select, update, tuple_
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet 导出为可选功能
+    pa = pq = None
+from calculate_ranking import METRIC_KEYS, TIE_LABEL
+from models import (
+    db, Annotation, AnnotatorTotal, ResultCube, model_names, encode_pair, encode_winner,
+    dialect_insert, select_annotation_rows, engine_options, configure_sqlite, WINNER_LO, WINNER_TIE, DEFAULT_CAMPAIGN
+)
+from aggregates import (
+    get_data_as_dataframe, update_aggregates_batch, rebuild_aggregates, rankings_from_aggregates, agreement_from_aggregates,
+    rankings_from_cube, cube_dimensions, set_category_resolver, case_category, pairwise_agreement_from_db
+)
+from migrate_annotations import has_legacy_schema, migrate_legacy_annotations, upgrade_campaign_schema
+from scheduler import StaticScheduler, AdaptiveScheduler, SCHEDULER_MODES
+from campaigns import Campaign, CampaignRegistry
+from dialogue_store import DEFAULT_PATTERN
+from bootstrap import bootstrap_intervals, attach_intervals, BOOTSTRAP_UNITS
+from auto_scores import compare_with_humans, accuracy_by_round
+from write_queue import GroupCommitQueue, WriteQueueFull, WriterStopped
+import metrics
+from metrics import stage, STAGE_SET_ARITHMETIC
 
 app = Flask(__name__)
 
 # --- 数据库配置 ---
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
+DATABASE_URL = os.environ.get('DATABASE_URL')
+app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-db = SQLAlchemy(app)
+# PostgreSQL 连接池：DB_POOL_SIZE 个常驻连接，高峰时最多再临时打开 DB_MAX_OVERFLOW 个
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+    DATABASE_URL,
+    pool_size=int(os.environ.get('DB_POOL_SIZE', '5')),
+    max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', '10')),
+    pool_timeout=float(os.environ.get('DB_POOL_TIMEOUT', '30')),
+    pool_recycle=int(os.environ.get('DB_POOL_RECYCLE', '1800')),
+)
+db.init_app(app)
+# 本地 SQLite：WAL 模式，SQLITE_SYNCHRONOUS 为 FULL（默认，提交即落盘）或 NORMAL 等
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'FULL').upper()
+if SQLITE_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+    print(f"Warning: Unknown SQLITE_SYNCHRONOUS '{SQLITE_SYNCHRONOUS}', falling back to 'FULL'.")
+    SQLITE_SYNCHRONOUS = 'FULL'
+with app.app_context():
+    configure_sqlite(db.engine, SQLITE_SYNCHRONOUS, int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000')))
+
+# --- 标注写入 ---
+# WRITE_MODE=sync（默认）：每个请求在自己的事务中写入并提交。
+# WRITE_MODE=group：请求把标注放入进程内的有界队列，由一个写线程把 WRITE_BATCH_DELAY_MS 毫秒内
+#   （或凑满 WRITE_BATCH_ROWS 条）的提交合并为一个事务；提交成功后请求才返回，因此确认时数据已经落盘。
+#   队列中超过 WRITE_QUEUE_SIZE 个请求时返回 503。
+WRITE_MODE = os.environ.get('WRITE_MODE', 'sync')
+if WRITE_MODE not in ('sync', 'group'):
+    print(f"Warning: Unknown WRITE_MODE '{WRITE_MODE}', falling back to 'sync'.")
+    WRITE_MODE = 'sync'
+WRITE_BATCH_ROWS = int(os.environ.get('WRITE_BATCH_ROWS', '64'))
+WRITE_BATCH_DELAY_MS = float(os.environ.get('WRITE_BATCH_DELAY_MS', '5'))
+WRITE_QUEUE_SIZE = int(os.environ.get('WRITE_QUEUE_SIZE', '1024'))
+
+# --- 请求埋点 ---
+# 超过 SLOW_REQUEST_SECONDS 的请求会写入慢请求日志（SLOW_REQUEST_LOG 未设置时输出到标准错误）
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', '1.0'))
+metrics.init_app(app, SLOW_REQUEST_SECONDS, os.environ.get('SLOW_REQUEST_LOG'))
 
 ANNOTATOR_LIST = ['yonghui', 'xinhui', 'jingyi', 'luanbo', 'zhenglong', 'yaqing']
-
-# --- 数据库模型定义 ---
-class Annotation(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    annotator_id = db.Column(db.String(80), nullable=False)
-    case_id = db.Column(db.String(80), nullable=False)
-    model_a = db.Column(db.String(80), nullable=False)
-    model_b = db.Column(db.String(80), nullable=False)
-    winner_coherence = db.Column(db.String(80), nullable=False)
-    winner_adherence = db.Column(db.String(80), nullable=False)
-    winner_clarity = db.Column(db.String(80), nullable=False)
-    winner_empathy = db.Column(db.String(80), nullable=False)
-    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
-
-# 注意：在生产环境中，此命令最好只在初始化时运行一次。
-# 在Render上，可以在Blueprint设置中使用 one-off job 来执行。
-with app.app_context():
-    db.create_all()
+# 可以用逗号分隔的 ANNOTATORS 环境变量覆盖（例如 benchmark.py 生成的合成标注员）
+if os.environ.get('ANNOTATORS'):
+    ANNOTATOR_LIST = [a.strip() for a in os.environ['ANNOTATORS'].split(',') if a.strip()]
 
 # --- 源对话数据加载 ---
-DATA_DIR = './data'
-
-def load_data():
-    """将所有源对话模型数据从文件加载并按 case_id 组织"""
-    all_data = {}
-    if not os.path.exists(DATA_DIR):
-        print(f"Warning: Data directory '{DATA_DIR}' not found.")
-        return {}
-        
-    model_files = [f for f in os.listdir(DATA_DIR) if f.endswith('.jsonl')]
-    for file_name in model_files:
-        model_name = os.path.splitext(file_name)[0]
-        with open(os.path.join(DATA_DIR, file_name), 'r', encoding='utf-8') as f:
-            for line in f:
-                try:
-                    record = json.loads(line)
-                    # case_id = record.get('case_id')
-                    case_id = str(record.get('case_id'))
-                    if not case_id: continue
-                    
-                    interactions = record.get('interactions', [])
-                    dialogue_parts = []
-                    for turn in interactions:
-                        if isinstance(turn, list) and len(turn) == 2:
-                            dialogue_parts.append(f'<div class="doctor-turn">医生: {turn[0]}</div>')
-                            dialogue_parts.append(f'<div class="patient-turn">患者: {turn[1]}</div>')
-                    
-                    formatted_dialogue = "".join(dialogue_parts).replace('*','')
-                    
-                    if case_id not in all_data:
-                        all_data[case_id] = {}
-                    
-                    all_data[case_id][model_name] = {
-                        "dialogue": formatted_dialogue,
-                        "choices": record.get("choices", "N/A"),
-                        "category": record.get("category", "N/A")
-                    }
-                except json.JSONDecodeError:
-                    print(f"Warning: Skipping invalid JSON line in {file_name}")
-    return all_data
+DATA_DIR = os.environ.get('DATA_DIR', './data')
+# eager: 启动时解析并渲染全部对话；lazy: 只建立字节偏移索引，按需读取并缓存；
+# snapshot: mmap 预先编译好的二进制快照（python dialogue_store.py 构建，源文件变化时自动重建），
+#           多个 gunicorn worker 通过页缓存共享同一份数据
+DATA_STORE_MODE = os.environ.get('DATA_STORE_MODE', 'eager')
+DIALOGUE_INDEX_PATH = os.environ.get('DIALOGUE_INDEX_PATH', os.path.join(DATA_DIR, '.dialogue_index.json'))
+DIALOGUE_SNAPSHOT_PATH = os.environ.get('DIALOGUE_SNAPSHOT_PATH', os.path.join(DATA_DIR, '.dialogue_snapshot.bin'))
+DIALOGUE_CACHE_SIZE = int(os.environ.get('DIALOGUE_CACHE_SIZE', '1024'))
+# 自动评分文件（相对于 DATA_DIR 的通配符，例如 */DoctorHistory_x_PatientEmotion/detailed_scores.json），
+# 设置后分析页可以把自动评分与人工判断对照
+AUTO_SCORES_PATTERN = os.environ.get('AUTO_SCORES_PATTERN')
+
+# --- 任务调度 ---
+# SCHEDULER_MODE=static（默认）：与之前相同，第 i 个任务分给 i % 标注员人数，每个任务只有一条判断。
+# SCHEDULER_MODE=adaptive：优先下发当前胜负最不确定的模型对，每个任务最多由 SCHEDULER_OVERLAP_QUOTA
+#   个不同的标注员判断（用于计算一致性），每个标注员最多 SCHEDULER_BUDGET 条（默认与 static 的人均任务数相同）。
+# 调度状态按进程保存在内存中，首次访问时从数据库加载，之后在每次提交时增量更新；多个 worker 之间不共享。
+SCHEDULER_MODE = os.environ.get('SCHEDULER_MODE', 'static')
+SCHEDULER_OPTIONS = {
+    'mode': SCHEDULER_MODE,
+    'overlap_quota': int(os.environ.get('SCHEDULER_OVERLAP_QUOTA', '2')),
+    'overlap_rate': float(os.environ.get('SCHEDULER_OVERLAP_RATE', '0.25')),
+    'budget': int(os.environ['SCHEDULER_BUDGET']) if os.environ.get('SCHEDULER_BUDGET') else None,
+}
+
+# --- 标注活动 ---
+# 一个进程可以同时服务多个标注活动，每个活动有自己的语料、标注员名单、任务列表和标注命名空间。
+# CAMPAIGNS_CONFIG 指向活动配置文件（格式见 campaigns.py 与 campaigns.example.json），未设置时只有一个
+# 名为 default 的活动，由上面的 DATA_DIR / DATA_STORE_MODE / SCHEDULER_* 等环境变量描述。
+# 语料在首次访问时加载；所有已加载语料的估计内存超过 CORPUS_MEMORY_BUDGET_MB 时，最久未使用的语料会被释放。
+CAMPAIGNS_CONFIG = os.environ.get('CAMPAIGNS_CONFIG')
+CORPUS_MEMORY_BUDGET_MB = os.environ.get('CORPUS_MEMORY_BUDGET_MB')
 
 # --- 【新版本】从数据库获取已完成任务 ---
-def get_completed_annotations(annotator_id):
-    """从数据库获取指定标注员已完成的任务"""
+def get_completed_annotations(campaign_name, annotator_id):
+    """从数据库获取指定活动中某个标注员已完成的任务"""
     completed = set()
     try:
-        annotations = db.session.query(Annotation).filter_by(
-            annotator_id=annotator_id
-        ).with_entities(
-            Annotation.case_id, Annotation.model_a, Annotation.model_b
-        ).all()
+        annotations = db.session.query(
+            Annotation.case_id, Annotation.model_lo, Annotation.model_hi
+        ).filter_by(campaign=campaign_name, annotator_id=annotator_id).all()
 
         for ann in annotations:
-            models = tuple(sorted((ann.model_a, ann.model_b)))
+            # model_lo 的名称按字典序小于 model_hi，与 tuple(sorted(...)) 一致
+            models = (model_names.name(ann.model_lo), model_names.name(ann.model_hi))
             completed.add((ann.case_id, models))
     except Exception as e:
         print(f"Database error in get_completed_annotations: {e}")
     return completed
 
-# --- 应用启动时加载和计算 ---
-organized_data = load_data()
-all_cases = list(organized_data.keys())
+def submission_score(winners, model_lo, model_hi):
+    """一次判断中 model_lo 的得分：赢得的指标比例，平局算一半"""
+    score = 0.0
+    for label in winners:
+        if label == model_lo:
+            score += 1.0
+        elif label == TIE_LABEL:
+            score += 0.5
+    return score / len(winners)
+
+def load_scheduler_history(campaign_name):
+    """按时间顺序产出某个活动全部已有标注的 (annotator_id, task, model_lo 得分)"""
+    columns = [getattr(Annotation, metric_key) for metric_key in METRIC_KEYS]
+    rows = db.session.query(
+        Annotation.annotator_id, Annotation.case_id, Annotation.model_lo, Annotation.model_hi, *columns
+    ).filter(Annotation.campaign == campaign_name).order_by(Annotation.timestamp.asc(), Annotation.id.asc()).yield_per(5000)
+    for annotator_id, case_id, model_lo, model_hi, *codes in rows:
+        task = (case_id, (model_names.name(model_lo), model_names.name(model_hi)))
+        score = sum(1.0 if code == WINNER_LO else 0.5 if code == WINNER_TIE else 0.0 for code in codes) / len(codes)
+        yield annotator_id, task, score
+
+def make_scheduler(campaign):
+    """在活动首次被访问时创建它的调度器"""
+    options = campaign.scheduler_options
+    mode = options.get('mode', 'static')
+    if mode not in SCHEDULER_MODES:
+        print(f"Warning: Unknown scheduler mode '{mode}' for campaign '{campaign.name}', falling back to 'static'.")
+        mode = 'static'
+    if mode == 'adaptive':
+        return AdaptiveScheduler(
+            campaign.all_pairs, campaign.annotators, partial(load_scheduler_history, campaign.name),
+            overlap_quota=options.get('overlap_quota', 2),
+            overlap_rate=options.get('overlap_rate', 0.25),
+            budget=options.get('budget'),
+        )
+    return StaticScheduler(campaign.all_pairs, campaign.annotators, partial(get_completed_annotations, campaign.name))
+
+def load_campaigns():
+    """按 CAMPAIGNS_CONFIG（或上面的单活动环境变量）创建活动注册表，此时不加载任何语料"""
+    memory_budget = int(float(CORPUS_MEMORY_BUDGET_MB) * 1024 * 1024) if CORPUS_MEMORY_BUDGET_MB else None
+    if CAMPAIGNS_CONFIG:
+        defaults = {
+            'annotators': ANNOTATOR_LIST,
+            'store_mode': DATA_STORE_MODE,
+            'pattern': DEFAULT_PATTERN,
+            'cache_size': DIALOGUE_CACHE_SIZE,
+            'scheduler_options': SCHEDULER_OPTIONS,
+        }
+        return CampaignRegistry.from_config(CAMPAIGNS_CONFIG, defaults, make_scheduler, memory_budget)
+    default_campaign = Campaign(
+        DEFAULT_CAMPAIGN, DATA_DIR, ANNOTATOR_LIST, store_mode=DATA_STORE_MODE,
+        index_path=DIALOGUE_INDEX_PATH, snapshot_path=DIALOGUE_SNAPSHOT_PATH,
+        cache_size=DIALOGUE_CACHE_SIZE, scheduler_options=SCHEDULER_OPTIONS, scores_pattern=AUTO_SCORES_PATTERN,
+    )
+    return CampaignRegistry([default_campaign], make_scheduler, memory_budget)
 
-def calculate_total_pairs(data):
-    """计算数据集中所有可能的对比组合总数"""
-    total = 0
-    for case_id in data:
-        models_in_case = list(data[case_id].keys())
-        if len(models_in_case) >= 2:
-            total += len(models_in_case) * (len(models_in_case) - 1) // 2
-    return total
+# --- 应用启动 ---
+campaigns = load_campaigns()
+# 汇总立方体按病例类别切片，类别取自对应活动的源对话数据（按需加载）
+set_category_resolver(campaigns.category)
 
-TOTAL_PAIRS = calculate_total_pairs(organized_data)
+# 注意：在生产环境中，此命令最好只在初始化时运行一次。
+# 在Render上，可以在Blueprint设置中使用 one-off job 来执行。
+with app.app_context():
+    # 引入标注活动之前的表：补上 campaign 列，汇总表删除后在下面自动重建
+    if upgrade_campaign_schema():
+        print("Upgraded the database schema to campaign namespaces.")
+    if has_legacy_schema():
+        # 旧版 annotation 表：迁移到新结构（旧数据保留在 annotation_legacy 中）
+        migrated, skipped = migrate_legacy_annotations()
+        print(f"Migrated {migrated} legacy annotations ({skipped} skipped).")
+    db.create_all()
+    # create_all 不会为已存在的表补建索引
+    for index in Annotation.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+# 语料规模和待办任务数只统计已经加载过的活动，抓取指标时不会触发语料加载或数据库查询
+metrics.CORPUS_SIZE.set_function(lambda: {
+    (campaign.name, unit): value
+    for campaign in campaigns if campaign.loaded
+    for unit, value in campaign.corpus_size().items()
+})
+metrics.CORPUS_RESIDENT_BYTES.set_function(
+    lambda: {(name,): size for name, size in campaigns.resident_bytes().items()}
+)
+metrics.PENDING_TASKS.set_function(lambda: {
+    (campaign.name, annotator_id): count
+    for campaign in campaigns if campaign.scheduler_if_loaded() is not None
+    for annotator_id, count in campaign.scheduler_if_loaded().pending_counts().items()
+})
+
+def resolve_campaign(name):
+    """按名称返回活动，未指定时为默认活动；未知活动返回 None"""
+    return campaigns.get(name or DEFAULT_CAMPAIGN)
 
 # --- 网页路由 ---
 @app.route('/')
@@ -117,17 +234,8 @@ def index():
     return render_template('index.html')
 
 
-# 这是一个一次性生成的全量任务列表，为了保证分配的稳定性
-# 我们在生成它时对 case_id 和 models 都进行了排序
-ALL_THEORETICAL_PAIRS = []
-for case_id in sorted(all_cases):
-    models_in_case = sorted(list(organized_data.get(case_id, {}).keys()))
-    if len(models_in_case) < 2: continue
-    for i in range(len(models_in_case)):
-        for j in range(i + 1, len(models_in_case)):
-            model1, model2 = models_in_case[i], models_in_case[j]
-            task = (case_id, tuple(sorted((model1, model2))))
-            ALL_THEORETICAL_PAIRS.append(task)
+def unknown_campaign_error(name):
+    return jsonify({"error": f"Unknown campaign '{name}'."}), 404
 
 @app.route('/get_comparison_pair')
 def get_comparison_pair():
@@ -135,91 +243,425 @@ def get_comparison_pair():
     if not annotator_id:
         return jsonify({"error": "Annotator ID is required"}), 400
 
-    if annotator_id not in ANNOTATOR_LIST:
+    campaign = resolve_campaign(request.args.get('campaign'))
+    if campaign is None:
+        return unknown_campaign_error(request.args.get('campaign'))
+    if annotator_id not in campaign.annotators:
         return jsonify({"error": f"Annotator ID '{annotator_id}' is not in the recognized list."}), 400
 
-    # --- 步骤 1: 根据固定规则，计算出分配给当前标注员的全部任务 ---
-    annotator_index = ANNOTATOR_LIST.index(annotator_id)
-    num_annotators = len(ANNOTATOR_LIST)
-    
-    my_assigned_tasks = [
-        task for i, task in enumerate(ALL_THEORETICAL_PAIRS)
-        if i % num_annotators == annotator_index
-    ]
-    # 这是当前用户的个人任务总数
-    my_total_tasks = len(my_assigned_tasks)
-
-    # --- 步骤 2: 从数据库获取当前标注员已完成的任务 ---
-    completed_by_me = get_completed_annotations(annotator_id)
-
-    # --- 步骤 3: 从“分配给我的任务”中，筛选出“待办”的任务 ---
-    # 使用集合(set)运算提高效率
-    my_assigned_tasks_set = set(my_assigned_tasks)
-    my_pending_tasks = list(my_assigned_tasks_set - completed_by_me)
-
-    # --- 步骤 4: 计算正确的个人进度 ---
-    my_completed_count = my_total_tasks - len(my_pending_tasks)
-
-    # --- 步骤 5: 判断个人任务是否已全部完成 ---
-    if not my_pending_tasks:
+    scheduler = campaign.scheduler
+    # --- 步骤 1: 计算个人进度 ---
+    with stage(STAGE_SET_ARITHMETIC):
+        my_completed_count, _, my_total_tasks = scheduler.progress(annotator_id)
+
+    # --- 步骤 2: 由调度器选出下一个任务，若为空则说明已全部完成 ---
+    with stage(STAGE_SET_ARITHMETIC):
+        tasks = scheduler.next_tasks(annotator_id, 1)
+    task = tasks[0] if tasks else None
+    if task is None:
         return jsonify({
             "message": "Congratulations! You have completed all your assigned tasks.",
             "progress_completed": my_completed_count,
             "progress_total": my_total_tasks
         })
-    
-    # --- 步骤 6: 从个人待办任务中随机选择一个并返回 ---
-    case_id, models = random.choice(my_pending_tasks)
+
+    pair = build_pair_payload(campaign, task)
+    # 在返回的json中使用正确的个人进度值
+    pair["progress_completed"] = my_completed_count
+    pair["progress_total"] = my_total_tasks
+    return jsonify(pair)
+
+def build_pair_payload(campaign, task):
+    """把活动中的一个 (case_id, (model1, model2)) 任务组装成前端需要的对比数据"""
+    case_id, models = task
     model_a, model_b = models[0], models[1]
     
     # 随机交换A/B的显示位置
     if random.random() < 0.5:
         model_a, model_b = model_b, model_a
 
-    data_for_case = organized_data.get(case_id, {}).get(model_a, {})
-    pair = {
+    store = campaign.store
+    data_for_case = store.get(case_id, model_a) or {}
+    return {
         "case_id": case_id,
         "category": data_for_case.get('category', 'N/A'),
         "choices": data_for_case.get('choices', 'N/A'),
-        "model_a_info": {"name": model_a, "dialogue": organized_data.get(case_id, {}).get(model_a, {}).get('dialogue', '')},
-        "model_b_info": {"name": model_b, "dialogue": organized_data.get(case_id, {}).get(model_b, {}).get('dialogue', '')}
+        "model_a_info": {"name": model_a, "dialogue_url": dialogue_url(campaign, store, case_id, model_a)},
+        "model_b_info": {"name": model_b, "dialogue_url": dialogue_url(campaign, store, case_id, model_b)}
     }
-    # 在返回的json中使用正确的个人进度值
-    pair["progress_completed"] = my_completed_count
-    pair["progress_total"] = my_total_tasks
-    return jsonify(pair)
 
+# --- 对话片段 ---
+# 同一个 (case_id, model) 的对话会出现在多组对比中，因此对话内容不再内嵌在任务数据里，
+# 而是通过带内容摘要的 URL 单独获取，浏览器可以长期缓存。
+DIALOGUE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+def dialogue_url(campaign, store, case_id, model_name):
+    fragment = store.fragment(case_id, model_name)
+    if fragment is None:
+        return None
+    return url_for(
+        'get_campaign_dialogue', campaign_name=campaign.name, case_id=case_id, model_name=model_name,
+        digest=fragment.digest
+    )
 
+@app.route('/dialogue/<case_id>/<model_name>/<digest>')
+def get_dialogue(case_id, model_name, digest):
+    """引入标注活动之前的链接，对应默认活动"""
+    return get_campaign_dialogue(DEFAULT_CAMPAIGN, case_id, model_name, digest)
+
+@app.route('/dialogue/<campaign_name>/<case_id>/<model_name>/<digest>')
+def get_campaign_dialogue(campaign_name, case_id, model_name, digest):
+    campaign = campaigns.get(campaign_name)
+    fragment = campaign.store.fragment(case_id, model_name) if campaign is not None else None
+    if fragment is None:
+        return "Dialogue not found", 404
+
+    # 选择客户端接受、且质量值最高的已压缩版本（同等时优先 br）
+    encoding = 'identity'
+    for candidate in ('br', 'gzip'):
+        if candidate in fragment.bodies and request.accept_encodings[candidate] > request.accept_encodings[encoding]:
+            encoding = candidate
+
+    response = Response(fragment.bodies[encoding], mimetype='text/html')
+    if encoding != 'identity':
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    # 同一内容的不同压缩版本使用不同的强 ETag
+    response.set_etag(fragment.digest if encoding == 'identity' else f"{fragment.digest}-{encoding}")
+    if digest == fragment.digest:
+        response.headers['Cache-Control'] = DIALOGUE_CACHE_CONTROL
+    else:
+        # 源数据已更新，旧链接仍返回当前内容但不允许长期缓存
+        response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+# --- 批量预取 ---
+# 前端一次取 N 个待办任务放进本地队列；这些任务在 PAIR_RESERVATION_SECONDS 内不会被再次返回，
+# 以免在提交尚未同步到服务器时重复下发。
+PAIR_BATCH_MAX = 20
+PAIR_RESERVATION_SECONDS = 15 * 60
+
+@app.route('/get_comparison_pairs')
+def get_comparison_pairs():
+    annotator_id = request.args.get('annotator_id')
+    if not annotator_id:
+        return jsonify({"error": "Annotator ID is required"}), 400
 
-@app.route('/submit_annotation', methods=['POST'])
-def submit_annotation():
-    data = request.json
+    campaign = resolve_campaign(request.args.get('campaign'))
+    if campaign is None:
+        return unknown_campaign_error(request.args.get('campaign'))
+    if annotator_id not in campaign.annotators:
+        return jsonify({"error": f"Annotator ID '{annotator_id}' is not in the recognized list."}), 400
+
+    try:
+        n = min(max(int(request.args.get('n', 5)), 1), PAIR_BATCH_MAX)
+    except ValueError:
+        return jsonify({"error": "'n' must be an integer"}), 400
+
+    scheduler = campaign.scheduler
+    with stage(STAGE_SET_ARITHMETIC):
+        if request.args.get('reset'):
+            # 页面刚打开时本地队列为空，之前的预留已无意义
+            scheduler.release(annotator_id)
+        tasks = scheduler.next_tasks(annotator_id, n, PAIR_RESERVATION_SECONDS)
+        completed, pending, total = scheduler.progress(annotator_id)
+    return jsonify({
+        "pairs": [build_pair_payload(campaign, task) for task in tasks],
+        "pending": pending,
+        "progress_completed": completed,
+        "progress_total": total
+    })
+
+
+def encode_submission(data):
+    """
+    把一次提交编码为 Annotation 的列值；缺字段返回 None，活动未知、两个模型相同或胜者标签无效时抛出 ValueError。
+    未指定 campaign 的提交属于默认活动。
+    """
     required_fields = ['annotator_id', 'case_id', 'model_a', 'model_b', 'winners']
     if not all(field in data for field in required_fields) or not all(key in data['winners'] for key in ['coherence', 'adherence', 'clarity', 'empathy']):
-        return jsonify({"error": "Missing data"}), 400
-        
-    new_annotation = Annotation(
+        return None
+    campaign_name = data.get('campaign') or DEFAULT_CAMPAIGN
+    if campaigns.get(campaign_name) is None:
+        raise ValueError(f"Unknown campaign '{campaign_name}'")
+    if data['model_a'] == data['model_b']:
+        # 汇总表（及重建）不统计模型与自身的比较
+        raise ValueError(f"model_a and model_b must differ (got '{data['model_a']}' twice)")
+    model_lo, model_hi, a_is_lo = encode_pair(data['model_a'], data['model_b'])
+    values = dict(
+        campaign=campaign_name,
         annotator_id=data['annotator_id'],
-        case_id=data['case_id'],
-        model_a=data['model_a'],
-        model_b=data['model_b'],
-        winner_coherence=data['winners']['coherence'],
-        winner_adherence=data['winners']['adherence'],
-        winner_clarity=data['winners']['clarity'],
-        winner_empathy=data['winners']['empathy'],
+        case_id=str(data['case_id']),
+        model_lo=model_lo,
+        model_hi=model_hi,
+        a_is_lo=a_is_lo,
         timestamp=datetime.now()
     )
+    for metric_key in METRIC_KEYS:
+        label = data['winners'][metric_key.replace('winner_', '')]
+        values[metric_key] = encode_winner(label, data['model_a'], data['model_b'])
+    return values
+
+# 标注的唯一键；同一活动中每个标注员对同一任务只有一行
+ANNOTATION_KEY = ('campaign', 'annotator_id', 'case_id', 'model_lo', 'model_hi')
+# 每条 IN 查询最多带多少个键（SQLite 对单条语句的参数个数有限制）
+ANNOTATION_KEY_CHUNK = 500
+
+def fetch_annotation_rows(keys):
+    """按唯一键批量读取已有标注并加行锁，返回 {键: 列值}"""
+    key_columns = [getattr(Annotation, col) for col in ANNOTATION_KEY]
+    columns = [Annotation.id, *key_columns, Annotation.a_is_lo, *[getattr(Annotation, m) for m in METRIC_KEYS]]
+    keys = sorted(keys)
+    rows = {}
+    for start in range(0, len(keys), ANNOTATION_KEY_CHUNK):
+        stmt = select(*columns).where(tuple_(*key_columns).in_(keys[start:start + ANNOTATION_KEY_CHUNK]))
+        for row in db.session.execute(stmt.order_by(Annotation.id).with_for_update()).mappings():
+            rows[tuple(row[col] for col in ANNOTATION_KEY)] = dict(row)
+    return rows
+
+def insert_annotation_rows(rows):
+    """用一条批量 INSERT 写入新标注，已存在的键跳过；返回实际写入的 {键: id}"""
+    if not rows:
+        return {}
+    insert = dialect_insert(Annotation)
+    if insert is None:
+        annotations = [Annotation(**values) for values in rows]
+        db.session.add_all(annotations)
+        db.session.flush()
+        return {tuple(getattr(a, col) for col in ANNOTATION_KEY): a.id for a in annotations}
+    key_columns = [getattr(Annotation, col) for col in ANNOTATION_KEY]
+    stmt = insert.on_conflict_do_nothing(index_elements=list(ANNOTATION_KEY)).returning(Annotation.id, *key_columns)
+    return {tuple(row[1:]): row[0] for row in db.session.execute(stmt, rows)}
+
+def write_annotations(batch):
+    """
+    在当前事务中写入一组标注（encode_submission 的结果）并同步更新汇总表，返回每条的状态。
+    同一活动中同一标注员对同一任务重复提交时：判断相同则不做任何修改（幂等），否则更新为新的判断；
+    同一组中的重复提交按顺序生效。状态为 'inserted'、'updated' 或 'unchanged'。
+    已有标注、新标注、修改和汇总表增量都按整组批量读写，语句数与组的大小无关。
+    """
+    keys = [tuple(values[col] for col in ANNOTATION_KEY) for values in batch]
+    current = fetch_annotation_rows(set(keys))
+    first_new = {}
+    for key, values in zip(keys, batch):
+        if key not in current and key not in first_new:
+            first_new[key] = values
+    inserted = insert_annotation_rows([first_new[key] for key in sorted(first_new)])
+    missing = first_new.keys() - inserted.keys()
+    if missing:
+        # 并发请求刚刚写入了同一任务
+        current.update(fetch_annotation_rows(missing))
+    for key, annotation_id in inserted.items():
+        current[key] = dict(first_new[key], id=annotation_id)
+
+    statuses, changes, updated = [], [], {}
+    pending_inserts = set(inserted)
+    for key, values in zip(keys, batch):
+        if key in pending_inserts:
+            pending_inserts.discard(key)
+            changes.append((Annotation(**values), 1, True))
+            statuses.append('inserted')
+            continue
+        row = current[key]
+        if all(row[metric_key] == values[metric_key] for metric_key in METRIC_KEYS):
+            statuses.append('unchanged')
+            continue
+        new_row = dict(row, **{col: values[col] for col in ('a_is_lo', 'timestamp', *METRIC_KEYS)})
+        changes.append((Annotation(**row), -1, False))
+        changes.append((Annotation(**new_row), 1, False))
+        current[key] = updated[new_row['id']] = new_row
+        statuses.append('updated')
+
+    if updated:
+        db.session.execute(update(Annotation), [
+            {col: row[col] for col in ('id', 'a_is_lo', 'timestamp', *METRIC_KEYS)}
+            for _, row in sorted(updated.items())
+        ])
+    update_aggregates_batch(changes)
+    return statuses
+
+def commit_annotation_group(batch):
+    """group 模式下写线程的回调：一组（可能来自多个请求的）标注在同一个事务中写入并提交"""
+    with app.app_context():
+        try:
+            statuses = write_annotations(batch)
+            db.session.commit()
+            return statuses
+        except Exception:
+            db.session.rollback()
+            model_names.invalidate()
+            raise
+
+def observe_write(rows, submissions, seconds):
+    metrics.WRITE_BATCH_ROWS.observe(rows, mode=WRITE_MODE)
+    metrics.WRITE_BATCH_SUBMISSIONS.observe(submissions, mode=WRITE_MODE)
+    metrics.WRITE_COMMIT_SECONDS.observe(seconds, mode=WRITE_MODE)
+
+write_queue = GroupCommitQueue(
+    commit_annotation_group, max_rows=WRITE_BATCH_ROWS, max_delay=WRITE_BATCH_DELAY_MS / 1000,
+    max_pending=WRITE_QUEUE_SIZE, on_commit=observe_write,
+) if WRITE_MODE == 'group' else None
+metrics.WRITE_QUEUE_DEPTH.set_function(lambda: write_queue.depth() if write_queue is not None else 0)
+
+def save_annotations(batch):
+    """
+    按 WRITE_MODE 写入并提交一个请求的全部标注（要么全部成功，要么全部失败），返回每条的状态。
+    队列已满时抛出 WriteQueueFull，写线程已停止时抛出 WriterStopped，写入失败时抛出数据库异常。
+    """
+    if write_queue is not None:
+        # encode_submission 可能刚写入新的模型名称：先提交，写线程的事务才能看到它们，也不会与之争抢写锁
+        db.session.commit()
+        return write_queue.submit(batch)
+    start = time.perf_counter()
+    statuses = write_annotations(batch)
+    db.session.commit()
+    observe_write(len(batch), 1, time.perf_counter() - start)
+    return statuses
 
+@app.route('/submit_annotation', methods=['POST'])
+def submit_annotation():
+    data = request.json
     try:
-        db.session.add(new_annotation)
-        db.session.commit()
-        return jsonify({"success": True})
+        values = encode_submission(data)
+    except ValueError as e:
+        db.session.rollback()
+        model_names.invalidate()
+        return jsonify({"error": str(e)}), 400
+    if values is None:
+        return jsonify({"error": "Missing data"}), 400
+
+    try:
+        status, = save_annotations([values])
+        record_submission(data)
+        return jsonify({"success": True, "status": status})
+    except (WriteQueueFull, WriterStopped) as e:
+        print(f"Write queue unavailable: {e}")
+        return write_queue_unavailable_error()
     except Exception as e:
         db.session.rollback()
+        model_names.invalidate()
         print(f"Database error: {e}")
         return jsonify({"error": "Failed to save to database"}), 500
 
+def write_queue_unavailable_error():
+    """写入队列已满或写线程已停止：让客户端稍后重试（前端的离线队列会自动重发）"""
+    response = jsonify({"error": "Submissions are temporarily unavailable, please retry"})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def record_submission(data):
+    """
+    提交成功后通知活动的调度器（static 模式下从待办集合中移除该任务）。
+    调度器尚未创建时不需要通知，创建时会从数据库读到这条标注。
+    """
+    scheduler = resolve_campaign(data.get('campaign')).scheduler_if_loaded()
+    if scheduler is None:
+        return
+    model_lo, model_hi = sorted((data['model_a'], data['model_b']))
+    task = (str(data['case_id']), (model_lo, model_hi))
+    winners = [data['winners'][metric_key.replace('winner_', '')] for metric_key in METRIC_KEYS]
+    with stage(STAGE_SET_ARITHMETIC):
+        scheduler.record(data['annotator_id'], task, submission_score(winners, model_lo, model_hi))
+
+SUBMIT_BATCH_MAX = 200
+
+@app.route('/submit_annotations', methods=['POST'])
+def submit_annotations():
+    """批量提交：所有判断在同一个事务中写入，要么全部成功，要么全部失败。重复提交是幂等的。"""
+    data = request.json or {}
+    items = data.get('annotations')
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "Missing data"}), 400
+    if len(items) > SUBMIT_BATCH_MAX:
+        return jsonify({"error": f"At most {SUBMIT_BATCH_MAX} annotations per batch"}), 400
+
+    encoded = []
+    for i, item in enumerate(items):
+        try:
+            values = encode_submission(item) if isinstance(item, dict) else None
+        except ValueError as e:
+            db.session.rollback()
+            model_names.invalidate()
+            return jsonify({"error": str(e), "index": i}), 400
+        if values is None:
+            db.session.rollback()
+            model_names.invalidate()
+            return jsonify({"error": "Missing data", "index": i}), 400
+        encoded.append(values)
+
+    try:
+        statuses = save_annotations(encoded)
+    except (WriteQueueFull, WriterStopped) as e:
+        print(f"Write queue unavailable: {e}")
+        return write_queue_unavailable_error()
+    except Exception as e:
+        db.session.rollback()
+        model_names.invalidate()
+        print(f"Database error: {e}")
+        return jsonify({"error": "Failed to save to database"}), 500
+
+    for item in items:
+        record_submission(item)
+    return jsonify({
+        "success": True,
+        "results": [
+            {"campaign": item.get('campaign') or DEFAULT_CAMPAIGN, "case_id": str(item['case_id']),
+             "model_a": item['model_a'], "model_b": item['model_b'], "status": status}
+            for item, status in zip(items, statuses)
+        ]
+    })
+
 ADMIN_PASSWORD = "123"
+
+# --- 标注结果分页 ---
+RESULTS_PAGE_SIZE = 50
+RESULTS_MAX_PAGE_SIZE = 500
+
+def encode_results_cursor(annotation):
+    raw = f"{annotation.timestamp.isoformat()}|{annotation.id}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_results_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+    timestamp, annotation_id = raw.rsplit('|', 1)
+    return datetime.fromisoformat(timestamp), int(annotation_id)
+
+def query_results_page(args):
+    """
+    按 (timestamp, id) 倒序做键集分页，返回 (当前页标注列表, 下一页游标或 None)。
+    支持按 campaign、annotator_id、case_id、model（作为 A 或 B 出现）过滤。
+    游标无效或 limit 非整数时抛出 ValueError。
+    """
+    limit = min(max(int(args.get('limit', RESULTS_PAGE_SIZE)), 1), RESULTS_MAX_PAGE_SIZE)
+    stmt = select_annotation_rows()
+    if args.get('campaign'):
+        stmt = stmt.where(Annotation.campaign == args['campaign'])
+    if args.get('annotator_id'):
+        stmt = stmt.where(Annotation.annotator_id == args['annotator_id'])
+    if args.get('case_id'):
+        stmt = stmt.where(Annotation.case_id == args['case_id'])
+    if args.get('model'):
+        model_id = model_names.find(args['model'])
+        stmt = stmt.where(db.or_(Annotation.model_lo == model_id, Annotation.model_hi == model_id))
+    if args.get('cursor'):
+        try:
+            cursor_timestamp, cursor_id = decode_results_cursor(args['cursor'])
+        except ValueError:
+            raise ValueError("Invalid cursor")
+        stmt = stmt.where(db.tuple_(Annotation.timestamp, Annotation.id) < (cursor_timestamp, cursor_id))
+
+    stmt = stmt.order_by(Annotation.timestamp.desc(), Annotation.id.desc()).limit(limit + 1)
+    rows = db.session.execute(stmt).all()
+    next_cursor = encode_results_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def total_annotation_count(campaign=None):
+    """总标注数（可限定某个活动）取自汇总表，避免对 Annotation 全表计数"""
+    query = db.session.query(db.func.coalesce(db.func.sum(AnnotatorTotal.annotations), 0))
+    if campaign:
+        query = query.filter(AnnotatorTotal.campaign == campaign)
+    return query.scalar()
+
 # 数据看板链接：https://medical-dialogue-annotation.onrender.com/results?password=123
 @app.route('/results')
 def view_results():
@@ -228,20 +670,120 @@ def view_results():
         return "<h1>访问被拒绝</h1><p>请提供正确的访问密码。</p>", 403
 
     try:
-        all_annotations = Annotation.query.order_by(Annotation.timestamp.desc()).all()
-        return render_template('results.html', annotations=all_annotations, count=len(all_annotations))
+        annotations, next_cursor = query_results_page(request.args)
+    except ValueError as e:
+        return f"<h1>参数错误</h1><p>{e}</p>", 400
+
+    try:
+        filters = {key: request.args.get(key, '') for key in ('campaign', 'annotator_id', 'case_id', 'model', 'limit')}
+        next_args = {key: value for key, value in filters.items() if value}
+        if next_cursor:
+            next_args.update(password=password, cursor=next_cursor)
+        return render_template(
+            'results.html',
+            annotations=annotations,
+            count=total_annotation_count(filters['campaign']),
+            filters=filters,
+            next_url=url_for('view_results', **next_args) if next_cursor else None,
+            first_url=url_for('view_results', password=password, **{k: v for k, v in filters.items() if v}),
+        )
     except Exception as e:
         print(f"Error fetching results: {e}")
         return "<h1>查询数据时出错</h1><p>请检查服务器日志。</p>", 500
 
+@app.route('/api/results')
+def api_results():
+    """/results 的 JSON 版本，返回一页标注和下一页的游标"""
+    password = request.args.get('password')
+    if password != ADMIN_PASSWORD:
+        return jsonify({"error": "Access denied"}), 403
 
+    try:
+        annotations, next_cursor = query_results_page(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({
+        "annotations": [
+            {col: getattr(ann, col) for col in EXPORT_COLUMNS} | {"timestamp": ann.timestamp.isoformat()}
+            for ann in annotations
+        ],
+        "next_cursor": next_cursor,
+    })
+
+
+@app.route('/api/cube')
+def api_cube():
+    """
+    从某个活动（campaign，默认为默认活动）的汇总立方体返回任意切片的排名：
+    可按 category、annotator_id 过滤，metric 只返回一个指标。
+    不带过滤条件时返回该活动全部数据的排名（同样来自立方体，不含 Elo）。
+    """
+    password = request.args.get('password')
+    if password != ADMIN_PASSWORD:
+        return jsonify({"error": "Access denied"}), 403
+
+    campaign = resolve_campaign(request.args.get('campaign'))
+    if campaign is None:
+        return unknown_campaign_error(request.args.get('campaign'))
+    metric = request.args.get('metric')
+    if metric and f"winner_{metric}" not in METRIC_KEYS:
+        return jsonify({"error": f"Unknown metric '{metric}'"}), 400
+    filters = {key: request.args.get(key) or None for key in ('category', 'annotator_id')}
+    rankings = rankings_from_cube(db.session, campaign.name, **filters)
+    if metric:
+        rankings = {metric: rankings.get(metric, [])}
+    return jsonify({
+        "campaign": campaign.name,
+        "filters": filters,
+        "rankings": rankings,
+        "dimensions": cube_dimensions(db.session, campaign.name),
+    })
+
+
+# Prometheus 抓取配置中可以用 params: {password: [...]} 或 basic_auth 提供密码
+@app.route('/metrics')
+def view_metrics():
+    password = request.args.get('password')
+    if password is None and request.authorization is not None:
+        password = request.authorization.password
+    if password != ADMIN_PASSWORD:
+        return "Access denied\n", 403
+    return Response(metrics.registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.cli.command('rebuild-aggregates')
+def rebuild_aggregates_command():
+    """从原始标注重新生成分析汇总表"""
+    count = rebuild_aggregates()
+    print(f"Rebuilt analytics aggregates from {count} annotations.")
+
+@app.cli.command('migrate-annotations')
+def migrate_annotations_command():
+    """把旧版 annotation 表迁移到新的紧凑结构"""
+    if not has_legacy_schema():
+        print("The annotation table already uses the current schema.")
+        return
+    migrated, skipped = migrate_legacy_annotations()
+    print(f"Migrated {migrated} legacy annotations ({skipped} skipped).")
+
+# 首次部署汇总表（或新增的汇总立方体）时，若已有标注但汇总表为空，则自动从原始数据生成一次
+with app.app_context():
+    try:
+        aggregates_missing = (
+            db.session.query(AnnotatorTotal).first() is None or db.session.query(ResultCube).first() is None
+        )
+        if aggregates_missing and db.session.query(Annotation.id).first() is not None:
+            rebuild_aggregates()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error rebuilding analytics aggregates: {e}")
 
-def get_data_as_dataframe(db_session):
-    """Queries all annotations and returns them as a Pandas DataFrame."""
-    query = db_session.query(Annotation).statement
-    df = pd.read_sql(query, db_session.bind)
-    return df
 
+# 置信区间需要读取全部原始标注，只有在 /analytics?bootstrap=N 时才计算
+ANALYTICS_BOOTSTRAP_MAX = 5000
+# 默认在请求线程内计算，不为每个请求启动进程池；需要时用 BOOTSTRAP_WORKERS 显式开启
+BOOTSTRAP_WORKERS = int(os.environ.get('BOOTSTRAP_WORKERS') or 1)
 
 # https://medical-dialogue-annotation.onrender.com/analytics?password=123
 @app.route('/analytics')
@@ -251,60 +793,192 @@ def view_analytics():
     if password != ADMIN_PASSWORD:
         return "<h1>Access Denied</h1><p>Please provide the correct access password.</p>", 403
 
-    try:
-        df = get_data_as_dataframe(db.session)
-        
-        if df.empty:
-            return "<h1>No Data</h1><p>There is no annotation data in the database to analyze.</p>"
+    campaign = resolve_campaign(request.args.get('campaign'))
+    if campaign is None:
+        return f"<h1>Unknown Campaign</h1><p>Available campaigns: {', '.join(campaigns.names())}.</p>", 404
 
-        # Calculate rankings and agreement scores
-        rankings = calculate_win_rates_from_df(df)
-        agreement = calculate_kappas_from_df(df)
+    try:
+        # Rankings and agreement are derived from the incrementally maintained
+        # summary tables, so the page never reads the full Annotation table.
+        # 每次只展示一个标注活动；选择了类别或标注员时，排名来自汇总立方体的对应切片（不含 Elo）
+        filters = {key: request.args.get(key, '') for key in ('category', 'annotator_id')}
+        start = time.perf_counter()
+        if any(filters.values()):
+            rankings = rankings_from_cube(db.session, campaign.name, **filters)
+        else:
+            rankings = rankings_from_aggregates(db.session, campaign.name)
+        metrics.ANALYTICS_SECONDS.set(time.perf_counter() - start, part='rankings')
+        if not rankings and not any(filters.values()):
+            return f"<h1>No Data</h1><p>There is no annotation data for campaign '{campaign.name}' to analyze.</p>"
+
+        start = time.perf_counter()
+        agreement = agreement_from_aggregates(db.session, campaign.name)
+        metrics.ANALYTICS_SECONDS.set(time.perf_counter() - start, part='agreement')
+
+        # 标注员两两一致性需要读取全部标注，按需计算
+        pairwise = None
+        if request.args.get('pairwise'):
+            start = time.perf_counter()
+            pairwise = pairwise_agreement_from_db(db.session, campaign.name)
+            metrics.ANALYTICS_SECONDS.set(time.perf_counter() - start, part='pairwise_agreement')
+
+        # 自动评分与人工判断的对照同样需要读取全部标注，按需计算（只适用于配置了评分文件的活动）
+        auto_scores = None
+        if request.args.get('auto') and campaign.scores_pattern:
+            start = time.perf_counter()
+            score_table = campaign.score_table()
+            auto_scores = {
+                'metrics': compare_with_humans(
+                    score_table, get_data_as_dataframe(db.session, campaign.name),
+                    tie_margin=request.args.get('tie_margin', 0.0, type=float)
+                ),
+                'accuracy': accuracy_by_round(score_table),
+            }
+            metrics.ANALYTICS_SECONDS.set(time.perf_counter() - start, part='auto_scores')
+
+        intervals = None
+        replicates = request.args.get('bootstrap', 0, type=int)
+        if replicates > 0 and rankings:
+            unit = request.args.get('unit', 'task')
+            if unit not in BOOTSTRAP_UNITS:
+                unit = 'task'
+            start = time.perf_counter()
+            df = get_data_as_dataframe(db.session, campaign.name)
+            if filters['category']:
+                df = df[df['case_id'].map(partial(case_category, campaign=campaign.name)) == filters['category']]
+            if filters['annotator_id']:
+                df = df[df['annotator_id'] == filters['annotator_id']]
+            intervals = bootstrap_intervals(
+                df, min(replicates, ANALYTICS_BOOTSTRAP_MAX),
+                unit=unit, seed=request.args.get('seed', 0, type=int), workers=BOOTSTRAP_WORKERS
+            )
+            attach_intervals(rankings, agreement, intervals)
+            metrics.ANALYTICS_SECONDS.set(time.perf_counter() - start, part='bootstrap')
         
         return render_template(
             'analytics.html',
             rankings=rankings,
-            agreement=agreement
+            agreement=agreement,
+            pairwise=pairwise,
+            auto_scores=auto_scores,
+            auto_available=bool(campaign.scores_pattern),
+            intervals=intervals,
+            filters={'campaign': campaign.name, **filters},
+            campaign_names=campaigns.names(),
+            dimensions=cube_dimensions(db.session, campaign.name)
         )
     except Exception as e:
         print(f"Error generating analytics page: {e}")
         return "<h1>Error</h1><p>An error occurred while generating analytics.</p>", 500
 
 
-@app.route('/export/csv')
-def export_csv():
+# --- 数据导出 ---
+# 导出以流的方式进行：通过服务端游标按 EXPORT_CHUNK_SIZE 行分批读取，逐批编码后发送，
+# 内存占用只与批大小有关，与表的总行数无关。
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', '1000'))
+# Parquet 需要先在临时文件中写完再发送，超过该大小的临时文件会落盘
+EXPORT_SPOOL_BYTES = 8 * 1024 * 1024
+EXPORT_COLUMNS = [
+    'id', 'timestamp', 'campaign', 'annotator_id', 'case_id', 'model_a', 'model_b',
+    'winner_coherence', 'winner_adherence', 'winner_clarity', 'winner_empathy',
+]
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+def iter_export_chunks(since=None, until=None, annotator_id=None, campaign=None):
+    """按时间顺序分批产出待导出的标注行，每批为 dict 列表"""
+    stmt = select_annotation_rows().order_by(Annotation.timestamp.asc(), Annotation.id.asc())
+    if since is not None:
+        stmt = stmt.where(Annotation.timestamp >= since)
+    if until is not None:
+        stmt = stmt.where(Annotation.timestamp < until)
+    if annotator_id:
+        stmt = stmt.where(Annotation.annotator_id == annotator_id)
+    if campaign:
+        stmt = stmt.where(Annotation.campaign == campaign)
+
+    result = db.session.execute(stmt.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+    for partition in result.mappings().partitions():
+        yield [
+            {**row, "timestamp": row["timestamp"].isoformat()}
+            for row in partition
+        ]
+
+def encode_csv(chunks):
+    # utf-8-sig for Excel compatibility
+    yield '\ufeff'.encode('utf-8')
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, lineterminator='\n')
+    writer.writeheader()
+    for chunk in chunks:
+        writer.writerows(chunk)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
+def encode_jsonl(chunks):
+    for chunk in chunks:
+        yield "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in chunk).encode('utf-8')
+
+def encode_parquet(chunks):
+    # 每批写成一个 row group，写完后再分块读出临时文件发送
+    schema = pa.schema([
+        ('id', pa.int64()), ('timestamp', pa.string()),
+        *[(col, pa.string()) for col in EXPORT_COLUMNS[2:]],
+    ])
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES) as spool:
+        with pq.ParquetWriter(spool, schema) as writer:
+            for chunk in chunks:
+                writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+        spool.seek(0)
+        while True:
+            block = spool.read(64 * 1024)
+            if not block:
+                break
+            yield block
+
+def _parse_timestamp_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+@app.route('/export/<fmt>')
+def export_annotations(fmt):
     password = request.args.get('password')
     if not ADMIN_PASSWORD or password != ADMIN_PASSWORD:
         return "<h1>Access Denied</h1>", 403
-    
+
+    if fmt not in EXPORT_FORMATS:
+        return f"<h1>Unsupported export format '{fmt}'</h1><p>Use one of: {', '.join(EXPORT_FORMATS)}.</p>", 400
+    if fmt == 'parquet' and pa is None:
+        return "<h1>Parquet export requires pyarrow</h1>", 501
+
+    try:
+        since = _parse_timestamp_arg('since')
+        until = _parse_timestamp_arg('until')
+    except ValueError:
+        return "<h1>Invalid timestamp</h1><p>'since' and 'until' must be ISO 8601 timestamps.</p>", 400
+
     try:
-        annotations = Annotation.query.order_by(Annotation.timestamp.asc()).all()
-        if not annotations:
+        chunks = iter_export_chunks(since, until, request.args.get('annotator_id'), request.args.get('campaign'))
+        first_chunk = next(chunks, None)
+        if first_chunk is None:
             return "No data to export."
-        data_to_export = [
-            {
-                "id": ann.id,
-                "timestamp": ann.timestamp.isoformat(),
-                "annotator_id": ann.annotator_id,
-                "case_id": ann.case_id,
-                "model_a": ann.model_a,
-                "model_b": ann.model_b,
-                "winner_coherence": ann.winner_coherence,
-                "winner_adherence": ann.winner_adherence,
-                "winner_clarity": ann.winner_clarity,
-                "winner_empathy": ann.winner_empathy,
-            } for ann in annotations
-        ]
-        df = pd.DataFrame(data_to_export)
-        csv_output = df.to_csv(index=False, encoding='utf-8-sig') # utf-8-sig for Excel compatibility
+        chunks = itertools.chain([first_chunk], chunks)
+
+        encoder = {'csv': encode_csv, 'jsonl': encode_jsonl, 'parquet': encode_parquet}[fmt]
         return Response(
-            csv_output,
-            mimetype="text/csv",
+            stream_with_context(encoder(chunks)),
+            mimetype=EXPORT_FORMATS[fmt],
             headers={"Content-disposition":
-                     f"attachment; filename=annotations_{datetime.now().strftime('%Y%m%d')}.csv"}
+                     f"attachment; filename=annotations_{datetime.now().strftime('%Y%m%d')}.{fmt}"}
         )
     except Exception as e:
-        print(f"Error exporting CSV: {e}")
+        print(f"Error exporting {fmt}: {e}")
         return "<h1>Error exporting data</h1>", 500
 
 
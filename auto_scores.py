@@ -0,0 +1,322 @@
+# auto_scores.py
+"""
+Automatic judge scores from data_linlu runs, and how well they agree with humans.
+
+Each run directory holds <model>/DoctorHistory_x_PatientEmotion/detailed_scores.json
+with per-case judge scores for the metrics humans annotate (coherence,
+adherence, clarity, empathy) and the diagnostic accuracy after every round.
+The files are read one at a time and reduced to a long columnar table with
+one row per (model, case, metric, round); the explanations are dropped. The
+table is cached next to the data as .npz and rebuilt when a source file
+changes.
+
+compare_with_humans() joins the table against human pairwise judgments. For
+every judgment the judge scores of model A and model B give an automatic
+verdict (the higher score wins, differences within tie_margin are ties) that
+is compared with the human verdict, per metric and in vectorized form.
+
+    python auto_scores.py data_linlu annotations.jsonl
+"""
+import os
+import json
+import tempfile
+import numpy as np
+import pandas as pd
+from scipy import stats
+from calculate_ranking import TIE_LABEL
+from dialogue_store import list_model_files, source_fingerprint
+
+SCORE_PATTERN = '*/DoctorHistory_x_PatientEmotion/detailed_scores.json'
+# Section of detailed_scores.json -> metrics scored in it (as '<metric>_score')
+SCORE_SECTIONS = {'diag_manage': ('adherence', 'coherence'), 'experience': ('clarity', 'empathy')}
+# Metrics judged both by the automatic scorer and by humans (as winner_<metric>)
+JUDGED_METRICS = ('coherence', 'adherence', 'clarity', 'empathy')
+ACCURACY = 'accuracy'
+# Round of per-case values; accuracy also has one row per incremental round (1, 2, ...)
+FINAL_ROUND = 0
+CACHE_VERSION = 1
+CACHE_FILE = '.auto_scores.npz'
+
+
+def _read_score_file(path):
+    """Returns the (case_id, metric, round, score) rows of one detailed_scores.json."""
+    with open(path, encoding='utf-8') as f:
+        sections = json.load(f)
+    rows = []
+    for section, metrics in SCORE_SECTIONS.items():
+        for record in sections.get(section) or ():
+            for metric in metrics:
+                score = record.get(f'{metric}_score')
+                if score is not None:
+                    rows.append((str(record['case_id']), metric, FINAL_ROUND, float(score)))
+    for record in sections.get('task_success') or ():
+        case_id = str(record['case_id'])
+        if record.get('is_successful') is not None:
+            rows.append((case_id, ACCURACY, FINAL_ROUND, float(record['is_successful'])))
+        for step in record.get('incremental') or ():
+            if step.get('is_successful') is not None:
+                rows.append((case_id, ACCURACY, int(step['round']), float(step['is_successful'])))
+    return rows
+
+
+def build_score_table(model_files):
+    """
+    Reduces [(model, path), ...] to a DataFrame with the columns model, case_id,
+    metric (categoricals), round (int16) and score (float32). A value given
+    twice for the same key keeps the last one.
+    """
+    frames = []
+    for model, path in model_files:
+        try:
+            rows = _read_score_file(path)
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"Warning: Skipping score file '{path}': {e}")
+            continue
+        frame = pd.DataFrame(rows, columns=['case_id', 'metric', 'round', 'score'])
+        frame.insert(0, 'model', model)
+        frames.append(frame)
+    if not frames:
+        table = pd.DataFrame({'model': [], 'case_id': [], 'metric': [], 'round': [], 'score': []})
+    else:
+        table = pd.concat(frames, ignore_index=True)
+        table = table.drop_duplicates(['model', 'case_id', 'metric', 'round'], keep='last')
+    return pd.DataFrame({
+        'model': pd.Categorical(table['model'].astype(str)),
+        'case_id': pd.Categorical(table['case_id'].astype(str)),
+        'metric': pd.Categorical(table['metric'].astype(str)),
+        'round': table['round'].to_numpy(dtype=np.int16),
+        'score': table['score'].to_numpy(dtype=np.float32),
+    })
+
+
+def _save_cache(table, cache_path, fingerprint):
+    arrays = {'fingerprint': np.array(fingerprint)}
+    for column in ('model', 'case_id', 'metric'):
+        arrays[f'{column}_codes'] = table[column].cat.codes.to_numpy()
+        arrays[f'{column}_values'] = np.array(table[column].cat.categories, dtype=str)
+    arrays['round'] = table['round'].to_numpy()
+    arrays['score'] = table['score'].to_numpy()
+    directory = os.path.dirname(os.path.abspath(cache_path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.auto_scores.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Warning: Could not write score cache '{cache_path}': {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _load_cache(cache_path, fingerprint):
+    """Returns the cached table, or None when it is missing, unreadable or stale."""
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with np.load(cache_path) as cached:
+            if str(cached['fingerprint']) != fingerprint:
+                return None
+            columns = {
+                column: pd.Categorical.from_codes(cached[f'{column}_codes'], cached[f'{column}_values'].astype(str))
+                for column in ('model', 'case_id', 'metric')
+            }
+            return pd.DataFrame({**columns, 'round': cached['round'], 'score': cached['score']})
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Warning: Ignoring unreadable score cache '{cache_path}': {e}")
+        return None
+
+
+def load_score_table(data_dir, pattern=SCORE_PATTERN, cache_path=None):
+    """
+    The score table of every file matching pattern below data_dir (the model
+    name is the first directory component). cache_path defaults to
+    <data_dir>/.auto_scores.npz; pass False to skip the cache.
+    """
+    model_files = list_model_files(data_dir, pattern) if os.path.isdir(data_dir) else []
+    if cache_path is None:
+        cache_path = os.path.join(data_dir, CACHE_FILE)
+    fingerprint = json.dumps([CACHE_VERSION, pattern, source_fingerprint(model_files, data_dir)])
+    if cache_path:
+        table = _load_cache(cache_path, fingerprint)
+        if table is not None:
+            return table
+    table = build_score_table(model_files)
+    if cache_path and model_files:
+        _save_cache(table, cache_path, fingerprint)
+    return table
+
+
+def accuracy_by_round(table):
+    """
+    {model: [accuracy after round 1, 2, ...]}. A dialogue that ended early keeps
+    its last diagnosis for the remaining rounds.
+    """
+    rounds = table[(table['metric'] == ACCURACY) & (table['round'] > FINAL_ROUND)]
+    if rounds.empty:
+        return {}
+    success = rounds.pivot_table(index=['model', 'case_id'], columns='round', values='score',
+                                 aggfunc='last', observed=True)
+    success = success.ffill(axis=1)
+    curve = success.groupby(level='model', observed=True).mean()
+    return {str(model): [float(v) for v in values] for model, values in zip(curve.index, curve.to_numpy())}
+
+
+def _nan_to_none(value):
+    return None if value is None or np.isnan(value) else float(value)
+
+
+def _correlation(x, y):
+    """(Spearman, Pearson) of two arrays, NaN when either is constant or too short."""
+    if len(x) < 3 or np.ptp(x) == 0 or np.ptp(y) == 0:
+        return float('nan'), float('nan')
+    return stats.spearmanr(x, y)[0], stats.pearsonr(x, y)[0]
+
+
+def verdict_agreement(human, auto, diff):
+    """
+    Agreement of automatic and human verdicts (+1 = model A, -1 = model B, 0 = tie).
+    diff is the automatic score of A minus that of B, correlated with the human verdict.
+    """
+    n = len(human)
+    confusion = np.bincount((human + 1) * 3 + (auto + 1), minlength=9).reshape(3, 3)
+    decisive = (human != 0) & (auto != 0)
+    result = {
+        'n': int(n),
+        'agreement': float('nan'),
+        'kappa': float('nan'),
+        'decisive_n': int(decisive.sum()),
+        'decisive_agreement': float(np.mean(human[decisive] == auto[decisive])) if decisive.any() else float('nan'),
+        'auto_tie_rate': float(np.mean(auto == 0)) if n else float('nan'),
+        'human_tie_rate': float(np.mean(human == 0)) if n else float('nan'),
+        # Rows: human verdict B / tie / A; columns: automatic verdict B / tie / A
+        'confusion': confusion.tolist(),
+    }
+    if n:
+        p_observed = np.trace(confusion) / n
+        p_expected = (confusion.sum(axis=1) @ confusion.sum(axis=0)) / (n * n)
+        result['agreement'] = float(p_observed)
+        if p_expected < 1 - 1e-12:
+            result['kappa'] = float((p_observed - p_expected) / (1 - p_expected))
+    result['spearman'], result['pearson'] = _correlation(diff, human.astype(float))
+    return result
+
+
+def _human_win_rates(model_a, model_b, human, models):
+    """Per-model human win rate (ties count half) over the joined judgments."""
+    index = {m: i for i, m in enumerate(models)}
+    a = np.array([index[m] for m in model_a], dtype=np.int64)
+    b = np.array([index[m] for m in model_b], dtype=np.int64)
+    score_a = (human + 1) / 2.0
+    points = np.bincount(a, weights=score_a, minlength=len(models)) + np.bincount(b, weights=1 - score_a, minlength=len(models))
+    games = np.bincount(a, minlength=len(models)) + np.bincount(b, minlength=len(models))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return points / games
+
+
+def compare_with_humans(table, df, tie_margin=0.0):
+    """
+    Joins the score table with human judgments (a DataFrame with case_id,
+    model_a, model_b and winner_<metric> columns holding model names or 'tie').
+    Judgments whose two dialogues both have a judge score are compared; for
+    each metric the result also correlates the models' mean judge score with
+    their human win rate on the joined judgments.
+    """
+    final = table[table['round'] == FINAL_ROUND]
+    case_ids = df['case_id'].astype(str).to_numpy()
+    model_a = df['model_a'].astype(str).to_numpy()
+    model_b = df['model_b'].astype(str).to_numpy()
+    results = {}
+    for metric in JUDGED_METRICS:
+        column = f'winner_{metric}'
+        scored = final[final['metric'] == metric]
+        if column not in df.columns or scored.empty:
+            continue
+        lookup = pd.Series(
+            scored['score'].to_numpy(dtype=np.float64),
+            index=pd.MultiIndex.from_arrays([scored['model'].astype(str), scored['case_id'].astype(str)]),
+        )
+        score_a = lookup.reindex(pd.MultiIndex.from_arrays([model_a, case_ids])).to_numpy()
+        score_b = lookup.reindex(pd.MultiIndex.from_arrays([model_b, case_ids])).to_numpy()
+        winner = df[column].astype(str).to_numpy()
+        known = (winner == model_a) | (winner == model_b) | (winner == TIE_LABEL)
+        valid = known & ~np.isnan(score_a) & ~np.isnan(score_b) & (model_a != model_b)
+
+        human = np.select([winner == model_a, winner == model_b], [1, -1], 0)[valid]
+        diff = (score_a - score_b)[valid]
+        auto = np.where(diff > tie_margin, 1, np.where(diff < -tie_margin, -1, 0))
+        result = verdict_agreement(human, auto, diff)
+        result['unmatched'] = int((known & ~valid).sum())
+
+        models = sorted(set(model_a[valid]) | set(model_b[valid]))
+        mean_scores = scored.groupby('model', observed=True)['score'].mean()
+        mean_scores.index = mean_scores.index.astype(str)
+        human_rates = _human_win_rates(model_a[valid], model_b[valid], human, models)
+        auto_means = mean_scores.reindex(models).to_numpy(dtype=np.float64)
+        keep = ~np.isnan(human_rates) & ~np.isnan(auto_means)
+        result['models'] = [
+            {'model': m, 'auto_mean': float(auto_means[i]), 'human_win_rate': _nan_to_none(human_rates[i])}
+            for i, m in enumerate(models)
+        ]
+        result['model_spearman'] = _correlation(auto_means[keep], human_rates[keep])[0]
+
+        for key in ('agreement', 'kappa', 'decisive_agreement', 'auto_tie_rate', 'human_tie_rate',
+                    'spearman', 'pearson', 'model_spearman'):
+            result[key] = _nan_to_none(result[key])
+        results[metric] = result
+    return results
+
+
+def display_comparison(comparison, curve=None):
+    """Prints the judge / human comparison (and the accuracy curve when given)."""
+    def fmt(value, spec):
+        return format(value, spec) if value is not None else '-'
+
+    print("\n--- Automatic Judge vs Human Judgments ---")
+    if not comparison:
+        print("No human judgment could be matched with automatic scores.")
+    else:
+        header = f"{'Metric':<12}{'Pairs':<8}{'Agree':<9}{'Kappa':<9}{'Decisive':<11}{'Spearman':<10}{'Pearson':<9}{'Model ρ':<9}{'Unmatched':<10}"
+        print(header)
+        print("-" * len(header))
+        for metric, r in comparison.items():
+            print(f"{metric:<12}{r['n']:<8}{fmt(r['agreement'], '.1%'):<9}{fmt(r['kappa'], '.3f'):<9}"
+                  f"{fmt(r['decisive_agreement'], '.1%'):<11}{fmt(r['spearman'], '.3f'):<10}"
+                  f"{fmt(r['pearson'], '.3f'):<9}{fmt(r['model_spearman'], '.3f'):<9}{r['unmatched']:<10}")
+    if curve:
+        n_rounds = max(len(values) for values in curve.values())
+        print("\n--- Diagnostic Accuracy by Round ---")
+        header = f"{'Model':<20}" + "".join(f"{f'R{r + 1}':<7}" for r in range(n_rounds))
+        print(header)
+        print("-" * len(header))
+        for model, values in sorted(curve.items()):
+            print(f"{model:<20}" + "".join(f"{v:<7.0%}" for v in values))
+
+
+if __name__ == '__main__':
+    import argparse
+    from annotation_stream import expand_inputs, read_chunks, DEFAULT_CHUNK_ROWS
+    parser = argparse.ArgumentParser(description="Compare automatic judge scores with human pairwise judgments.")
+    parser.add_argument('data_dir', help="directory with <model>/.../detailed_scores.json files")
+    parser.add_argument('inputs', nargs='*', help="annotation files or globs (.jsonl / .csv / .parquet / .json)")
+    parser.add_argument('--pattern', default=SCORE_PATTERN, help="score file glob relative to data_dir")
+    parser.add_argument('--cache', default=None, help="score cache path (default <data_dir>/.auto_scores.npz)")
+    parser.add_argument('--no-cache', action='store_true', help="always re-read the score files")
+    parser.add_argument('--tie-margin', type=float, default=0.0,
+                        help="score differences up to this value count as an automatic tie")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_ROWS, help="rows per chunk when reading annotations")
+    args = parser.parse_args()
+
+    score_table = load_score_table(args.data_dir, args.pattern, False if args.no_cache else args.cache)
+    print(f"Loaded {len(score_table)} automatic scores for {score_table['model'].nunique()} model(s) "
+          f"and {score_table['case_id'].nunique()} case(s).")
+    columns = ['case_id', 'model_a', 'model_b', *(f'winner_{metric}' for metric in JUDGED_METRICS)]
+    # Only the columns needed for the join are kept from each chunk
+    frames = [
+        chunk[[c for c in columns if c in chunk.columns]]
+        for path in expand_inputs(args.inputs)
+        for chunk in read_chunks(path, args.chunk_size)
+    ]
+    human_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+    print(f"Loaded {len(human_df)} human judgments.")
+    display_comparison(compare_with_humans(score_table, human_df, args.tie_margin), accuracy_by_round(score_table))
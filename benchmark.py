@@ -0,0 +1,310 @@
+# benchmark.py
+"""
+合成负载基准测试：按给定规模生成对话语料和标注表，在本地 SQLite 上运行 Flask 应用，
+输出 JSON 格式的结果，便于比较改动前后的性能。
+
+    python benchmark.py --cases 2000 --models 8 --annotators 12 --annotations 20000 --output before.json
+
+报告内容：
+  - 应用启动（import app，语料在首次访问时才加载）耗时与 RSS，以及单独打开一次语料的耗时与 RSS 增量；
+  - /get_comparison_pair、/submit_annotation、/analytics、/export/csv 的 p50/p99 延迟；
+  - calculate_win_rates_from_df、calculate_agreements_from_df、calculate_pairwise_agreements_from_df 单独运行的耗时；
+  - 活动后期 AdaptiveScheduler 的 progress / next_tasks 耗时（所有任务都已判断过一次，大部分出自同一个标注员）。
+应用在导入时读取配置，所以每次运行只测一组规模；语料和数据库写在临时目录中，结束后删除。
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+
+CATEGORIES = ['普通外科', '心内科', '儿科', '神经内科', '皮肤科', '内分泌科']
+
+
+def rss_mb():
+    """当前进程的常驻内存（MB）"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    # 不支持 /proc 时退回峰值 RSS（Linux 单位为 KB，macOS 为字节）
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def summarize(samples):
+    """把一组耗时（秒）汇总为毫秒级的 p50/p99/mean/max"""
+    ms = np.asarray(samples, dtype=float) * 1000
+    if ms.size == 0:
+        return {"n": 0}
+    return {
+        "n": int(ms.size),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean()),
+        "max_ms": float(ms.max()),
+    }
+
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def generate_corpus(data_dir, n_cases, n_models, turns, rng):
+    """每个模型写一个 jsonl 文件，每个文件包含全部 case 的一条对话记录"""
+    os.makedirs(data_dir, exist_ok=True)
+    models = [f"model_{i:02d}" for i in range(n_models)]
+    for model in models:
+        with open(os.path.join(data_dir, f"{model}.jsonl"), 'w', encoding='utf-8') as f:
+            for case_id in range(n_cases):
+                record = {
+                    "case_id": case_id,
+                    "category": CATEGORIES[case_id % len(CATEGORIES)],
+                    "choices": [f"疾病{j}" for j in range(5)],
+                    "interactions": [
+                        [f"医生第{t}轮提问（{model}，病例{case_id}）" * rng.randint(1, 4),
+                         f"患者第{t}轮回答，病例{case_id}" * rng.randint(1, 4)]
+                        for t in range(turns)
+                    ],
+                }
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return models
+
+
+def seed_annotations(app_module, n_annotations, rng):
+    """从每个标注员分到的任务中随机抽取，批量写入已有标注，并重建汇总表"""
+    from calculate_ranking import METRIC_KEYS
+    from models import db, Annotation, encode_pair, encode_winner
+    from aggregates import rebuild_aggregates
+    from task_index import build_annotator_task_index
+
+    campaign = app_module.resolve_campaign(None)
+    assigned = build_annotator_task_index(campaign.all_pairs, campaign.annotators)
+    per_annotator = {a: list(tasks) for a, tasks in assigned.items()}
+    for tasks in per_annotator.values():
+        rng.shuffle(tasks)
+    start = datetime(2025, 1, 1)
+    rows = []
+    annotators = [a for a in per_annotator if per_annotator[a]]
+    while len(rows) < n_annotations and annotators:
+        annotator_id = annotators[len(rows) % len(annotators)]
+        case_id, (model_a, model_b) = per_annotator[annotator_id].pop()
+        if not per_annotator[annotator_id]:
+            annotators.remove(annotator_id)
+        if rng.random() < 0.5:
+            model_a, model_b = model_b, model_a
+        model_lo, model_hi, a_is_lo = encode_pair(model_a, model_b)
+        row = dict(
+            annotator_id=annotator_id, case_id=case_id,
+            model_lo=model_lo, model_hi=model_hi, a_is_lo=a_is_lo,
+            timestamp=start + timedelta(seconds=len(rows)),
+        )
+        for metric_key in METRIC_KEYS:
+            row[metric_key] = encode_winner(rng.choice((model_a, model_b, 'tie')), model_a, model_b)
+        rows.append(row)
+    db.session.bulk_insert_mappings(Annotation, rows)
+    db.session.commit()
+    rebuild_aggregates()
+    return len(rows)
+
+
+def scheduler_late_campaign(n_cases, n_models, n_annotators, repeat, rng):
+    """
+    活动后期的调度器状态：全新任务已经用完，每个任务都被判断过一次，其中 90% 出自第一个标注员，
+    该标注员只能拿到别人判断过的重叠任务。直接构造 AdaptiveScheduler，不经过 Flask 和数据库。
+    """
+    from scheduler import AdaptiveScheduler
+    from campaigns import build_theoretical_pairs
+
+    models = [f"model_{i:02d}" for i in range(n_models)]
+    all_pairs = build_theoretical_pairs({str(case_id): models for case_id in range(n_cases)})
+    annotators = [f"annotator_{i:02d}" for i in range(n_annotators)]
+    history = [
+        (annotators[0] if rng.random() < 0.9 else annotators[1 + rng.randrange(n_annotators - 1)], task, rng.random())
+        for task in all_pairs
+    ]
+    scheduler = AdaptiveScheduler(all_pairs, annotators, lambda: iter(history), budget=len(all_pairs))
+    start = time.perf_counter()
+    scheduler.progress(annotators[0])
+    load_seconds = time.perf_counter() - start
+
+    def next_tasks():
+        scheduler.next_tasks(annotators[0], 5, ttl=600)
+        scheduler.release(annotators[0])
+
+    return {
+        "tasks": len(all_pairs),
+        "load_history_seconds": load_seconds,
+        "progress": summarize(timed(lambda: scheduler.progress(annotators[0]), repeat)),
+        "next_tasks": summarize(timed(next_tasks, repeat)),
+    }
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    work_dir = tempfile.mkdtemp(prefix='annotation-bench-')
+    try:
+        data_dir = os.path.join(work_dir, 'data')
+        gen_start = time.perf_counter()
+        generate_corpus(data_dir, args.cases, args.models, args.turns, rng)
+        corpus_seconds = time.perf_counter() - gen_start
+
+        annotators = [f"annotator_{i:02d}" for i in range(args.annotators)]
+        os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(work_dir, 'bench.db')}"
+        os.environ['DATA_DIR'] = data_dir
+        os.environ['DATA_STORE_MODE'] = args.store
+        os.environ['DIALOGUE_INDEX_PATH'] = os.path.join(work_dir, 'dialogue_index.json')
+        os.environ['DIALOGUE_SNAPSHOT_PATH'] = os.path.join(work_dir, 'dialogue_snapshot.bin')
+        os.environ['ANNOTATORS'] = ','.join(annotators)
+        os.environ['SCHEDULER_MODE'] = args.scheduler
+
+        rss_before = rss_mb()
+        start = time.perf_counter()
+        import app as app_module
+        startup_seconds = time.perf_counter() - start
+        rss_after_startup = rss_mb()
+
+        start = time.perf_counter()
+        store = app_module.resolve_campaign(None).open_store()
+        load_data_seconds = time.perf_counter() - start
+        load_data_rss_delta = rss_mb() - rss_after_startup
+        del store
+
+        flask_app = app_module.app
+        client = flask_app.test_client()
+        with flask_app.app_context():
+            start = time.perf_counter()
+            seeded = seed_annotations(app_module, args.annotations, rng)
+            seed_seconds = time.perf_counter() - start
+
+        # /get_comparison_pair 与 /submit_annotation：轮流为各标注员取一组并提交
+        pair_samples, submit_samples = [], []
+        for i in range(args.requests):
+            annotator_id = annotators[i % len(annotators)]
+            start = time.perf_counter()
+            pair = client.get(f'/get_comparison_pair?annotator_id={annotator_id}').get_json()
+            pair_samples.append(time.perf_counter() - start)
+            if 'case_id' not in pair:
+                continue
+            model_a, model_b = pair['model_a_info']['name'], pair['model_b_info']['name']
+            payload = {
+                "annotator_id": annotator_id,
+                "case_id": pair['case_id'],
+                "model_a": model_a,
+                "model_b": model_b,
+                "winners": {m: rng.choice((model_a, model_b, 'tie')) for m in ['coherence', 'adherence', 'clarity', 'empathy']},
+            }
+            start = time.perf_counter()
+            response = client.post('/submit_annotation', json=payload)
+            submit_samples.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(f"/submit_annotation failed: {response.get_json()}")
+
+        def get_report(path):
+            response = client.get(f'{path}?password={app_module.ADMIN_PASSWORD}')
+            if response.status_code != 200:
+                raise RuntimeError(f"{path} failed with status {response.status_code}")
+            return response.get_data()
+
+        analytics_samples = timed(lambda: get_report('/analytics'), args.report_requests)
+        export_samples = timed(lambda: get_report('/export/csv'), args.report_requests)
+
+        from calculate_ranking import calculate_win_rates_from_df
+        from calculate_agreement import calculate_agreements_from_df, calculate_pairwise_agreements_from_df
+        from aggregates import get_data_as_dataframe
+        from models import db
+        with flask_app.app_context():
+            df = get_data_as_dataframe(db.session)
+        ranking_samples = timed(lambda: calculate_win_rates_from_df(df), args.report_requests)
+        agreement_samples = timed(lambda: calculate_agreements_from_df(df), args.report_requests)
+        pairwise_samples = timed(lambda: calculate_pairwise_agreements_from_df(df), args.report_requests)
+        late_campaign = scheduler_late_campaign(
+            args.late_cases, args.late_models, max(args.annotators, 2), args.requests, rng
+        ) if args.late_cases else None
+
+        return {
+            "config": vars(args),
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "timestamp": datetime.now().isoformat(timespec='seconds'),
+            },
+            "dataset": {
+                "cases": len(app_module.resolve_campaign(None).case_models),
+                "theoretical_pairs": len(app_module.resolve_campaign(None).all_pairs),
+                "seeded_annotations": seeded,
+                "dataframe_rows": len(df),
+                "corpus_bytes": sum(os.path.getsize(os.path.join(data_dir, f)) for f in os.listdir(data_dir)),
+                "corpus_seconds": corpus_seconds,
+                "seed_seconds": seed_seconds,
+            },
+            "startup": {
+                "import_app_seconds": startup_seconds,
+                "rss_before_mb": rss_before,
+                "rss_after_startup_mb": rss_after_startup,
+                "load_data_seconds": load_data_seconds,
+                "load_data_rss_delta_mb": load_data_rss_delta,
+            },
+            "endpoints": {
+                "get_comparison_pair": summarize(pair_samples),
+                "submit_annotation": summarize(submit_samples),
+                "analytics": summarize(analytics_samples),
+                "export_csv": summarize(export_samples),
+            },
+            "functions": {
+                "calculate_win_rates_from_df": summarize(ranking_samples),
+                "calculate_agreements_from_df": summarize(agreement_samples),
+                "calculate_pairwise_agreements_from_df": summarize(pairwise_samples),
+            },
+            "scheduler_late_campaign": late_campaign,
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Synthetic-load benchmark for the annotation app.")
+    parser.add_argument('--cases', type=int, default=500, help="number of cases in the synthetic corpus")
+    parser.add_argument('--models', type=int, default=5, help="number of model files")
+    parser.add_argument('--annotators', type=int, default=6, help="number of annotators")
+    parser.add_argument('--annotations', type=int, default=2000, help="annotations seeded before timing")
+    parser.add_argument('--turns', type=int, default=8, help="dialogue turns per record")
+    parser.add_argument('--requests', type=int, default=200, help="pair/submit round trips to time")
+    parser.add_argument('--report-requests', type=int, default=10,
+                        help="repetitions for /analytics, /export/csv and the standalone calculations")
+    parser.add_argument('--store', choices=['eager', 'lazy', 'snapshot'], default='eager', help="DATA_STORE_MODE to benchmark")
+    parser.add_argument('--scheduler', choices=['static', 'adaptive'], default='static', help="SCHEDULER_MODE to benchmark")
+    parser.add_argument('--late-cases', type=int, default=20000,
+                        help="cases of the late-campaign AdaptiveScheduler case (0 skips it)")
+    parser.add_argument('--late-models', type=int, default=5, help="models of the late-campaign scheduler case")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    report = run(args)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
+        print(f"Benchmark report written to '{args.output}'.")
+    else:
+        print(text)
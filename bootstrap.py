@@ -0,0 +1,286 @@
+# bootstrap.py
+"""
+Bootstrap confidence intervals for the leaderboards (win rate, Bradley-Terry
+strength) and the agreement scores (Fleiss' kappa, Krippendorff's alpha).
+
+Resampling is done over tasks (case + model pair) or over annotators. Every
+replicate is expressed as a vector of unit weights, so the statistics of a
+whole chunk of replicates are computed with a few matrix products instead of
+rebuilding a DataFrame per replicate. Chunks are spread over a process pool;
+each chunk draws from its own child of one SeedSequence, so results depend on
+the seed but not on the number of workers.
+"""
+import os
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from calculate_ranking import METRIC_KEYS, encode_pairs, outcome_codes, fit_bradley_terry
+from calculate_agreement import build_task_ids
+
+BOOTSTRAP_UNITS = ('task', 'annotator')
+DEFAULT_REPLICATES = 1000
+DEFAULT_CONFIDENCE = 0.95
+# Replicates per chunk; chunks are the unit of work handed to the pool
+CHUNK_REPLICATES = 100
+
+
+def _unit_indicator(unit_codes, flat_index, n_units, n_cols, mask):
+    """Sparse (n_units x n_cols) matrix counting the rows selected by mask."""
+    return sparse.csr_matrix(
+        (np.ones(int(mask.sum())), (unit_codes[mask], flat_index[mask])), shape=(n_units, n_cols)
+    )
+
+
+def prepare_bootstrap(df, unit='task'):
+    """
+    Reduces an annotation DataFrame to per-unit sufficient statistics.
+    Returns a plain dict that is cheap to send to worker processes.
+    """
+    if unit not in BOOTSTRAP_UNITS:
+        raise ValueError(f"unit must be one of {BOOTSTRAP_UNITS}, got '{unit}'")
+
+    task_ids = build_task_ids(df).to_numpy()
+    annotator_ids = df['annotator_id'].astype(str).to_numpy()
+    unit_codes, units = pd.factorize(task_ids if unit == 'task' else annotator_ids)
+    n_units = len(units)
+    task_codes, tasks = pd.factorize(task_ids)
+    annotator_codes = pd.factorize(annotator_ids)[0]
+
+    models, a_idx, b_idx = encode_pairs(df)
+    n = len(models)
+
+    problem = {'unit': unit, 'n_units': n_units, 'models': list(models), 'rankings': {}, 'agreement': {}}
+    for metric_key in METRIC_KEYS:
+        if metric_key not in df.columns:
+            continue
+        outcome = outcome_codes(df, metric_key)
+        winner = np.where(outcome == 1, a_idx, b_idx)
+        loser = np.where(outcome == 1, b_idx, a_idx)
+        problem['rankings'][metric_key] = {
+            'wins': _unit_indicator(unit_codes, winner * n + loser, n_units, n * n, np.abs(outcome) == 1),
+            'ties': (_unit_indicator(unit_codes, a_idx * n + b_idx, n_units, n * n, outcome == 0)
+                     + _unit_indicator(unit_codes, b_idx * n + a_idx, n_units, n * n, outcome == 0)),
+        }
+
+        valid = df[metric_key].notna().to_numpy() & df['annotator_id'].notna().to_numpy()
+        label_codes, categories = pd.factorize(df[metric_key].to_numpy()[valid], sort=True)
+        t, a = task_codes[valid], annotator_codes[valid]
+        # Only the first label of each annotator on a task counts towards alpha
+        first = ~pd.DataFrame({'t': t, 'a': a}).duplicated().to_numpy()
+        n_cats = len(categories)
+        if unit == 'task':
+            # Rows are tasks; a replicate weights each task by how often it was drawn
+            flat = t * n_cats + label_codes
+            size = len(tasks) * n_cats
+            counts = np.bincount(flat, minlength=size).reshape(len(tasks), n_cats)
+            rater_counts = np.bincount(flat[first], minlength=size).reshape(len(tasks), n_cats)
+            task_unit = pd.Index(units).get_indexer(tasks)
+            problem['agreement'][metric_key] = {
+                'counts': counts, 'rater_counts': rater_counts, 'task_unit': task_unit,
+            }
+        else:
+            # Rows are annotators; a replicate keeps the annotators that were drawn at least once
+            # (an annotator counted twice on one task would trivially agree with themselves)
+            flat = t * n_cats + label_codes
+            a_unit = unit_codes[valid]
+            ones = np.ones(len(flat))
+            shape = (n_units, len(tasks) * n_cats)
+            problem['agreement'][metric_key] = {
+                'counts': sparse.csr_matrix((ones, (a_unit, flat)), shape=shape),
+                'rater_counts': sparse.csr_matrix((ones[first], (a_unit[first], flat[first])), shape=shape),
+                'n_tasks': len(tasks), 'n_cats': n_cats,
+            }
+    return problem
+
+
+def _fleiss_from_totals(rated, agreement, category_totals):
+    """Fleiss' kappa from the weighted number of rated tasks, their summed agreement and per-category ratings."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p_mean = agreement / rated
+        p_cat = category_totals / category_totals.sum(axis=-1, keepdims=True)
+        p_exp = (p_cat * p_cat).sum(axis=-1)
+        return (p_mean - p_exp) / (1.0 - p_exp)
+
+
+def _alpha_from_coincidences(coincidences):
+    """Nominal Krippendorff's alpha from a batch of (C x C) coincidence matrices."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        n_c = coincidences.sum(axis=-1)
+        total = n_c.sum(axis=-1)
+        observed = coincidences.sum(axis=(-2, -1)) - np.trace(coincidences, axis1=-2, axis2=-1)
+        expected = total * total - (n_c * n_c).sum(axis=-1)
+        return 1 - (observed / expected) * (total - 1)
+
+
+def _task_agreement(counts):
+    """Per-task agreement and whether the task has at least two ratings, for (..., T, C) counts."""
+    n_i = counts.sum(axis=-1)
+    rated = n_i >= 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        p_rat = np.where(rated, ((counts * counts).sum(axis=-1) - n_i) / (n_i * (n_i - 1.0)), 0.0)
+    return rated, p_rat
+
+
+def weighted_fleiss_kappa(counts, weights):
+    """
+    Fleiss' kappa of one (tasks x categories) count matrix under a batch of
+    task weights, counts (T, C) and weights (R, T). Tasks with fewer than two
+    ratings are ignored. Per-task agreement uses each task's own number of
+    ratings, which equals statsmodels' fleiss_kappa when that number is constant.
+    """
+    rated, p_rat = _task_agreement(counts)
+    totals = weights @ np.column_stack([rated, p_rat])
+    return _fleiss_from_totals(totals[:, 0], totals[:, 1], weights @ (counts * rated[:, None]))
+
+
+def weighted_krippendorff_alpha(counts, weights):
+    """Nominal Krippendorff's alpha of one unit count matrix under a batch of unit weights (see weighted_fleiss_kappa)."""
+    n_u = counts.sum(axis=-1)
+    n_cats = counts.shape[-1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = np.where(n_u >= 2, 1.0 / np.where(n_u >= 2, n_u - 1.0, 1.0), 0.0)
+    # Each unit's own coincidences, flattened to (T, C*C) so a replicate is a single weighted sum
+    pairs = scale[:, None, None] * (counts[:, :, None] * counts[:, None, :] - counts[:, :, None] * np.eye(n_cats))
+    coincidences = weights @ pairs.reshape(len(counts), n_cats * n_cats)
+    return _alpha_from_coincidences(coincidences.reshape(-1, n_cats, n_cats))
+
+
+def batch_fleiss_kappa(counts):
+    """Fleiss' kappa for a batch of unweighted count matrices, counts (R, T, C)."""
+    rated, p_rat = _task_agreement(counts)
+    return _fleiss_from_totals(rated.sum(axis=-1), p_rat.sum(axis=-1), (rated[..., None] * counts).sum(axis=-2))
+
+
+def batch_krippendorff_alpha(counts):
+    """Nominal Krippendorff's alpha for a batch of unweighted unit count matrices, counts (R, T, C)."""
+    n_u = counts.sum(axis=-1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scale = np.where(n_u >= 2, 1.0 / np.where(n_u >= 2, n_u - 1.0, 1.0), 0.0)
+    scaled = scale[..., None] * counts
+    coincidences = np.einsum('rtc,rtk->rck', scaled, counts)
+    coincidences -= np.einsum('rc,ck->rck', scaled.sum(axis=-2), np.eye(counts.shape[-1]))
+    return _alpha_from_coincidences(coincidences)
+
+
+def _replicate_statistics(problem, unit_weights):
+    """Computes every statistic for a chunk of replicates given (R, n_units) weights."""
+    n_models = len(problem['models'])
+    n_rep = unit_weights.shape[0]
+    results = {}
+    for metric_key, stats in problem['rankings'].items():
+        wins = np.asarray((stats['wins'].T @ unit_weights.T).T).reshape(n_rep, n_models, n_models)
+        ties = np.asarray((stats['ties'].T @ unit_weights.T).T).reshape(n_rep, n_models, n_models)
+        total_wins, total_losses = wins.sum(axis=2), wins.sum(axis=1)
+        decided = total_wins + total_losses
+        win_rate = np.divide(total_wins, decided, out=np.zeros_like(total_wins), where=decided > 0)
+        results[metric_key] = {'win_rate': win_rate, 'bt_strength': fit_bradley_terry(wins, ties)}
+
+    for metric_key, stats in problem['agreement'].items():
+        if problem['unit'] == 'task':
+            # Every replicate sees the same counts; only the task weights differ
+            weights = unit_weights[:, stats['task_unit']]
+            results[metric_key]['fleiss'] = weighted_fleiss_kappa(stats['counts'], weights)
+            results[metric_key]['krippendorff'] = weighted_krippendorff_alpha(stats['rater_counts'], weights)
+        else:
+            shape = (n_rep, stats['n_tasks'], stats['n_cats'])
+            included = (unit_weights > 0).astype(float)
+            counts = np.asarray((stats['counts'].T @ included.T).T).reshape(shape)
+            rater_counts = np.asarray((stats['rater_counts'].T @ included.T).T).reshape(shape)
+            results[metric_key]['fleiss'] = batch_fleiss_kappa(counts)
+            results[metric_key]['krippendorff'] = batch_krippendorff_alpha(rater_counts)
+    return results
+
+
+_worker_problem = None
+
+def _init_worker(problem):
+    global _worker_problem
+    _worker_problem = problem
+
+
+def _run_chunk(seed_sequence, n_rep):
+    rng = np.random.default_rng(seed_sequence)
+    n_units = _worker_problem['n_units']
+    unit_weights = rng.multinomial(n_units, np.full(n_units, 1.0 / n_units), size=n_rep).astype(float)
+    return _replicate_statistics(_worker_problem, unit_weights)
+
+
+def run_bootstrap(problem, replicates=DEFAULT_REPLICATES, seed=0, workers=None):
+    """Runs the replicates and returns {metric_key: {statistic: array of shape (replicates, ...)}}."""
+    sizes = [CHUNK_REPLICATES] * (replicates // CHUNK_REPLICATES)
+    if replicates % CHUNK_REPLICATES:
+        sizes.append(replicates % CHUNK_REPLICATES)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(sizes) <= 1:
+        _init_worker(problem)
+        chunks = [_run_chunk(s, n) for s, n in zip(seeds, sizes)]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(sizes)), initializer=_init_worker,
+                                 initargs=(problem,)) as pool:
+            chunks = list(pool.map(_run_chunk, seeds, sizes))
+
+    return {
+        metric_key: {
+            statistic: np.concatenate([chunk[metric_key][statistic] for chunk in chunks])
+            for statistic in chunks[0][metric_key]
+        }
+        for metric_key in chunks[0]
+    } if chunks else {}
+
+
+def bootstrap_intervals(df, replicates=DEFAULT_REPLICATES, unit='task', confidence=DEFAULT_CONFIDENCE,
+                        seed=0, workers=None):
+    """
+    Percentile bootstrap intervals for every metric in the DataFrame.
+    Returns {'rankings': {metric: {model: {'win_rate': (lo, hi), 'bt_strength': (lo, hi)}}},
+             'agreement': {metric: {'fleiss': (lo, hi), 'krippendorff': (lo, hi)}}, ...settings}
+    with metric names as used by calculate_win_rates_from_df (without the 'winner_' prefix).
+    """
+    problem = prepare_bootstrap(df, unit)
+    samples = run_bootstrap(problem, replicates, seed, workers)
+    tail = (1 - confidence) / 2 * 100
+
+    def interval(values):
+        # Replicates where a statistic is undefined (e.g. no overlapping tasks drawn) are NaN and skipped
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            lo, hi = np.nanpercentile(values, [tail, 100 - tail], axis=0)
+        return lo, hi
+
+    intervals = {'rankings': {}, 'agreement': {}, 'replicates': replicates, 'unit': unit,
+                 'confidence': confidence, 'seed': seed}
+    for metric_key, stats in samples.items():
+        metric_name = metric_key.replace('winner_', '')
+        win_lo, win_hi = interval(stats['win_rate'])
+        bt_lo, bt_hi = interval(stats['bt_strength'])
+        intervals['rankings'][metric_name] = {
+            model: {'win_rate': (float(win_lo[i]), float(win_hi[i])),
+                    'bt_strength': (float(bt_lo[i]), float(bt_hi[i]))}
+            for i, model in enumerate(problem['models'])
+        }
+        if 'fleiss' in stats:
+            intervals['agreement'][metric_name] = {
+                key: tuple(float(v) for v in interval(stats[key])) for key in ('fleiss', 'krippendorff')
+            }
+    return intervals
+
+
+def attach_intervals(rankings, agreement, intervals):
+    """
+    Adds 'win_rate_ci' / 'bt_strength_ci' to each leaderboard entry and
+    'fleiss_ci' / 'krippendorff_ci' to each agreement result, in place.
+    """
+    for metric_name, leaderboard in rankings.items():
+        model_intervals = intervals['rankings'].get(metric_name, {})
+        for item in leaderboard:
+            if item['model'] in model_intervals:
+                item['win_rate_ci'] = model_intervals[item['model']]['win_rate']
+                item['bt_strength_ci'] = model_intervals[item['model']]['bt_strength']
+    for metric_name, scores in agreement.items():
+        if isinstance(scores, dict) and metric_name in intervals['agreement']:
+            scores['fleiss_ci'] = intervals['agreement'][metric_name]['fleiss']
+            scores['krippendorff_ci'] = intervals['agreement'][metric_name]['krippendorff']
@@ -1,8 +1,8 @@
 import json
 import pandas as pd
-import simpledorff
 from statsmodels.stats.inter_rater import fleiss_kappa
 import numpy as np
+from scipy import sparse
 
 # 你要计算的一致性维度
 METRIC_KEYS = [
@@ -12,67 +12,251 @@ METRIC_KEYS = [
     'winner_empathy'
 ]
 
+def build_task_ids(df):
+    """
+    向量化构造 task_id（保证同一个case+模型对比是一致的任务），
+    格式与之前逐行 apply 生成的一致：'<case_id>_<较小模型>_vs_<较大模型>'
+    """
+    model_a = df['model_a'].astype(str)
+    model_b = df['model_b'].astype(str)
+    a_first = (model_a <= model_b).to_numpy()
+    lo = np.where(a_first, model_a, model_b)
+    hi = np.where(a_first, model_b, model_a)
+    return df['case_id'].astype(str) + '_' + lo + '_vs_' + hi
+
+
+def build_label_count_matrices(task_ids, annotator_ids, labels):
+    """
+    一次性构造某个指标的 (n_tasks × n_categories) 计数矩阵。
+    返回 (tasks, categories, counts, rater_counts)：
+      counts       —— 每条标注都计数，用于 Fleiss' kappa
+      rater_counts —— 同一标注员对同一任务只计第一条，用于 Krippendorff's alpha
+    任务按首次出现的顺序排列，类别按字典序排列。
+    """
+    task_codes, tasks = pd.factorize(task_ids)
+    label_codes, categories = pd.factorize(labels, sort=True)
+    n_tasks, n_cats = len(tasks), len(categories)
+
+    flat = task_codes * n_cats + label_codes
+    counts = np.bincount(flat, minlength=n_tasks * n_cats).reshape(n_tasks, n_cats)
+
+    first = ~pd.DataFrame({'t': task_codes, 'a': pd.factorize(annotator_ids)[0]}).duplicated().to_numpy()
+    rater_counts = np.bincount(flat[first], minlength=n_tasks * n_cats).reshape(n_tasks, n_cats)
+    return tasks, categories, counts, rater_counts
+
+
+def coincidence_matrix(counts):
+    """
+    由单元计数矩阵计算 Krippendorff 的类别共现（coincidence）矩阵：
+    o_ck = Σ_u (n_uc · n_uk − [c = k] · n_uc) / (n_u − 1)，只包含可配对（n_u ≥ 2）的单元。
+    """
+    counts = np.asarray(counts, dtype=float)
+    n_u = counts.sum(axis=1)
+    pairable = n_u >= 2
+    counts = counts[pairable]
+    weighted = counts / (n_u[pairable] - 1)[:, None]
+    return weighted.T @ counts - np.diag(weighted.sum(axis=0))
+
+
+def krippendorff_alpha_from_counts(counts):
+    """名义尺度下的 Krippendorff's alpha，由单元计数矩阵（每个标注员每个单元一条）计算"""
+    coincidences = coincidence_matrix(counts)
+    n_c = coincidences.sum(axis=1)
+    total = float(n_c.sum())
+    observed = float(coincidences.sum() - np.trace(coincidences))
+    expected = float(total * total - (n_c * n_c).sum())
+    return 1 - (observed / expected) * (total - 1)
+
+
+def agreement_from_counts(counts, rater_counts):
+    """由计数矩阵得到一个指标的一致性结果；数据不足时返回说明文字"""
+    # 至少要有两条标注落在同一个 task 上
+    overlapping = counts.sum(axis=1) > 1
+    if not overlapping.any():
+        return "Not enough overlapping annotations"
+
+    try:
+        # ----- Krippendorff's alpha -----
+        alpha = krippendorff_alpha_from_counts(rater_counts[overlapping])
+
+        # ----- Fleiss' kappa -----
+        # 只保留在重叠任务中出现过的类别
+        mat = counts[overlapping]
+        mat = mat[:, mat.sum(axis=0) > 0]
+        fleiss = fleiss_kappa(mat)
+
+        return {
+            "fleiss": fleiss,
+            "krippendorff": alpha
+        }
+    except Exception as e:
+        return f"Calculation error: {e}"
+
+
 def calculate_agreements_from_df(df):
     if df.empty or 'annotator_id' not in df.columns or len(df['annotator_id'].unique()) < 2:
         return {"error": "Insufficient data or annotators for agreement calculation."}
 
-    agreement_scores = {}
-    
-    # 构造 task_id（保证同一个case+模型对比是一致的任务）
-    df['task_id'] = df.apply(
-        lambda row: f"{row['case_id']}_{'_vs_'.join(sorted([row['model_a'], row['model_b']]))}",
-        axis=1
-    )
+    task_ids = build_task_ids(df)
+    matrices = {}
+    for metric_key in METRIC_KEYS:
+        if metric_key not in df.columns:
+            continue
+        valid = df[metric_key].notna() & df['annotator_id'].notna()
+        _, _, counts, rater_counts = build_label_count_matrices(
+            task_ids[valid].to_numpy(),
+            df.loc[valid, 'annotator_id'].to_numpy(),
+            df.loc[valid, metric_key].to_numpy(),
+        )
+        matrices[metric_key] = (counts, rater_counts)
 
+    return agreements_from_matrices(df['annotator_id'].nunique(dropna=False), matrices)
+
+
+def agreements_from_matrices(n_annotators, matrices):
+    """
+    由各指标的 (counts, rater_counts) 计数矩阵计算一致性，
+    matrices 的键为指标列名（如 'winner_coherence'），缺失的指标会标注出来。
+    """
+    if n_annotators < 2:
+        return {"error": "Insufficient data or annotators for agreement calculation."}
+
+    agreement_scores = {}
     for metric_key in METRIC_KEYS:
         metric_name = metric_key.replace('winner_', '')
-        if metric_key not in df.columns:
+        if metric_key not in matrices:
             agreement_scores[metric_name] = "Metric column not found"
             continue
+        counts, rater_counts = matrices[metric_key]
+        agreement_scores[metric_name] = agreement_from_counts(counts, rater_counts)
 
-        kappa_df = df[['task_id', 'annotator_id', metric_key]].dropna()
-        kappa_df = kappa_df.rename(columns={metric_key: 'annotation'})
+    return agreement_scores
 
-        # 至少要有两个 annotator 标注同一个 task
-        task_counts = kappa_df['task_id'].value_counts()
-        tasks_with_multiple = task_counts[task_counts > 1].index
-        if len(tasks_with_multiple) < 1:
-            agreement_scores[metric_name] = "Not enough overlapping annotations"
+
+def build_overlap_index(task_codes, annotator_codes, n_tasks, n_annotators):
+    """
+    稀疏的 (标注员 × 任务) 出现矩阵 P（同一标注员对同一任务只计一次）。
+    P @ P.T 即两两标注员共同标注过的任务数，对角线为各自标注的任务数。
+    """
+    presence = sparse.csr_matrix(
+        (np.ones(len(task_codes)), (annotator_codes, task_codes)), shape=(n_annotators, n_tasks)
+    )
+    presence.data[:] = 1.0  # 重复条目在构造时已被累加
+    return presence
+
+
+def pairwise_agreement(task_codes, annotator_codes, label_codes, n_tasks, n_annotators, n_cats):
+    """
+    计算一个指标的标注员两两一致性，输入为整数编码（同一标注员对同一任务只取第一条）。
+    返回 dict（均为 numpy 数组，按标注员编码排列）：
+      overlap    —— (A × A) 共同标注的任务数
+      agreement  —— (A × A) 共同任务上的原始一致率
+      kappa      —— (A × A) Cohen's kappa，期望一致率取两人在共同任务上的各自标签分布
+      majority   —— (A,) 与其余标注员多数标签一致的比例（留一法，其余标注员少于两人或并列时跳过该任务）
+      majority_tasks —— (A,) 参与上述比例计算的任务数
+    对角线以及没有共同任务的组合为 NaN。
+    """
+    first = ~pd.DataFrame({'t': task_codes, 'a': annotator_codes}).duplicated().to_numpy()
+    t, a, c = task_codes[first], annotator_codes[first], label_codes[first]
+    ones = np.ones(len(t))
+
+    presence = build_overlap_index(t, a, n_tasks, n_annotators)
+    overlap = (presence @ presence.T).toarray()
+    # 每个类别一个 (A × T) 矩阵：标注员在该任务上给出了这个标签
+    by_label = [
+        sparse.csr_matrix((ones[c == k], (a[c == k], t[c == k])), shape=(n_annotators, n_tasks))
+        for k in range(n_cats)
+    ]
+    agreed = np.zeros((n_annotators, n_annotators))
+    expected = np.zeros((n_annotators, n_annotators))
+    for labelled in by_label:
+        agreed += (labelled @ labelled.T).toarray()
+        # [i, j]：i 在与 j 共同的任务上给出该标签的次数
+        marginal = (labelled @ presence.T).toarray()
+        expected += marginal * marginal.T
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        agreement = agreed / overlap
+        p_exp = expected / (overlap * overlap)
+        kappa = (agreement - p_exp) / (1.0 - p_exp)
+    kappa[np.isclose(p_exp, 1.0)] = np.nan
+    for matrix in (agreement, kappa):
+        np.fill_diagonal(matrix, np.nan)
+
+    # 留一法多数标签：每条标注与同一任务上其余标注员的标签分布比较
+    counts = np.bincount(t * n_cats + c, minlength=n_tasks * n_cats).reshape(n_tasks, n_cats)
+    others = counts[t]
+    others[np.arange(len(t)), c] -= 1
+    top = others.max(axis=1)
+    decided = (others.sum(axis=1) >= 2) & ((others == top[:, None]).sum(axis=1) == 1)
+    matches = decided & (others.argmax(axis=1) == c)
+    majority_tasks = np.bincount(a, weights=decided, minlength=n_annotators)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        majority = np.bincount(a, weights=matches, minlength=n_annotators) / majority_tasks
+
+    return {
+        "overlap": overlap.astype(int),
+        "agreement": agreement,
+        "kappa": kappa,
+        "majority": majority,
+        "majority_tasks": majority_tasks.astype(int),
+    }
+
+
+def _nan_to_none(values):
+    """数组转为（嵌套）列表，NaN 变为 None"""
+    converted = values.astype(object)
+    converted[np.isnan(values)] = None
+    return converted.tolist()
+
+
+def pairwise_result(annotators, scores_by_metric):
+    """把各指标 pairwise_agreement 的结果转换为列表（NaN 变为 None），可直接用于模板或 JSON"""
+    result = {"annotators": list(annotators), "metrics": {}}
+    for metric_key, scores in scores_by_metric.items():
+        result["metrics"][metric_key.replace('winner_', '')] = {
+            "overlap": scores["overlap"].tolist(),
+            "agreement": _nan_to_none(scores["agreement"]),
+            "kappa": _nan_to_none(scores["kappa"]),
+            "majority": _nan_to_none(scores["majority"]),
+            "majority_tasks": scores["majority_tasks"].tolist(),
+        }
+    return result
+
+
+def pairwise_agreements_from_codes(task_codes, annotator_codes, annotators, labels_by_metric):
+    """
+    由整数编码的任务 / 标注员和各指标的标签数组计算两两一致性，
+    labels_by_metric 的键为指标列名，值为与 task_codes 等长的标签数组（缺失为 NaN / None）。
+    """
+    task_codes = np.asarray(task_codes)
+    annotator_codes = np.asarray(annotator_codes)
+    n_tasks = int(task_codes.max()) + 1 if len(task_codes) else 0
+    scores_by_metric = {}
+    for metric_key in METRIC_KEYS:
+        if metric_key not in labels_by_metric:
             continue
+        labels = pd.Series(labels_by_metric[metric_key])
+        valid = labels.notna().to_numpy()
+        label_codes, categories = pd.factorize(labels[valid], sort=True)
+        scores_by_metric[metric_key] = pairwise_agreement(
+            task_codes[valid], annotator_codes[valid], label_codes, n_tasks, len(annotators), len(categories)
+        )
+    return pairwise_result(annotators, scores_by_metric)
 
-        kappa_df_filtered = kappa_df[kappa_df['task_id'].isin(tasks_with_multiple)]
 
-        try:
-            # ----- Krippendorff's alpha -----
-            alpha = simpledorff.calculate_krippendorffs_alpha_for_df(
-                kappa_df_filtered,
-                experiment_col='task_id',
-                annotator_col='annotator_id',
-                class_col='annotation'
-            )
-
-            # ----- Fleiss' kappa -----
-            # 构造 (n_tasks × n_categories) 的矩阵
-            categories = sorted(kappa_df_filtered['annotation'].unique())
-            task_ids = kappa_df_filtered['task_id'].unique()
-            mat = []
-            for tid in task_ids:
-                sub = kappa_df_filtered[kappa_df_filtered['task_id'] == tid]
-                counts = [sum(sub['annotation'] == c) for c in categories]
-                mat.append(counts)
-            mat = np.array(mat)
-
-            fleiss = fleiss_kappa(mat)
-
-            agreement_scores[metric_name] = {
-                "fleiss": fleiss,
-                "krippendorff": alpha
-            }
-
-        except Exception as e:
-            agreement_scores[metric_name] = f"Calculation error: {e}"
+def calculate_pairwise_agreements_from_df(df):
+    """标注员两两之间的 Cohen's kappa / 原始一致率矩阵，以及各标注员与多数标签的一致率"""
+    if df.empty or 'annotator_id' not in df.columns:
+        return {"error": "Insufficient data or annotators for agreement calculation."}
+    df = df[df['annotator_id'].notna()]
+    if df['annotator_id'].nunique() < 2:
+        return {"error": "Insufficient data or annotators for agreement calculation."}
 
-    return agreement_scores
+    task_codes = pd.factorize(build_task_ids(df))[0]
+    annotator_codes, annotators = pd.factorize(df['annotator_id'].astype(str), sort=True)
+    labels_by_metric = {key: df[key].to_numpy() for key in METRIC_KEYS if key in df.columns}
+    return pairwise_agreements_from_codes(task_codes, annotator_codes, annotators, labels_by_metric)
 
 
 def display_agreement(agreement_scores):
@@ -84,8 +268,10 @@ def display_agreement(agreement_scores):
     for metric_name, scores in agreement_scores.items():
         print(f"\nMetric: {metric_name.title()}")
         if isinstance(scores, dict):
-            print(f"  Fleiss' kappa       : {scores['fleiss']:.4f}")
-            print(f"  Krippendorff's alpha: {scores['krippendorff']:.4f}")
+            fleiss_ci = "  [{:.4f}, {:.4f}]".format(*scores['fleiss_ci']) if 'fleiss_ci' in scores else ""
+            alpha_ci = "  [{:.4f}, {:.4f}]".format(*scores['krippendorff_ci']) if 'krippendorff_ci' in scores else ""
+            print(f"  Fleiss' kappa       : {scores['fleiss']:.4f}{fleiss_ci}")
+            print(f"  Krippendorff's alpha: {scores['krippendorff']:.4f}{alpha_ci}")
         else:
             print(f"  {scores}")
 
@@ -94,24 +280,78 @@ def display_agreement(agreement_scores):
     print("  0.81 - 1.00: Almost perfect agreement")
 
 
+def display_pairwise_agreement(pairwise):
+    print("\n--- Pairwise Annotator Agreement (Cohen's kappa) ---")
+    if "error" in pairwise:
+        print(pairwise["error"])
+        return
+
+    annotators = pairwise["annotators"]
+    for metric_name, scores in pairwise["metrics"].items():
+        print(f"\nMetric: {metric_name.title()}")
+        kappa = pd.DataFrame(scores["kappa"], index=annotators, columns=annotators, dtype=float)
+        print(kappa.to_string(float_format=lambda v: f"{v:.3f}", na_rep="-"))
+        majority = pd.DataFrame({
+            "majority_agreement": pd.Series(scores["majority"], index=annotators, dtype=float),
+            "tasks": scores["majority_tasks"],
+        }, index=annotators)
+        print(majority.to_string(float_format=lambda v: f"{v:.3f}", na_rep="-"))
+
+
 if __name__ == '__main__':
-    FILE_PATH = 'annotation_data/annotation_202509240830.json'
+    import argparse
+    parser = argparse.ArgumentParser(description="计算标注员之间的一致性")
+    parser.add_argument('inputs', nargs='*',
+                        help="标注文件或通配符（.jsonl / .csv / .parquet / .json）；未指定 --in-memory 或 --bootstrap 时分块流式读取")
+    parser.add_argument('--chunk-size', type=int, default=None, help="流式读取时每块的行数")
+    parser.add_argument('--in-memory', action='store_true', help="把全部输入读入一个 DataFrame")
+    parser.add_argument('--bootstrap', type=int, default=0, metavar='N', help="用 N 次 bootstrap 计算置信区间")
+    parser.add_argument('--unit', choices=['task', 'annotator'], default='task', help="bootstrap 的重抽样单位")
+    parser.add_argument('--seed', type=int, default=0, help="bootstrap 随机种子")
+    parser.add_argument('--workers', type=int, default=None, help="bootstrap 以及并行归约多个输入文件时使用的进程数")
+    parser.add_argument('--pairwise', action='store_true', help="同时输出标注员两两之间的一致性矩阵")
+    args = parser.parse_args()
 
-    try:
-        with open(FILE_PATH, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        df = pd.DataFrame(data['annotation'])
-        print(f"Successfully loaded {len(df)} records from '{FILE_PATH}'.")
+    df = pd.DataFrame()
+    if args.inputs:
+        from annotation_stream import expand_inputs, load_dataframe, reduce_files, AgreementStats, DEFAULT_CHUNK_ROWS
+        paths = expand_inputs(args.inputs)
+        chunk_rows = args.chunk_size or DEFAULT_CHUNK_ROWS
+        if args.in_memory or args.bootstrap > 0:
+            # bootstrap 需要逐行重抽样，只能在内存中进行
+            df = load_dataframe(paths, chunk_rows)
+            print(f"Successfully loaded {len(df)} records from {len(paths)} file(s).")
+        else:
+            stats = reduce_files(paths, AgreementStats, chunk_rows, args.workers)
+            print(f"Streamed {stats.rows} records from {len(paths)} file(s).")
+            display_agreement(stats.agreement())
+            if args.pairwise:
+                display_pairwise_agreement(stats.pairwise())
+    else:
+        FILE_PATH = 'annotation_data/annotation_202509240830.json'
 
-    except (FileNotFoundError, json.JSONDecodeError, KeyError) as e:
         try:
-            print(f"Could not load as standard JSON ({e}), trying JSONL format...")
-            df = pd.read_json('results.jsonl', lines=True)
-            print(f"Successfully loaded {len(df)} records from 'results.jsonl'.")
-        except Exception as e2:
-            print(f"Error: Could not read the results file. Error: {e2}")
-            df = pd.DataFrame()
+            with open(FILE_PATH, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            df = pd.DataFrame(data['annotation'])
+            print(f"Successfully loaded {len(df)} records from '{FILE_PATH}'.")
+
+        except (FileNotFoundError, json.JSONDecodeError, KeyError) as e:
+            try:
+                print(f"Could not load as standard JSON ({e}), trying JSONL format...")
+                df = pd.read_json('results.jsonl', lines=True)
+                print(f"Successfully loaded {len(df)} records from 'results.jsonl'.")
+            except Exception as e2:
+                print(f"Error: Could not read the results file. Error: {e2}")
+                df = pd.DataFrame()
 
     if not df.empty:
         calculated_agreement = calculate_agreements_from_df(df)
-        display_agreement(calculated_agreement)
\ No newline at end of file
+        if args.bootstrap > 0 and "error" not in calculated_agreement:
+            from bootstrap import bootstrap_intervals, attach_intervals
+            intervals = bootstrap_intervals(df, args.bootstrap, unit=args.unit, seed=args.seed, workers=args.workers)
+            attach_intervals({}, calculated_agreement, intervals)
+            print(f"Bootstrap: {args.bootstrap} 次重抽样（单位: {args.unit}），{intervals['confidence']:.0%} 置信区间")
+        display_agreement(calculated_agreement)
+        if args.pairwise:
+            display_pairwise_agreement(calculate_pairwise_agreements_from_df(df))
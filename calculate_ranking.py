@@ -1,6 +1,6 @@
 import json
+import numpy as np
 import pandas as pd
-from collections import defaultdict
 
 # --- Define metric keys ---
 # Note: I've updated these to match your new database schema.
@@ -11,95 +11,283 @@ METRIC_KEYS = [
     'winner_empathy'
 ]
 
+TIE_LABEL = 'tie'
+
+# Elo defaults (classic chess-style parameters)
+ELO_INITIAL = 1000.0
+ELO_K = 32.0
+ELO_SCALE = 400.0
+
+
+def complete_pairs(df):
+    """
+    Drops rows without a model_a or model_b, which cannot be attributed to a
+    pair. Returns the DataFrame itself when every row is complete.
+    """
+    complete = df['model_a'].notna().to_numpy() & df['model_b'].notna().to_numpy()
+    return df if complete.all() else df[complete]
+
+
+def encode_pairs(df):
+    """
+    Maps 'model_a' / 'model_b' to integer codes in one pass.
+    Models are numbered in order of first appearance (a0, b0, a1, b1, ...),
+    which matches the order the old row-by-row loop created them in.
+    Returns (models, a_idx, b_idx). Rows with a missing model are rejected
+    with a ValueError; drop them first with complete_pairs().
+    """
+    interleaved = np.column_stack([df['model_a'].to_numpy(), df['model_b'].to_numpy()]).ravel()
+    codes, models = pd.factorize(interleaved)
+    if (codes < 0).any():
+        raise ValueError("model_a / model_b must not be missing; drop such rows with complete_pairs()")
+    return np.asarray(models), codes[0::2], codes[1::2]
+
+
+def outcome_codes(df, metric_key):
+    """
+    Encodes the winner column of one metric relative to each row's pair:
+    1 = model_a won, -1 = model_b won, 0 = tie, and NaN for anything else
+    (missing or unrecognised labels, which only count as a comparison).
+    """
+    winner = df[metric_key].to_numpy()
+    outcome = np.full(len(df), np.nan)
+    outcome[winner == TIE_LABEL] = 0
+    outcome[winner == df['model_b'].to_numpy()] = -1
+    outcome[winner == df['model_a'].to_numpy()] = 1
+    return outcome
+
+
+def build_outcome_matrices(df, metric_keys=METRIC_KEYS):
+    """
+    Builds the count matrices for every metric present in the DataFrame.
+    For each metric, wins[i, j] is the number of times model i beat model j
+    and ties[i, j] the number of ties between them (symmetric).
+    Returns (models, a_idx, b_idx, comparisons, matrices), where comparisons[i]
+    is the number of rows model i appears in and matrices maps the metric
+    column to a dict with 'wins', 'ties' and 'outcome' arrays.
+    """
+    models, a_idx, b_idx = encode_pairs(df)
+    n = len(models)
+    comparisons = np.bincount(a_idx, minlength=n) + np.bincount(b_idx, minlength=n)
+
+    matrices = {}
+    for metric_key in metric_keys:
+        if metric_key not in df.columns:
+            continue
+        outcome = outcome_codes(df, metric_key)
+        a_won = outcome == 1
+        b_won = outcome == -1
+        tied = outcome == 0
+
+        wins = np.bincount(a_idx[a_won] * n + b_idx[a_won], minlength=n * n)
+        wins += np.bincount(b_idx[b_won] * n + a_idx[b_won], minlength=n * n)
+        wins = wins.reshape(n, n)
+
+        ties = np.bincount(a_idx[tied] * n + b_idx[tied], minlength=n * n).reshape(n, n)
+        ties = ties + ties.T
+
+        matrices[metric_key] = {'wins': wins, 'ties': ties, 'outcome': outcome}
+    return models, a_idx, b_idx, comparisons, matrices
+
+
+def fit_bradley_terry(wins, ties, prior=0.5, max_iter=1000, tol=1e-9):
+    """
+    Fits Bradley-Terry strengths by maximum likelihood with the MM algorithm
+    (Hunter, 2004). Ties count as half a win for each side. A small number of
+    virtual ties ('prior') between every pair keeps the estimate finite when a
+    model never wins or the comparison graph is disconnected.
+    Returns strengths normalised to sum to 1, so P(i beats j) = p_i / (p_i + p_j).
+    wins and ties may carry leading batch dimensions (..., n, n), in which case
+    every matrix in the batch is fitted at once (used by the bootstrap).
+    """
+    n = wins.shape[-1]
+    if n == 0:
+        return np.zeros(wins.shape[:-1])
+
+    off_diagonal = 1.0 - np.eye(n)
+    score = wins + 0.5 * ties + 0.5 * prior * off_diagonal
+    games = score + np.swapaxes(score, -1, -2)
+    total_score = score.sum(axis=-1)
+
+    p = np.full(score.shape[:-1], 1.0 / n)
+    for _ in range(max_iter):
+        denom = (games / (p[..., :, None] + p[..., None, :])).sum(axis=-1)
+        new_p = total_score / denom
+        new_p /= new_p.sum(axis=-1, keepdims=True)
+        if np.max(np.abs(new_p - p)) < tol:
+            p = new_p
+            break
+        p = new_p
+    return p
+
+
+def replay_elo(a_idx, b_idx, outcome, n_models, k=ELO_K, initial=ELO_INITIAL, scale=ELO_SCALE):
+    """
+    Replays comparisons in the given order and returns the final Elo ratings.
+    Rows whose outcome is NaN are skipped. Elo is order dependent, so this is
+    the one sequential step; it runs over plain arrays rather than DataFrame rows.
+    """
+    ratings = np.full(n_models, initial, dtype=float)
+    valid = ~np.isnan(outcome)
+    scores = (outcome[valid] + 1.0) / 2.0  # 1 -> 1.0, 0 -> 0.5, -1 -> 0.0
+    for a, b, s in zip(a_idx[valid].tolist(), b_idx[valid].tolist(), scores.tolist()):
+        expected = 1.0 / (1.0 + 10 ** ((ratings[b] - ratings[a]) / scale))
+        delta = k * (s - expected)
+        ratings[a] += delta
+        ratings[b] -= delta
+    return ratings
+
+
+def leaderboard_from_matrices(models, wins, ties, comparisons, bt_strengths=None, elo_ratings=None):
+    """Turns the count matrices of one metric into the leaderboard list structure."""
+    total_wins = wins.sum(axis=1)
+    total_losses = wins.sum(axis=0)
+    total_ties = ties.sum(axis=1)
+
+    leaderboard = []
+    for i, model in enumerate(models):
+        w, l = int(total_wins[i]), int(total_losses[i])
+        # Avoid division by zero if a model was only ever in 'tie' results for a metric
+        valid_comparisons = w + l
+        win_rate = w / valid_comparisons if valid_comparisons > 0 else 0
+        item = {
+            'model': model, 'win_rate': win_rate, 'wins': w,
+            'losses': l, 'ties': int(total_ties[i]), 'comparisons': int(comparisons[i])
+        }
+        if bt_strengths is not None:
+            item['bt_strength'] = float(bt_strengths[i])
+        if elo_ratings is not None:
+            item['elo'] = float(elo_ratings[i])
+        leaderboard.append(item)
+
+    leaderboard.sort(key=lambda x: x['win_rate'], reverse=True)
+    return leaderboard
+
+
 def calculate_win_rates_from_df(df):
     """
     Calculates win rates for multiple metrics from a DataFrame.
     The DataFrame must contain 'model_a', 'model_b', and the metric winner columns.
+    Each leaderboard entry also carries a Bradley-Terry strength ('bt_strength')
+    and an Elo rating ('elo') replayed in timestamp order when available.
+    Rows without a model_a or model_b are ignored.
     """
+    df = complete_pairs(df)
     if df.empty:
         return {}
 
-    rankings = {}
-    models = pd.concat([df['model_a'], df['model_b']]).unique()
+    models, a_idx, b_idx, comparisons, matrices = build_outcome_matrices(df)
 
-    for metric_key in METRIC_KEYS:
-        if metric_key not in df.columns:
-            continue
+    order = np.arange(len(df))
+    if 'timestamp' in df.columns:
+        timestamps = pd.to_datetime(df['timestamp'], errors='coerce').to_numpy()
+        order = np.argsort(timestamps, kind='stable')
+
+    elo_ratings = {
+        metric_key: replay_elo(a_idx[order], b_idx[order], counts['outcome'][order], len(models))
+        for metric_key, counts in matrices.items()
+    }
+    return rankings_from_matrices(models, comparisons, matrices, elo_ratings)
+
+
+def rankings_from_matrices(models, comparisons, matrices, elo_ratings=None):
+    """
+    Builds the per-metric leaderboards from precomputed count matrices
+    (as returned by build_outcome_matrices, or read back from aggregates).
+    elo_ratings optionally maps each metric column to an array of ratings.
+    """
+    rankings = {}
+    for metric_key, counts in matrices.items():
+        bt_strengths = fit_bradley_terry(counts['wins'], counts['ties'])
+        elo = elo_ratings.get(metric_key) if elo_ratings else None
+        rankings[metric_key.replace('winner_', '')] = leaderboard_from_matrices(
+            models, counts['wins'], counts['ties'], comparisons, bt_strengths, elo
+        )
 
-        stats = defaultdict(lambda: {'wins': 0, 'losses': 0, 'ties': 0, 'comparisons': 0})
-
-        for _, row in df.iterrows():
-            model_a = row['model_a']
-            model_b = row['model_b']
-            winner = row[metric_key]
-
-            # Ensure both models are initialized in stats
-            stats[model_a]
-            stats[model_b]
-            
-            stats[model_a]['comparisons'] += 1
-            stats[model_b]['comparisons'] += 1
-
-            if winner == model_a:
-                stats[model_a]['wins'] += 1
-                stats[model_b]['losses'] += 1
-            elif winner == model_b:
-                stats[model_b]['wins'] += 1
-                stats[model_a]['losses'] += 1
-            elif winner == 'tie':
-                stats[model_a]['ties'] += 1
-                stats[model_b]['ties'] += 1
-        
-        leaderboard = []
-        for model, data in stats.items():
-            # Avoid division by zero if a model was only ever in 'tie' results for a metric
-            valid_comparisons = data['wins'] + data['losses']
-            win_rate = data['wins'] / valid_comparisons if valid_comparisons > 0 else 0
-            leaderboard.append({
-                'model': model, 'win_rate': win_rate, 'wins': data['wins'],
-                'losses': data['losses'], 'ties': data['ties'], 'comparisons': data['comparisons']
-            })
-        
-        leaderboard.sort(key=lambda x: x['win_rate'], reverse=True)
-        rankings[metric_key.replace('winner_', '')] = leaderboard
-        
     return rankings
 
 def display_rankings(rankings):
-    """Formats and prints the rankings to the console."""
+    """Formats and prints the rankings to the console (with bootstrap intervals when attached)."""
     for metric_name, leaderboard in rankings.items():
+        show_ci = any('win_rate_ci' in item for item in leaderboard)
         print(f"\n--- Model Ranking: {metric_name.replace('_', ' ').title()} ---")
-        print(f"{'Rank':<5}{'Model':<20}{'Win Rate':<12}{'Wins':<7}{'Losses':<8}{'Ties':<7}{'Compared':<10}")
-        print("-" * 80)
+        header = f"{'Rank':<5}{'Model':<20}{'Win Rate':<12}{'Wins':<7}{'Losses':<8}{'Ties':<7}{'Compared':<10}{'BT':<9}{'Elo':<8}"
+        if show_ci:
+            header += f"{'Win Rate CI':<18}{'BT CI':<16}"
+        print(header)
+        print("-" * len(header))
         for i, item in enumerate(leaderboard):
             rank = i + 1
             win_rate_str = f"{item['win_rate']:.2%}"
-            print(f"{rank:<5}{item['model']:<20}{win_rate_str:<12}{item['wins']:<7}{item['losses']:<8}{item['ties']:<7}{item['comparisons']:<10}")
+            bt_str = f"{item['bt_strength']:.3f}" if 'bt_strength' in item else '-'
+            elo_str = f"{item['elo']:.0f}" if 'elo' in item else '-'
+            line = f"{rank:<5}{item['model']:<20}{win_rate_str:<12}{item['wins']:<7}{item['losses']:<8}{item['ties']:<7}{item['comparisons']:<10}{bt_str:<9}{elo_str:<8}"
+            if show_ci and 'win_rate_ci' in item:
+                lo, hi = item['win_rate_ci']
+                bt_lo, bt_hi = item['bt_strength_ci']
+                line += f"{f'[{lo:.1%}, {hi:.1%}]':<18}{f'[{bt_lo:.3f}, {bt_hi:.3f}]':<16}"
+            print(line)
 
 if __name__ == '__main__':
-    # This block allows the script to run locally on a JSON or JSONL file
-    FILE_PATH = 'annotation_data/annotation_202509240830.json' # Change to your local file name
-    
-    try:
-        # Load data from the provided JSON structure
-        with open(FILE_PATH, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        # The data is nested under the "annotation" key
-        df = pd.DataFrame(data['annotation'])
-        print(f"Successfully loaded {len(df)} records from '{FILE_PATH}'.")
-
-    except (FileNotFoundError, json.JSONDecodeError, KeyError) as e:
-        # Fallback for JSONL format
+    import argparse
+    parser = argparse.ArgumentParser(description="Compute model rankings from exported annotations.")
+    parser.add_argument('inputs', nargs='*',
+                        help="annotation files or glob patterns (.jsonl, .csv, .parquet, .json); "
+                             "streamed in chunks unless --in-memory or --bootstrap is given")
+    parser.add_argument('--chunk-size', type=int, default=None, help="rows per chunk when streaming")
+    parser.add_argument('--in-memory', action='store_true', help="load every input into one DataFrame")
+    parser.add_argument('--no-elo', action='store_true', help="skip Elo when streaming (no per-row log is kept)")
+    parser.add_argument('--bootstrap', type=int, default=0, metavar='N',
+                        help="add N-replicate bootstrap confidence intervals")
+    parser.add_argument('--unit', choices=['task', 'annotator'], default='task', help="bootstrap resampling unit")
+    parser.add_argument('--seed', type=int, default=0, help="bootstrap random seed")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="worker processes for the bootstrap and for reducing input files in parallel")
+    args = parser.parse_args()
+
+    df = pd.DataFrame()
+    if args.inputs:
+        from functools import partial
+        from annotation_stream import expand_inputs, load_dataframe, reduce_files, RankingStats, DEFAULT_CHUNK_ROWS
+        paths = expand_inputs(args.inputs)
+        chunk_rows = args.chunk_size or DEFAULT_CHUNK_ROWS
+        if args.in_memory or args.bootstrap > 0:
+            # The bootstrap resamples individual rows, so it needs the whole DataFrame
+            df = load_dataframe(paths, chunk_rows)
+            print(f"Successfully loaded {len(df)} records from {len(paths)} file(s).")
+        else:
+            stats = reduce_files(paths, partial(RankingStats, keep_elo=not args.no_elo), chunk_rows, args.workers)
+            print(f"Streamed {stats.rows} records from {len(paths)} file(s).")
+            display_rankings(stats.rankings())
+    else:
+        # This block allows the script to run locally on a JSON or JSONL file
+        FILE_PATH = 'annotation_data/annotation_202509240830.json' # Change to your local file name
+
         try:
-            print(f"Could not load as standard JSON ({e}), trying JSONL format...")
-            df = pd.read_json('results.jsonl', lines=True)
-            print(f"Successfully loaded {len(df)} records from 'results.jsonl'.")
-        except Exception as e2:
-            print(f"Error: Could not read the results file. Please check the format. Error: {e2}")
-            df = pd.DataFrame()
+            # Load data from the provided JSON structure
+            with open(FILE_PATH, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # The data is nested under the "annotation" key
+            df = pd.DataFrame(data['annotation'])
+            print(f"Successfully loaded {len(df)} records from '{FILE_PATH}'.")
+
+        except (FileNotFoundError, json.JSONDecodeError, KeyError) as e:
+            # Fallback for JSONL format
+            try:
+                print(f"Could not load as standard JSON ({e}), trying JSONL format...")
+                df = pd.read_json('results.jsonl', lines=True)
+                print(f"Successfully loaded {len(df)} records from 'results.jsonl'.")
+            except Exception as e2:
+                print(f"Error: Could not read the results file. Please check the format. Error: {e2}")
+                df = pd.DataFrame()
 
     if not df.empty:
         # Calculate rankings from the DataFrame
         calculated_ranks = calculate_win_rates_from_df(df)
+        if args.bootstrap > 0:
+            from bootstrap import bootstrap_intervals, attach_intervals
+            intervals = bootstrap_intervals(df, args.bootstrap, unit=args.unit, seed=args.seed, workers=args.workers)
+            attach_intervals(calculated_ranks, {}, intervals)
+            print(f"Bootstrap: {args.bootstrap} replicates over {args.unit}s, {intervals['confidence']:.0%} intervals.")
         # Display the formatted rankings
-        display_rankings(calculated_ranks)
\ No newline at end of file
+        display_rankings(calculated_ranks)
@@ -0,0 +1,256 @@
+# campaigns.py
+"""
+Annotation campaigns: several studies served by one process.
+
+A campaign bundles a corpus (a data directory plus a file pattern), an
+annotator roster, the pair index built from the corpus, a scheduler and an
+annotation namespace (the campaign column of Annotation and of every summary
+table). Nothing is loaded up front: the corpus is opened on first access, and
+when the estimated resident size of all open corpora exceeds the memory
+budget the least recently used ones are closed again. Snapshot stores only
+count their private tables: the mapped snapshot is shared page cache that
+closing it would not free. Pair indexes and schedulers are kept, since they
+are small next to the dialogues and hold the annotation state of the campaign.
+
+Campaigns come from a JSON file (see campaigns.example.json):
+
+    {"campaigns": [
+        {"name": "default", "data_dir": "./data", "annotators": ["yonghui", ...]},
+        {"name": "emotion", "data_dir": "./data_linlu",
+         "pattern": "*/DoctorHistory_x_PatientEmotion/log_merged.jsonl",
+         "store": "lazy", "scheduler": {"mode": "adaptive", "overlap_quota": 2},
+         "scores_pattern": "*/DoctorHistory_x_PatientEmotion/detailed_scores.json"}
+    ]}
+
+scores_pattern (relative to data_dir) points at automatic judge scores that
+the analytics page can compare with the human judgments (see auto_scores.py).
+
+Fields that are left out take the server-wide defaults; relative paths are
+resolved against the directory of the configuration file.
+"""
+import os
+import json
+import threading
+from collections import OrderedDict
+from dialogue_store import EagerDialogueStore, LazyDialogueStore, SnapshotDialogueStore, DEFAULT_PATTERN
+from auto_scores import load_score_table
+from models import DEFAULT_CAMPAIGN
+
+STORE_MODES = ('eager', 'lazy', 'snapshot')
+
+
+def build_theoretical_pairs(case_models):
+    """
+    All (case_id, (model1, model2)) tasks of a corpus. Case ids and models are
+    sorted so that the assignment of tasks to annotators stays stable.
+    """
+    pairs = []
+    for case_id in sorted(case_models):
+        models_in_case = sorted(case_models[case_id])
+        for i in range(len(models_in_case)):
+            for j in range(i + 1, len(models_in_case)):
+                pairs.append((case_id, (models_in_case[i], models_in_case[j])))
+    return pairs
+
+
+class Campaign:
+    """
+    One annotation campaign. The corpus is reached through the registry so
+    that it can be evicted; case_models, all_pairs and scheduler are built
+    once on first use.
+    """
+
+    def __init__(self, name, data_dir, annotators, pattern=DEFAULT_PATTERN, store_mode='eager',
+                 index_path=None, snapshot_path=None, cache_size=1024, scheduler_options=None, scores_pattern=None):
+        if store_mode not in STORE_MODES:
+            print(f"Warning: Unknown store mode '{store_mode}' for campaign '{name}', falling back to 'eager'.")
+            store_mode = 'eager'
+        self.name = name
+        self.data_dir = data_dir
+        self.annotators = list(annotators)
+        self.pattern = pattern
+        self.store_mode = store_mode
+        # The default campaign keeps the file names used before campaigns existed
+        suffix = '' if name == DEFAULT_CAMPAIGN else f'.{name}'
+        self.index_path = index_path or os.path.join(data_dir, f'.dialogue_index{suffix}.json')
+        self.snapshot_path = snapshot_path or os.path.join(data_dir, f'.dialogue_snapshot{suffix}.bin')
+        self.scores_pattern = scores_pattern
+        self.scores_cache_path = os.path.join(data_dir, f'.auto_scores{suffix}.npz')
+        self.cache_size = cache_size
+        self.scheduler_options = dict(scheduler_options or {})
+        self.registry = None
+        self._store = None
+        self._case_models = None
+        self._all_pairs = None
+        self._scheduler = None
+        self._lock = threading.Lock()
+
+    def open_store(self):
+        """Opens a new dialogue store for the corpus (bypassing the registry's cache)."""
+        if self.store_mode == 'lazy':
+            return LazyDialogueStore(self.data_dir, index_path=self.index_path, cache_size=self.cache_size,
+                                     pattern=self.pattern)
+        if self.store_mode == 'snapshot':
+            return SnapshotDialogueStore(self.data_dir, self.snapshot_path, pattern=self.pattern)
+        return EagerDialogueStore(self.data_dir, pattern=self.pattern)
+
+    @property
+    def store(self):
+        return self.registry.acquire(self)
+
+    @property
+    def loaded(self):
+        """True once the pair index has been built (the corpus itself may have been evicted since)."""
+        return self._case_models is not None
+
+    @property
+    def case_models(self):
+        """{case_id: [model, ...]}"""
+        if self._case_models is None:
+            case_models = self.store.case_models()
+            with self._lock:
+                if self._case_models is None:
+                    self._case_models = case_models
+        return self._case_models
+
+    @property
+    def all_pairs(self):
+        if self._all_pairs is None:
+            pairs = build_theoretical_pairs(self.case_models)
+            with self._lock:
+                if self._all_pairs is None:
+                    self._all_pairs = pairs
+        return self._all_pairs
+
+    @property
+    def scheduler(self):
+        if self._scheduler is None:
+            scheduler = self.registry.make_scheduler(self)
+            with self._lock:
+                if self._scheduler is None:
+                    self._scheduler = scheduler
+        return self._scheduler
+
+    def scheduler_if_loaded(self):
+        """The scheduler, or None when it has not been built yet (never loads anything)."""
+        return self._scheduler
+
+    def category(self, case_id):
+        return self.store.category(case_id)
+
+    def score_table(self):
+        """The automatic judge scores of the corpus (cached on disk), or None when the campaign has none."""
+        if not self.scores_pattern:
+            return None
+        return load_score_table(self.data_dir, self.scores_pattern, self.scores_cache_path)
+
+    def corpus_size(self):
+        """Returns {'cases': ..., 'models': ..., 'pairs': ...} for a loaded campaign."""
+        case_models = self.case_models
+        return {
+            'cases': len(case_models),
+            'models': len({m for models in case_models.values() for m in models}),
+            'pairs': len(self.all_pairs),
+        }
+
+
+class CampaignRegistry:
+    """
+    The campaigns served by the process, and the LRU of their open corpora.
+    make_scheduler(campaign) builds a campaign's scheduler on first use.
+    memory_budget is in bytes; None disables eviction.
+    """
+
+    def __init__(self, campaigns, make_scheduler, memory_budget=None):
+        self._campaigns = OrderedDict((campaign.name, campaign) for campaign in campaigns)
+        for campaign in self._campaigns.values():
+            campaign.registry = self
+        self.make_scheduler = make_scheduler
+        self.memory_budget = memory_budget
+        # campaign name -> estimated resident bytes, least recently used first
+        self._resident = OrderedDict()
+        self._lock = threading.RLock()
+
+    @classmethod
+    def from_config(cls, path, defaults, make_scheduler, memory_budget=None):
+        """
+        Reads the campaigns from a JSON file. defaults holds the server-wide
+        values (annotators, store_mode, pattern, cache_size, scheduler_options)
+        for fields a campaign leaves out.
+        """
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+        base_dir = os.path.dirname(os.path.abspath(path))
+
+        def resolve(value):
+            return os.path.join(base_dir, value) if value else None
+
+        campaigns = []
+        for entry in config.get('campaigns', []):
+            scheduler_options = dict(defaults.get('scheduler_options', {}))
+            scheduler_options.update(entry.get('scheduler', {}))
+            campaigns.append(Campaign(
+                entry['name'],
+                resolve(entry['data_dir']),
+                entry.get('annotators', defaults.get('annotators', [])),
+                pattern=entry.get('pattern', defaults.get('pattern', DEFAULT_PATTERN)),
+                store_mode=entry.get('store', defaults.get('store_mode', 'eager')),
+                index_path=resolve(entry.get('index_path')),
+                snapshot_path=resolve(entry.get('snapshot_path')),
+                cache_size=entry.get('cache_size', defaults.get('cache_size', 1024)),
+                scheduler_options=scheduler_options,
+                scores_pattern=entry.get('scores_pattern'),
+            ))
+        return cls(campaigns, make_scheduler, memory_budget)
+
+    def get(self, name):
+        return self._campaigns.get(name)
+
+    def names(self):
+        return list(self._campaigns)
+
+    def __iter__(self):
+        return iter(list(self._campaigns.values()))
+
+    def acquire(self, campaign):
+        """Returns the campaign's open corpus, opening it (and evicting others) when needed."""
+        store = campaign._store
+        if store is None:
+            # Opening can take long; only requests for this campaign wait for it
+            with campaign._lock:
+                store = campaign._store
+                if store is None:
+                    store = campaign.open_store()
+                    campaign._store = store
+        with self._lock:
+            if campaign._store is None:
+                # Evicted while it was being opened
+                campaign._store = store
+            store = campaign._store
+            self._resident[campaign.name] = store.memory_bytes()
+            self._resident.move_to_end(campaign.name)
+            self._evict(keep=campaign.name)
+            return store
+
+    def _evict(self, keep):
+        if self.memory_budget is None:
+            return
+        while sum(self._resident.values()) > self.memory_budget and len(self._resident) > 1:
+            name = next(iter(self._resident))
+            if name == keep:
+                self._resident.move_to_end(name)
+                continue
+            del self._resident[name]
+            # Requests still holding the store keep using it; it is freed once they finish
+            self._campaigns[name]._store = None
+            print(f"Evicted corpus of campaign '{name}' (memory budget {self.memory_budget} bytes).")
+
+    def resident_bytes(self):
+        """{campaign name: estimated bytes} of the corpora that are currently open."""
+        with self._lock:
+            return dict(self._resident)
+
+    def category(self, campaign_name, case_id):
+        """Category resolver for the summary tables; unknown campaigns have no categories."""
+        campaign = self._campaigns.get(campaign_name)
+        return campaign.category(case_id) if campaign is not None else None
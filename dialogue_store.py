@@ -0,0 +1,581 @@
+import os
+import re
+import gzip
+import json
+import glob
+import mmap
+import struct
+import hashlib
+import tempfile
+import functools
+import numpy as np
+try:
+    import brotli
+except ImportError:  # brotli 压缩为可选功能
+    brotli = None
+try:
+    import fcntl
+except ImportError:  # 非 POSIX 平台上不加锁，并发构建时各自写临时文件再原子替换
+    fcntl = None
+
+# 当 case_id 是记录的第一个字段时，直接从行首取出，避免在建立索引时完整解析每条记录
+_CASE_ID_RE = re.compile(rb'\s*\{\s*"case_id"\s*:\s*(?:"([^"\\]*)"|(-?\d+))\s*[,}]')
+
+INDEX_VERSION = 1
+
+# LazyDialogueStore 估算内存占用时使用的单条大小：索引条目（字典项与元组），以及缓存的一段对话
+LAZY_INDEX_ENTRY_BYTES = 300
+LAZY_CACHE_ENTRY_BYTES = 16 * 1024
+# SnapshotDialogueStore 私有内存中每个病例 / 模型 / 类别表项（字典项与字符串）的估计大小；
+# 映射的快照页面由页缓存共享、按需载入，不计入内存预算
+SNAPSHOT_TABLE_ENTRY_BYTES = 200
+
+# brotli 11 级比 5 级慢几十倍而体积只小几个百分点，启动时要压缩全部对话，因此取 5 级
+BROTLI_QUALITY = 5
+
+
+def render_record(record):
+    """将一条源记录渲染为前端需要的对话 HTML 及附加信息"""
+    interactions = record.get('interactions', [])
+    dialogue_parts = []
+    for turn in interactions:
+        if isinstance(turn, list) and len(turn) == 2:
+            dialogue_parts.append(f'<div class="doctor-turn">医生: {turn[0]}</div>')
+            dialogue_parts.append(f'<div class="patient-turn">患者: {turn[1]}</div>')
+
+    formatted_dialogue = "".join(dialogue_parts).replace('*','')
+    return {
+        "dialogue": formatted_dialogue,
+        "choices": record.get("choices", "N/A"),
+        "category": record.get("category", "N/A")
+    }
+
+
+class DialogueFragment:
+    """
+    一段对话 HTML 的不可变响应体：内容摘要（用作 URL 和 ETag）以及预先压缩好的各编码版本。
+    压缩结果不比原文小时不保留该编码。
+    """
+    __slots__ = ('digest', 'bodies')
+
+    @classmethod
+    def prebuilt(cls, digest, bodies):
+        """由已经计算好的摘要和各编码版本构造（快照中读出的片段）"""
+        fragment = cls.__new__(cls)
+        fragment.digest = digest
+        fragment.bodies = bodies
+        return fragment
+
+    def __init__(self, html):
+        body = html.encode('utf-8')
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        self.bodies = {'identity': body}
+        compressed = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed['br'] = brotli.compress(body, quality=BROTLI_QUALITY)
+        for encoding, data in compressed.items():
+            if len(data) < len(body):
+                self.bodies[encoding] = data
+
+
+# 默认每个模型一个 jsonl 文件，文件名即模型名
+DEFAULT_PATTERN = '*.jsonl'
+
+
+def list_model_files(data_dir, pattern=DEFAULT_PATTERN):
+    """
+    返回数据目录下的 (model_name, file_path) 列表。pattern 是相对于 data_dir 的通配符：
+    不含目录时模型名取文件名（如 '*.jsonl'），含目录时取第一级目录名
+    （如 '*/DoctorHistory_x_PatientEmotion/log_merged.jsonl'）。
+    """
+    paths = sorted(glob.glob(os.path.join(glob.escape(data_dir), pattern)))
+    model_files = []
+    for path in paths:
+        relative = os.path.relpath(path, data_dir)
+        parts = relative.split(os.sep)
+        model_name = parts[0] if len(parts) > 1 else os.path.splitext(parts[0])[0]
+        model_files.append((model_name, path))
+    return sorted(model_files)
+
+
+def source_fingerprint(model_files, data_dir):
+    """用文件路径（相对于 data_dir）、大小和修改时间标识一组源文件，用于判断持久化索引是否过期"""
+    fingerprint = []
+    for model_name, path in model_files:
+        st = os.stat(path)
+        fingerprint.append([os.path.relpath(path, data_dir), st.st_size, st.st_mtime_ns])
+    return fingerprint
+
+
+class EagerDialogueStore:
+    """启动时解析并渲染全部记录，常驻内存（原 load_data 的行为）"""
+
+    def __init__(self, data_dir, pattern=DEFAULT_PATTERN):
+        self.data_dir = data_dir
+        self._data = {}
+        self._fragments = {}
+        self._memory_bytes = 0
+        if not os.path.exists(data_dir):
+            print(f"Warning: Data directory '{data_dir}' not found.")
+            return
+
+        for model_name, path in list_model_files(data_dir, pattern):
+            file_name = os.path.relpath(path, data_dir)
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        case_id = str(record.get('case_id'))
+                        if not case_id: continue
+                        self._data.setdefault(case_id, {})[model_name] = render_record(record)
+                    except json.JSONDecodeError:
+                        print(f"Warning: Skipping invalid JSON line in {file_name}")
+
+        # 对话片段在启动时一次性压缩好
+        for case_id, models in self._data.items():
+            for model_name, rendered in models.items():
+                fragment = DialogueFragment(rendered['dialogue'])
+                self._fragments[(case_id, model_name)] = fragment
+                self._memory_bytes += len(rendered['dialogue']) + sum(len(body) for body in fragment.bodies.values())
+
+    def memory_bytes(self):
+        """常驻内存的粗略估计：渲染后的对话文本及其各编码版本"""
+        return self._memory_bytes
+
+    def case_models(self):
+        """返回 {case_id: [model, ...]}"""
+        return {case_id: list(models.keys()) for case_id, models in self._data.items()}
+
+    def get(self, case_id, model_name):
+        return self._data.get(case_id, {}).get(model_name)
+
+    def fragment(self, case_id, model_name):
+        """返回对话的 DialogueFragment，不存在时返回 None"""
+        return self._fragments.get((case_id, model_name))
+
+    def category(self, case_id):
+        """返回病例的科室类别（取第一个模型的记录），未知时返回 None"""
+        models = self._data.get(case_id)
+        if not models:
+            return None
+        return models[min(models)].get('category')
+
+
+class LazyDialogueStore:
+    """
+    启动时只记录每个 (case_id, model) 在源文件中的字节偏移，
+    需要时再读取、解析并渲染，渲染结果放在有容量上限的 LRU 缓存中。
+    压缩后的对话片段同样在首次请求时生成，并放在另一个同样大小的 LRU 缓存中。
+    偏移索引会持久化到 index_path，源文件未变化时直接加载。
+    """
+
+    def __init__(self, data_dir, index_path=None, cache_size=1024, pattern=DEFAULT_PATTERN):
+        self.data_dir = data_dir
+        self.index_path = index_path
+        self._files = []
+        self._offsets = {}
+        if not os.path.exists(data_dir):
+            print(f"Warning: Data directory '{data_dir}' not found.")
+        else:
+            model_files = list_model_files(data_dir, pattern)
+            fingerprint = source_fingerprint(model_files, data_dir)
+            if not self._load_index(fingerprint):
+                self._build_index(model_files)
+                self._save_index(fingerprint)
+        self._load_cached = functools.lru_cache(maxsize=cache_size)(self._load)
+        self._fragment_cached = functools.lru_cache(maxsize=cache_size)(self._build_fragment)
+        # case_id -> 类别，首次查询时读取一条记录后缓存（类别很短，全部缓存也不占多少内存）
+        self._categories = {}
+
+    def _build_index(self, model_files):
+        self._files = [path for _, path in model_files]
+        self._offsets = {}
+        for file_idx, (model_name, path) in enumerate(model_files):
+            file_name = os.path.relpath(path, self.data_dir)
+            offset = 0
+            with open(path, 'rb') as f:
+                for line in f:
+                    length = len(line)
+                    case_id = self._parse_case_id(line)
+                    if case_id is None:
+                        if line.strip():
+                            print(f"Warning: Skipping invalid JSON line in {file_name}")
+                    else:
+                        self._offsets.setdefault(case_id, {})[model_name] = (file_idx, offset, length)
+                    offset += length
+
+    @staticmethod
+    def _parse_case_id(line):
+        match = _CASE_ID_RE.match(line)
+        if match:
+            value = match.group(1) if match.group(1) is not None else match.group(2)
+            return value.decode('utf-8')
+        # 其他情况退回完整解析
+        try:
+            record = json.loads(line)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return None
+        if not isinstance(record, dict):
+            return None
+        return str(record.get('case_id'))
+
+    def _load_index(self, fingerprint):
+        if not self.index_path or not os.path.exists(self.index_path):
+            return False
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return False
+        if saved.get('version') != INDEX_VERSION or saved.get('fingerprint') != fingerprint:
+            return False
+        self._files = [os.path.join(self.data_dir, name) for name in saved['files']]
+        self._offsets = {}
+        for case_id, model_name, file_idx, offset, length in saved['entries']:
+            self._offsets.setdefault(case_id, {})[model_name] = (file_idx, offset, length)
+        return True
+
+    def _save_index(self, fingerprint):
+        if not self.index_path:
+            return
+        entries = [
+            [case_id, model_name, file_idx, offset, length]
+            for case_id, models in self._offsets.items()
+            for model_name, (file_idx, offset, length) in models.items()
+        ]
+        saved = {
+            "version": INDEX_VERSION,
+            "fingerprint": fingerprint,
+            "files": [os.path.relpath(path, self.data_dir) for path in self._files],
+            "entries": entries,
+        }
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(saved, f, ensure_ascii=False)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            print(f"Warning: Could not persist dialogue index to '{self.index_path}': {e}")
+
+    def _load(self, case_id, model_name):
+        file_idx, offset, length = self._offsets[case_id][model_name]
+        with open(self._files[file_idx], 'rb') as f:
+            f.seek(offset)
+            line = f.read(length)
+        return render_record(json.loads(line))
+
+    def _build_fragment(self, case_id, model_name):
+        return DialogueFragment(self._load_cached(case_id, model_name)['dialogue'])
+
+    def case_models(self):
+        """返回 {case_id: [model, ...]}"""
+        return {case_id: list(models.keys()) for case_id, models in self._offsets.items()}
+
+    def get(self, case_id, model_name):
+        if model_name not in self._offsets.get(case_id, {}):
+            return None
+        try:
+            return self._load_cached(case_id, model_name)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Error reading dialogue ({case_id}, {model_name}): {e}")
+            return None
+
+    def fragment(self, case_id, model_name):
+        """返回对话的 DialogueFragment，不存在或读取失败时返回 None"""
+        if model_name not in self._offsets.get(case_id, {}):
+            return None
+        try:
+            return self._fragment_cached(case_id, model_name)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Error reading dialogue ({case_id}, {model_name}): {e}")
+            return None
+
+    def category(self, case_id):
+        """返回病例的科室类别（取第一个模型的记录），未知时返回 None"""
+        if case_id not in self._categories:
+            models = self._offsets.get(case_id)
+            if not models:
+                return None
+            record = self.get(case_id, min(models))
+            if record is None:
+                return None
+            self._categories[case_id] = record.get('category')
+        return self._categories[case_id]
+
+    def cache_info(self):
+        return self._load_cached.cache_info()
+
+    def memory_bytes(self):
+        """常驻内存的粗略估计：偏移索引加上两个 LRU 缓存中的条目"""
+        entries = sum(len(models) for models in self._offsets.values())
+        cached = self._load_cached.cache_info().currsize + self._fragment_cached.cache_info().currsize
+        return entries * LAZY_INDEX_ENTRY_BYTES + cached * LAZY_CACHE_ENTRY_BYTES
+
+
+# --- 二进制快照 ---
+# 快照文件布局（数组均为小端、8 字节对齐，便于直接 mmap 后用 numpy 读取）：
+#   SNAPSHOT_MAGIC | uint32 版本 | uint32 头部长度 | 头部 JSON
+#   头部 JSON：源文件指纹、模型表、病例表、类别表，以及各数组和文本缓冲区的位置
+#   数组：每个 (case, model) 一项，按病例分组，病例内按模型文件顺序排列
+#   文本缓冲区：对话 HTML（原文 / gzip / br）和 choices 的 JSON，连续存放
+# 快照只读共享：gunicorn 的多个 worker mmap 同一个文件，页面由操作系统的页缓存共享。
+SNAPSHOT_MAGIC = b'DLGSNAP\0'
+SNAPSHOT_VERSION = 1
+SNAPSHOT_ALIGN = 8
+# spans 每行的列：各段内容在文本缓冲区中的 (偏移, 长度)，长度为 0 表示没有该编码
+SNAPSHOT_SPAN_COLUMNS = ('identity', 'gzip', 'br', 'choices')
+
+
+def _pad(f):
+    f.write(b'\0' * (-f.tell() % SNAPSHOT_ALIGN))
+
+
+def build_snapshot(data_dir, snapshot_path, model_files=None, pattern=DEFAULT_PATTERN):
+    """
+    把数据目录下的 jsonl 编译成二进制快照：逐条解析、渲染并压缩，文本直接写入临时文件，
+    内存中只保留定长数组。写完后原子替换 snapshot_path，返回条目数。
+    """
+    model_files = model_files if model_files is not None else list_model_files(data_dir, pattern)
+    models = [model_name for model_name, _ in model_files]
+    case_index, categories, category_index = {}, [], {}
+    entries = []  # (case_idx, model_idx, category_idx, digest, spans)
+
+    directory = os.path.dirname(os.path.abspath(snapshot_path))
+    with tempfile.TemporaryFile(dir=directory) as text:
+        def write_text(data):
+            offset = text.tell()
+            text.write(data)
+            return offset, len(data)
+
+        for model_idx, (model_name, path) in enumerate(model_files):
+            file_name = os.path.relpath(path, data_dir)
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        print(f"Warning: Skipping invalid JSON line in {file_name}")
+                        continue
+                    case_id = str(record.get('case_id'))
+                    rendered = render_record(record)
+                    fragment = DialogueFragment(rendered['dialogue'])
+                    spans = []
+                    for encoding in SNAPSHOT_SPAN_COLUMNS[:-1]:
+                        spans.extend(write_text(fragment.bodies[encoding]) if encoding in fragment.bodies else (0, 0))
+                    spans.extend(write_text(json.dumps(rendered['choices'], ensure_ascii=False).encode('utf-8')))
+                    category = json.dumps(rendered['category'], ensure_ascii=False)
+                    if category not in category_index:
+                        category_index[category] = len(categories)
+                        categories.append(category)
+                    case_idx = case_index.setdefault(case_id, len(case_index))
+                    entries.append((case_idx, model_idx, category_index[category], fragment.digest, spans))
+
+        # 同一病例的条目相邻，病例按首次出现的顺序、病例内按模型文件顺序（与 EagerDialogueStore 一致）
+        # 同一模型文件中重复的 case_id 以最后一条为准
+        latest = {(entry[0], entry[1]): entry for entry in entries}
+        entries = sorted(latest.values(), key=lambda entry: (entry[0], entry[1]))
+        n = len(entries)
+        arrays = {
+            'entry_model': np.array([e[1] for e in entries], dtype='<u2'),
+            'entry_category': np.array([e[2] for e in entries], dtype='<u4'),
+            'case_start': np.searchsorted(np.array([e[0] for e in entries], dtype='<i8'),
+                                          np.arange(len(case_index) + 1)).astype('<i8'),
+            'digests': np.array([e[3].encode('ascii') for e in entries], dtype='S16').reshape(n),
+            'spans': np.array([e[4] for e in entries], dtype='<i8').reshape(n, 2 * len(SNAPSHOT_SPAN_COLUMNS)),
+        }
+
+        header = {
+            "fingerprint": source_fingerprint(model_files, data_dir),
+            "models": models,
+            "cases": list(case_index),
+            "categories": categories,
+            "arrays": {},
+        }
+        # 先估计头部长度，数组位置依赖头部长度；位置写成定宽数字，保证两次序列化长度一致
+        position = 0
+        for name, array in arrays.items():
+            header["arrays"][name] = [f"{position:016d}", array.dtype.str, list(array.shape)]
+            position += -(-array.nbytes // SNAPSHOT_ALIGN) * SNAPSHOT_ALIGN
+        header["text"] = f"{position:016d}"
+        header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        base = -(-(len(SNAPSHOT_MAGIC) + 8 + len(header_bytes)) // SNAPSHOT_ALIGN) * SNAPSHOT_ALIGN
+        for name in arrays:
+            header["arrays"][name][0] = f"{base + int(header['arrays'][name][0]):016d}"
+        header["text"] = f"{base + int(header['text']):016d}"
+        header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+
+        tmp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as out:
+            out.write(SNAPSHOT_MAGIC)
+            out.write(struct.pack('<II', SNAPSHOT_VERSION, len(header_bytes)))
+            out.write(header_bytes)
+            for array in arrays.values():
+                _pad(out)
+                out.write(array.tobytes())
+            _pad(out)
+            text.seek(0)
+            while True:
+                block = text.read(1 << 20)
+                if not block:
+                    break
+                out.write(block)
+        os.replace(tmp_path, snapshot_path)
+    return n
+
+
+def read_snapshot_header(snapshot_path):
+    """读取快照头部，文件不存在或格式不符时返回 None"""
+    try:
+        with open(snapshot_path, 'rb') as f:
+            prefix = f.read(len(SNAPSHOT_MAGIC) + 8)
+            if len(prefix) < len(SNAPSHOT_MAGIC) + 8 or prefix[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                return None
+            version, header_len = struct.unpack('<II', prefix[len(SNAPSHOT_MAGIC):])
+            if version != SNAPSHOT_VERSION:
+                return None
+            return json.loads(f.read(header_len))
+    except (OSError, ValueError):
+        return None
+
+
+class SnapshotDialogueStore:
+    """
+    从二进制快照读取对话：启动时只 mmap 快照文件并读取头部中的模型 / 病例表，
+    对话 HTML 及其压缩版本直接从映射的页面中切出，不再解析 JSON 或压缩。
+    快照的源文件指纹与数据目录不一致时自动重建（多个进程同时启动时用文件锁只构建一次）。
+    """
+
+    def __init__(self, data_dir, snapshot_path, pattern=DEFAULT_PATTERN):
+        self.data_dir = data_dir
+        self.snapshot_path = snapshot_path
+        self._mmap = None
+        self._models = []
+        self._cases = {}
+        if not os.path.exists(data_dir):
+            print(f"Warning: Data directory '{data_dir}' not found.")
+            return
+
+        model_files = list_model_files(data_dir, pattern)
+        fingerprint = source_fingerprint(model_files, data_dir)
+        header = read_snapshot_header(snapshot_path)
+        if header is None or header.get('fingerprint') != fingerprint:
+            header = self._rebuild(model_files, fingerprint)
+        self._open(header)
+
+    def _rebuild(self, model_files, fingerprint):
+        lock_file = open(f"{self.snapshot_path}.lock", 'w') if fcntl is not None else None
+        try:
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # 等锁期间其他进程可能已经构建完成
+            header = read_snapshot_header(self.snapshot_path)
+            if header is None or header.get('fingerprint') != fingerprint:
+                count = build_snapshot(self.data_dir, self.snapshot_path, model_files)
+                print(f"Built dialogue snapshot '{self.snapshot_path}' ({count} dialogues).")
+                header = read_snapshot_header(self.snapshot_path)
+            return header
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+
+    def _open(self, header):
+        with open(self.snapshot_path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        arrays = {
+            name: np.frombuffer(self._mmap, dtype=np.dtype(dtype), count=int(np.prod(shape)),
+                                offset=int(offset)).reshape(shape)
+            for name, (offset, dtype, shape) in header['arrays'].items()
+        }
+        self._entry_model = arrays['entry_model']
+        self._entry_category = arrays['entry_category']
+        self._case_start = arrays['case_start']
+        self._digests = arrays['digests']
+        self._spans = arrays['spans']
+        self._text_base = int(header['text'])
+        self._models = header['models']
+        self._categories = [json.loads(category) for category in header['categories']]
+        self._cases = {case_id: idx for idx, case_id in enumerate(header['cases'])}
+        self._model_index = {model_name: idx for idx, model_name in enumerate(self._models)}
+
+    def _entry(self, case_id, model_name):
+        case_idx = self._cases.get(case_id)
+        model_idx = self._model_index.get(model_name)
+        if case_idx is None or model_idx is None:
+            return None
+        start, end = int(self._case_start[case_idx]), int(self._case_start[case_idx + 1])
+        # 病例内的条目按模型编号升序排列
+        pos = start + int(np.searchsorted(self._entry_model[start:end], model_idx))
+        if pos < end and self._entry_model[pos] == model_idx:
+            return pos
+        return None
+
+    def _text(self, entry, column):
+        offset, length = self._spans[entry, 2 * column:2 * column + 2].tolist()
+        if not length:
+            return None
+        start = self._text_base + offset
+        return self._mmap[start:start + length]
+
+    def memory_bytes(self):
+        """
+        进程私有内存的粗略估计：从头部解析出的病例、模型和类别表。
+        映射的页面（数组与对话文本）属于页缓存，多个进程共享，内存紧张时由内核回收，
+        关闭快照也不会释放它们，因此不计入活动的内存预算。
+        """
+        if self._mmap is None:
+            return 0
+        entries = len(self._cases) + 2 * len(self._models) + len(self._categories)
+        return entries * SNAPSHOT_TABLE_ENTRY_BYTES
+
+    def case_models(self):
+        """返回 {case_id: [model, ...]}"""
+        models = [self._models[idx] for idx in self._entry_model.tolist()] if self._cases else []
+        starts = self._case_start.tolist() if self._cases else []
+        return {case_id: models[starts[idx]:starts[idx + 1]] for case_id, idx in self._cases.items()}
+
+    def get(self, case_id, model_name):
+        entry = self._entry(case_id, model_name)
+        if entry is None:
+            return None
+        return {
+            # 空对话的片段长度为 0，_text 返回 None
+            "dialogue": (self._text(entry, 0) or b'').decode('utf-8'),
+            "choices": json.loads(self._text(entry, SNAPSHOT_SPAN_COLUMNS.index('choices')) or b'null'),
+            "category": self._categories[int(self._entry_category[entry])],
+        }
+
+    def fragment(self, case_id, model_name):
+        """返回对话的 DialogueFragment，不存在时返回 None"""
+        entry = self._entry(case_id, model_name)
+        if entry is None:
+            return None
+        bodies = {}
+        for column, encoding in enumerate(SNAPSHOT_SPAN_COLUMNS[:-1]):
+            body = self._text(entry, column)
+            if body is not None or encoding == 'identity':
+                bodies[encoding] = body or b''
+        return DialogueFragment.prebuilt(self._digests[entry].decode('ascii'), bodies)
+
+    def category(self, case_id):
+        """返回病例的科室类别（取第一个模型的记录），未知时返回 None"""
+        case_idx = self._cases.get(case_id)
+        if case_idx is None:
+            return None
+        start, end = int(self._case_start[case_idx]), int(self._case_start[case_idx + 1])
+        if start == end:
+            return None
+        entries = range(start, end)
+        first = min(entries, key=lambda entry: self._models[int(self._entry_model[entry])])
+        return self._categories[int(self._entry_category[first])]
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="把数据目录下的 jsonl 编译为二进制对话快照（DATA_STORE_MODE=snapshot 使用）")
+    parser.add_argument('data_dir', nargs='?', default=os.environ.get('DATA_DIR', './data'))
+    parser.add_argument('--pattern', default=DEFAULT_PATTERN, help="相对于 data_dir 的源文件通配符")
+    parser.add_argument('--output', default=None, help="快照路径，默认 <data_dir>/.dialogue_snapshot.bin")
+    args = parser.parse_args()
+    output = args.output or os.path.join(args.data_dir, '.dialogue_snapshot.bin')
+    count = build_snapshot(args.data_dir, output, pattern=args.pattern)
+    print(f"Built dialogue snapshot '{output}' ({count} dialogues).")
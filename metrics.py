@@ -0,0 +1,315 @@
+# metrics.py
+"""
+进程内的请求 / 查询埋点，以 Prometheus 文本格式输出。
+
+- 每个路由的请求耗时直方图、每个请求的 SQL 查询条数和单条查询耗时；
+- 各标注活动的语料规模与内存占用、各标注员待办任务数、分析页计算耗时等 gauge；
+- 每次提交写入的标注条数、合并的请求数与提交耗时，以及组提交队列的长度；
+- 请求耗时超过阈值时写一条慢请求日志，按阶段（数据库读取、集合运算、JSON 序列化、模板渲染）拆分耗时。
+
+指标按进程维护，gunicorn 多 worker 时每个 worker 各自统计。
+"""
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# 慢请求日志中的阶段名称
+STAGE_DB = 'db_read'
+STAGE_SET_ARITHMETIC = 'set_arithmetic'
+STAGE_JSON = 'json_serialization'
+STAGE_TEMPLATE = 'template_render'
+
+slow_request_logger = logging.getLogger('annotation.slow_requests')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """可直接 set，也可以通过 set_function 在抓取时计算（返回单个值或 {标签元组: 值}）"""
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            result = self._function()
+            if not isinstance(result, dict):
+                result = {(): result}
+            items = [(tuple(zip(self.labelnames, key)), value) for key, value in result.items()]
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{_format_labels(key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, (list(counts), total, n)) for key, (counts, total, n) in self._values.items()]
+        lines = []
+        for key, (counts, total, n) in items:
+            for bound, count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(key + (('le', _format_value(bound)),))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {n}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+REQUEST_DURATION = registry.register(Histogram(
+    'annotation_http_request_duration_seconds', 'Request latency by route.', ('endpoint', 'method', 'status')))
+REQUEST_QUERIES = registry.register(Histogram(
+    'annotation_db_queries_per_request', 'Number of SQL statements executed per request.', ('endpoint',),
+    buckets=QUERY_COUNT_BUCKETS))
+QUERY_DURATION = registry.register(Histogram(
+    'annotation_db_query_duration_seconds', 'Duration of individual SQL statements.', ('endpoint',)))
+SLOW_REQUESTS = registry.register(Counter(
+    'annotation_slow_requests_total', 'Requests slower than the slow-request threshold.', ('endpoint',)))
+CORPUS_SIZE = registry.register(Gauge(
+    'annotation_corpus_size', 'Size of the dialogue corpus of each loaded campaign.', ('campaign', 'unit')))
+CORPUS_RESIDENT_BYTES = registry.register(Gauge(
+    'annotation_corpus_resident_bytes', 'Estimated memory of the open dialogue corpora.', ('campaign',)))
+PENDING_TASKS = registry.register(Gauge(
+    'annotation_pending_tasks', 'Pending comparison tasks per annotator.', ('campaign', 'annotator_id')))
+WRITE_BATCH_ROWS = registry.register(Histogram(
+    'annotation_write_batch_rows', 'Annotations written per commit.', ('mode',), buckets=BATCH_SIZE_BUCKETS))
+WRITE_BATCH_SUBMISSIONS = registry.register(Histogram(
+    'annotation_write_batch_submissions', 'Submissions (requests) sharing one commit.', ('mode',),
+    buckets=BATCH_SIZE_BUCKETS))
+WRITE_COMMIT_SECONDS = registry.register(Histogram(
+    'annotation_write_commit_seconds', 'Time to write and commit one group of annotations.', ('mode',)))
+WRITE_QUEUE_DEPTH = registry.register(Gauge(
+    'annotation_write_queue_depth', 'Submissions waiting for the group-commit writer.'))
+ANALYTICS_SECONDS = registry.register(Gauge(
+    'annotation_analytics_compute_seconds', 'Time spent computing the last analytics page.', ('part',)))
+
+
+def _stage_begin():
+    """记录开始时间和此刻各阶段已记入的总耗时"""
+    return time.perf_counter(), sum(g.metrics_stages.values())
+
+
+def _stage_end(name, begin):
+    """
+    把自 begin 以来的耗时记入阶段 name，扣除期间记入其他阶段的部分（例如阶段内执行的 SQL 已记入 db_read），
+    使各阶段互不重叠，加起来不超过请求总耗时。
+    """
+    start, accounted = begin
+    nested = sum(g.metrics_stages.values()) - accounted
+    elapsed = max(time.perf_counter() - start - nested, 0.0)
+    g.metrics_stages[name] = g.metrics_stages.get(name, 0.0) + elapsed
+
+
+@contextmanager
+def stage(name):
+    """把代码块的耗时记入当前请求的某个阶段（不在请求中时不做记录）"""
+    if not (has_request_context() and hasattr(g, 'metrics_stages')):
+        yield
+        return
+    begin = _stage_begin()
+    try:
+        yield
+    finally:
+        _stage_end(name, begin)
+
+
+def _endpoint_label():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """记录 jsonify 的序列化耗时"""
+
+    def dumps(self, obj, **kwargs):
+        with stage(STAGE_JSON):
+            return super().dumps(obj, **kwargs)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and hasattr(g, 'metrics_stages'):
+        context._metrics_query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, '_metrics_query_start', None)
+    if start is None or not has_request_context() or not hasattr(g, 'metrics_stages'):
+        return
+    elapsed = time.perf_counter() - start
+    g.metrics_queries += 1
+    g.metrics_stages[STAGE_DB] = g.metrics_stages.get(STAGE_DB, 0.0) + elapsed
+    QUERY_DURATION.observe(elapsed, endpoint=_endpoint_label())
+
+
+def _before_render(sender, template, context, **extra):
+    if hasattr(g, 'metrics_stages'):
+        g.metrics_template_begin = _stage_begin()
+
+
+def _after_render(sender, template, context, **extra):
+    begin = g.pop('metrics_template_begin', None)
+    if begin is not None and hasattr(g, 'metrics_stages'):
+        _stage_end(STAGE_TEMPLATE, begin)
+
+
+def init_app(app, slow_request_seconds=1.0, slow_request_log=None):
+    """
+    注册请求钩子、SQLAlchemy 事件和模板信号。
+    slow_request_log 为文件路径时慢请求写入该文件，否则输出到标准错误。
+    """
+    app.json_provider_class = TimedJSONProvider
+    app.json = TimedJSONProvider(app)
+
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    if not slow_request_logger.handlers:
+        handler = logging.FileHandler(slow_request_log, encoding='utf-8') if slow_request_log else logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        slow_request_logger.addHandler(handler)
+        slow_request_logger.setLevel(logging.INFO)
+        slow_request_logger.propagate = False
+
+    @app.before_request
+    def start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_stages = {}
+
+    @app.after_request
+    def finish_request_metrics(response):
+        if not hasattr(g, 'metrics_start'):
+            return response
+        metrics = g._get_current_object()
+        # 只记录路径，不记录查询参数（其中可能含有访问密码）
+        endpoint, method, path = _endpoint_label(), request.method, request.path
+
+        def record():
+            # 流式响应在全部发送完毕后才记录，包含生成响应体期间的查询
+            elapsed = time.perf_counter() - metrics.metrics_start
+            REQUEST_DURATION.observe(elapsed, endpoint=endpoint, method=method, status=str(response.status_code))
+            REQUEST_QUERIES.observe(metrics.metrics_queries, endpoint=endpoint)
+            if elapsed >= slow_request_seconds:
+                SLOW_REQUESTS.inc(endpoint=endpoint)
+                stages = {name: round(seconds * 1000, 2) for name, seconds in metrics.metrics_stages.items()}
+                stages['other'] = round(max(elapsed * 1000 - sum(stages.values()), 0.0), 2)
+                slow_request_logger.info(json.dumps({
+                    "method": method,
+                    "path": path,
+                    "endpoint": endpoint,
+                    "status": response.status_code,
+                    "total_ms": round(elapsed * 1000, 2),
+                    "queries": metrics.metrics_queries,
+                    "stages_ms": stages,
+                }, ensure_ascii=False))
+
+        if response.is_streamed:
+            response.call_on_close(record)
+        else:
+            record()
+        return response
@@ -0,0 +1,131 @@
+# migrate_annotations.py
+"""
+把旧版 annotation 表（模型名和胜者均为 String(80)、无索引、允许重复）迁移到
+models.Annotation 的紧凑结构：
+  1. 旧表重命名为 annotation_legacy（保留原始数据，不做删除）；
+  2. 创建新表及索引；
+  3. 按 (timestamp, id) 顺序分批读取旧数据并编码写入，同一标注员对同一任务的
+     重复提交只保留最后一条；
+  4. 重建分析汇总表。
+可以通过 `flask --app app migrate-annotations` 手动执行，应用启动时检测到旧表也会自动执行。
+
+引入标注活动（campaign）之前创建的表由 upgrade_campaign_schema 升级：annotation 表补上
+campaign 列（已有标注归入默认活动）并重建唯一索引，汇总表直接删除，之后重新生成。
+"""
+import sqlalchemy as sa
+from calculate_ranking import METRIC_KEYS
+from models import (
+    db, Annotation, PairwiseCount, TaskLabelCount, ModelRating, AnnotatorTotal, ResultCube,
+    dialect_insert, encode_pair, encode_winner, model_names, DEFAULT_CAMPAIGN
+)
+from aggregates import rebuild_aggregates
+
+LEGACY_TABLE = 'annotation_legacy'
+MIGRATION_CHUNK_SIZE = 5000
+
+
+def has_legacy_schema():
+    """annotation 表仍是旧结构（含 model_a 字符串列）时返回 True"""
+    inspector = sa.inspect(db.engine)
+    if not inspector.has_table(Annotation.__tablename__):
+        return False
+    columns = {col['name'] for col in inspector.get_columns(Annotation.__tablename__)}
+    return 'model_a' in columns
+
+
+def upgrade_campaign_schema():
+    """
+    为缺少 campaign 列的表升级结构，返回是否做了修改。
+    旧版 annotation 表（含 model_a）由 migrate_legacy_annotations 处理，这里跳过。
+    汇总表的主键发生了变化，删除后由 db.create_all 重建，再从原始标注重新生成。
+    """
+    inspector = sa.inspect(db.engine)
+    upgraded = False
+    for model in (PairwiseCount, TaskLabelCount, ModelRating, AnnotatorTotal, ResultCube):
+        table = model.__table__
+        if inspector.has_table(table.name) and 'campaign' not in {col['name'] for col in inspector.get_columns(table.name)}:
+            table.drop(db.engine)
+            upgraded = True
+
+    table_name = Annotation.__tablename__
+    if inspector.has_table(table_name):
+        columns = {col['name'] for col in inspector.get_columns(table_name)}
+        if 'model_a' not in columns and 'campaign' not in columns:
+            with db.engine.begin() as conn:
+                conn.execute(sa.text(
+                    f"ALTER TABLE {table_name} ADD COLUMN campaign VARCHAR(80) NOT NULL DEFAULT '{DEFAULT_CAMPAIGN}'"
+                ))
+                # 唯一索引需要加上 campaign，由启动时的 index.create 重新创建
+                conn.execute(sa.text('DROP INDEX IF EXISTS ux_annotation_task'))
+            upgraded = True
+    return upgraded
+
+
+def _flush_chunk(rows):
+    """写入一批编码后的行；同一批内的重复任务先在内存中去重（保留最后一条）"""
+    if not rows:
+        return
+    deduped = {}
+    for row in rows:
+        deduped[(row['campaign'], row['annotator_id'], row['case_id'], row['model_lo'], row['model_hi'])] = row
+    stmt = dialect_insert(Annotation)
+    if stmt is None:
+        raise RuntimeError("Annotation migration requires PostgreSQL or SQLite.")
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['campaign', 'annotator_id', 'case_id', 'model_lo', 'model_hi'],
+        set_={col: stmt.excluded[col] for col in ['a_is_lo', 'timestamp', *METRIC_KEYS]}
+    )
+    db.session.execute(stmt, list(deduped.values()))
+
+
+def migrate_legacy_annotations(chunk_size=MIGRATION_CHUNK_SIZE):
+    """执行迁移，返回 (读取的旧行数, 因胜者标签无法识别而跳过的行数)"""
+    with db.engine.begin() as conn:
+        # 索引名在数据库内全局唯一，先删掉旧表上的索引，新表会重新创建
+        conn.execute(sa.text('DROP INDEX IF EXISTS ix_annotation_timestamp_id'))
+        conn.execute(sa.text(f'ALTER TABLE {Annotation.__tablename__} RENAME TO {LEGACY_TABLE}'))
+    db.create_all()
+    model_names.invalidate()
+
+    legacy = sa.Table(LEGACY_TABLE, sa.MetaData(), autoload_with=db.engine)
+    stmt = sa.select(legacy).order_by(legacy.c.timestamp.asc(), legacy.c.id.asc())
+
+    total = skipped = 0
+    rows = []
+    result = db.session.execute(stmt, execution_options={'yield_per': chunk_size})
+    for legacy_row in result.mappings():
+        total += 1
+        try:
+            model_lo, model_hi, a_is_lo = encode_pair(legacy_row['model_a'], legacy_row['model_b'])
+            winners = {
+                metric_key: encode_winner(legacy_row[metric_key], legacy_row['model_a'], legacy_row['model_b'])
+                for metric_key in METRIC_KEYS
+            }
+        except ValueError as e:
+            skipped += 1
+            print(f"Warning: Skipping legacy annotation {legacy_row['id']}: {e}")
+            continue
+        rows.append(dict(
+            id=legacy_row['id'],
+            campaign=DEFAULT_CAMPAIGN,
+            annotator_id=legacy_row['annotator_id'],
+            case_id=str(legacy_row['case_id']),
+            model_lo=model_lo,
+            model_hi=model_hi,
+            a_is_lo=a_is_lo,
+            timestamp=legacy_row['timestamp'],
+            **winners,
+        ))
+        if len(rows) >= chunk_size:
+            _flush_chunk(rows)
+            rows = []
+    _flush_chunk(rows)
+
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # 显式写入了 id，需要把序列推进到当前最大值之后
+        db.session.execute(sa.text(
+            "SELECT setval(pg_get_serial_sequence('annotation', 'id'), COALESCE(MAX(id), 1)) FROM annotation"
+        ))
+    db.session.commit()
+    rebuild_aggregates()
+    return total, skipped
@@ -0,0 +1,262 @@
+# models.py
+import threading
+from datetime import datetime
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from calculate_ranking import METRIC_KEYS, TIE_LABEL, ELO_INITIAL
+
+db = SQLAlchemy()
+
+# --- 胜者编码 ---
+# 胜者不再以字符串保存，而是相对于该行的规范模型对 (model_lo, model_hi) 编码
+WINNER_TIE = 0
+WINNER_LO = 1
+WINNER_HI = 2
+
+# 未指定标注活动时使用的名称；引入多活动之前的标注都属于该活动
+DEFAULT_CAMPAIGN = 'default'
+
+def campaign_column(**kwargs):
+    """标注活动列：标注和各汇总表都按活动划分命名空间"""
+    return db.Column(db.String(80), nullable=False, default=DEFAULT_CAMPAIGN, server_default=DEFAULT_CAMPAIGN, **kwargs)
+
+# --- 数据库模型定义 ---
+class ModelName(db.Model):
+    """模型名称字典表，标注表中只保存其小整数 id"""
+    # SQLite 只有 INTEGER PRIMARY KEY 才会自增
+    id = db.Column(db.SmallInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    name = db.Column(db.String(80), nullable=False, unique=True)
+
+class Annotation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    campaign = campaign_column()
+    annotator_id = db.Column(db.String(80), nullable=False)
+    case_id = db.Column(db.String(80), nullable=False)
+    # 规范模型对：model_lo 的名称按字典序小于 model_hi
+    model_lo = db.Column(db.SmallInteger, db.ForeignKey('model_name.id'), nullable=False)
+    model_hi = db.Column(db.SmallInteger, db.ForeignKey('model_name.id'), nullable=False)
+    # 页面上模型 A 是否为 model_lo（保留 A/B 的展示顺序）
+    a_is_lo = db.Column(db.Boolean, nullable=False)
+    winner_coherence = db.Column(db.SmallInteger, nullable=False)
+    winner_adherence = db.Column(db.SmallInteger, nullable=False)
+    winner_clarity = db.Column(db.SmallInteger, nullable=False)
+    winner_empathy = db.Column(db.SmallInteger, nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # 同一活动中每个标注员对同一个任务只保留一条标注，重复提交变为更新
+        db.Index('ux_annotation_task', 'campaign', 'annotator_id', 'case_id', 'model_lo', 'model_hi', unique=True),
+        # /results 按 (timestamp, id) 做键集分页
+        db.Index('ix_annotation_timestamp_id', 'timestamp', 'id'),
+    )
+
+    @property
+    def model_a(self):
+        return model_names.name(self.model_lo if self.a_is_lo else self.model_hi)
+
+    @property
+    def model_b(self):
+        return model_names.name(self.model_hi if self.a_is_lo else self.model_lo)
+
+    def winner_label(self, metric_key):
+        """返回某个指标胜者的名称（模型名或 'tie'）"""
+        return decode_winner(getattr(self, metric_key), self.model_lo, self.model_hi)
+
+# --- 分析汇总表 ---
+# 以下几张表在 submit_annotation 的同一事务中增量更新，/analytics 只读取这些汇总数据。
+# 可通过 `flask --app app rebuild-aggregates` 从原始标注重新生成。每张表的主键都以标注活动开头。
+class PairwiseCount(db.Model):
+    """每个指标下一对模型的胜/负/平计数，model_x < model_y（按字典序）"""
+    campaign = campaign_column(primary_key=True)
+    metric = db.Column(db.String(40), primary_key=True)
+    model_x = db.Column(db.String(80), primary_key=True)
+    model_y = db.Column(db.String(80), primary_key=True)
+    x_wins = db.Column(db.Integer, nullable=False, default=0)
+    y_wins = db.Column(db.Integer, nullable=False, default=0)
+    ties = db.Column(db.Integer, nullable=False, default=0)
+    comparisons = db.Column(db.Integer, nullable=False, default=0)
+
+class TaskLabelCount(db.Model):
+    """每个指标下每个任务各标签的计数；rater_count 只计每个标注员的第一条（用于 Krippendorff's alpha）"""
+    campaign = campaign_column(primary_key=True)
+    metric = db.Column(db.String(40), primary_key=True)
+    task_id = db.Column(db.String(255), primary_key=True)
+    label = db.Column(db.String(80), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    rater_count = db.Column(db.Integer, nullable=False, default=0)
+
+class ModelRating(db.Model):
+    """按提交顺序增量更新的 Elo 分数"""
+    campaign = campaign_column(primary_key=True)
+    metric = db.Column(db.String(40), primary_key=True)
+    model = db.Column(db.String(80), primary_key=True)
+    elo = db.Column(db.Float, nullable=False, default=ELO_INITIAL)
+
+class ResultCube(db.Model):
+    """按 指标 × 类别 × 标注员 × 模型对 汇总的胜/负/平计数，model_x < model_y（按字典序），用于任意切片的排名"""
+    campaign = campaign_column(primary_key=True)
+    metric = db.Column(db.String(40), primary_key=True)
+    category = db.Column(db.String(80), primary_key=True)
+    annotator_id = db.Column(db.String(80), primary_key=True)
+    model_x = db.Column(db.String(80), primary_key=True)
+    model_y = db.Column(db.String(80), primary_key=True)
+    x_wins = db.Column(db.Integer, nullable=False, default=0)
+    y_wins = db.Column(db.Integer, nullable=False, default=0)
+    ties = db.Column(db.Integer, nullable=False, default=0)
+    comparisons = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        # 主键已覆盖按指标 / 类别过滤；只按标注员切片时使用这个索引
+        db.Index('ix_result_cube_annotator', 'campaign', 'annotator_id', 'metric'),
+    )
+
+class AnnotatorTotal(db.Model):
+    """每个标注员的标注条数"""
+    campaign = campaign_column(primary_key=True)
+    annotator_id = db.Column(db.String(80), primary_key=True)
+    annotations = db.Column(db.Integer, nullable=False, default=0)
+
+
+def dialect_insert(model):
+    """返回当前数据库方言的 INSERT 构造（支持 ON CONFLICT），其他方言返回 None"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(model)
+    if dialect == 'sqlite':
+        return sqlite.insert(model)
+    return None
+
+
+def engine_options(database_url, pool_size=5, max_overflow=10, pool_timeout=30, pool_recycle=1800):
+    """
+    create_engine 的连接池参数。SQLite 保持 Flask-SQLAlchemy 的默认设置（PRAGMA 见 configure_sqlite）；
+    其他数据库（Render 上的 PostgreSQL）使用固定大小的连接池，取出连接前先检测，并定期回收长时间存活的连接，
+    避免使用被服务端关闭的空闲连接。
+    """
+    if not database_url or database_url.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': pool_timeout,
+        'pool_recycle': pool_recycle,
+        'pool_pre_ping': True,
+    }
+
+
+def configure_sqlite(engine, synchronous='FULL', busy_timeout_ms=5000):
+    """
+    SQLite 的每个新连接启用 WAL（读写互不阻塞）并设置同步级别与忙等待时间，其他数据库不做任何修改。
+    synchronous=FULL 时提交返回即已落盘；NORMAL 更快，但断电时可能丢失最近提交的事务。
+    """
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute(f'PRAGMA synchronous={synchronous}')
+        cursor.execute(f'PRAGMA busy_timeout={int(busy_timeout_ms)}')
+        cursor.close()
+
+
+class ModelNameRegistry:
+    """进程内缓存的模型名称 <-> id 映射，遇到新名称时写入 ModelName 表"""
+
+    def __init__(self):
+        self._ids = {}
+        self._names = {}
+        self._lock = threading.Lock()
+
+    def reload(self):
+        with self._lock:
+            rows = db.session.query(ModelName.id, ModelName.name).all()
+            self._ids = {name: model_id for model_id, name in rows}
+            self._names = {model_id: name for model_id, name in rows}
+
+    def invalidate(self):
+        """事务回滚后调用，丢弃可能包含未提交 id 的缓存"""
+        with self._lock:
+            self._ids = {}
+            self._names = {}
+
+    def id(self, name):
+        model_id = self._ids.get(name)
+        if model_id is not None:
+            return model_id
+        insert = dialect_insert(ModelName)
+        if insert is not None:
+            db.session.execute(insert.values(name=name).on_conflict_do_nothing(index_elements=['name']))
+        elif db.session.query(ModelName.id).filter_by(name=name).first() is None:
+            db.session.add(ModelName(name=name))
+            db.session.flush()
+        self.reload()
+        return self._ids[name]
+
+    def find(self, name):
+        """只查找、不创建，未知名称返回 None"""
+        if name not in self._ids:
+            self.reload()
+        return self._ids.get(name)
+
+    def name(self, model_id):
+        if model_id not in self._names:
+            self.reload()
+        return self._names.get(model_id)
+
+model_names = ModelNameRegistry()
+
+
+def encode_pair(model_a, model_b):
+    """返回 (model_lo_id, model_hi_id, a_is_lo)"""
+    a_is_lo = model_a <= model_b
+    lo, hi = (model_a, model_b) if a_is_lo else (model_b, model_a)
+    return model_names.id(lo), model_names.id(hi), a_is_lo
+
+
+def encode_winner(label, model_a, model_b):
+    """把胜者名称编码为 WINNER_*；无法识别的标签抛出 ValueError"""
+    lo, hi = sorted((model_a, model_b))
+    if label == lo:
+        return WINNER_LO
+    if label == hi:
+        return WINNER_HI
+    if label == TIE_LABEL:
+        return WINNER_TIE
+    raise ValueError(f"Unknown winner label '{label}' for pair ({model_a}, {model_b})")
+
+
+def decode_winner(code, model_lo, model_hi):
+    if code == WINNER_LO:
+        return model_names.name(model_lo)
+    if code == WINNER_HI:
+        return model_names.name(model_hi)
+    return TIE_LABEL
+
+
+def select_annotation_rows():
+    """
+    返回一个 SELECT，把编码后的标注还原为原来的列：
+    id, timestamp, campaign, annotator_id, case_id, model_a, model_b, winner_*（均为名称）。
+    可以在其上继续追加基于 Annotation 列的 where / order_by。
+    """
+    lo = db.aliased(ModelName)
+    hi = db.aliased(ModelName)
+
+    def winner(column):
+        return db.case(
+            (column == WINNER_LO, lo.name), (column == WINNER_HI, hi.name), else_=TIE_LABEL
+        ).label(column.key)
+
+    return db.select(
+        Annotation.id,
+        Annotation.timestamp,
+        Annotation.campaign,
+        Annotation.annotator_id,
+        Annotation.case_id,
+        db.case((Annotation.a_is_lo, lo.name), else_=hi.name).label('model_a'),
+        db.case((Annotation.a_is_lo, hi.name), else_=lo.name).label('model_b'),
+        *[winner(getattr(Annotation, metric_key)) for metric_key in METRIC_KEYS],
+    ).select_from(Annotation).join(lo, lo.id == Annotation.model_lo).join(hi, hi.id == Annotation.model_hi)
@@ -0,0 +1,276 @@
+# scheduler.py
+"""
+Pair schedulers: decide which (case_id, (model1, model2)) task an annotator gets next.
+
+StaticScheduler keeps the original behaviour: every task is assigned to exactly
+one annotator by the i % len(annotators) rule and served in random order.
+
+AdaptiveScheduler serves tasks from the model pair whose head-to-head outcome
+is currently least certain, and lets a task be judged by up to overlap_quota
+different annotators so that agreement can be measured.
+
+Both keep their state in memory (per process) and are updated on every submit.
+"""
+import math
+import random
+import threading
+import numpy as np
+from task_index import build_annotator_task_index, PendingTaskSet
+
+SCHEDULER_MODES = ('static', 'adaptive')
+
+
+class StaticScheduler:
+    """
+    Fixed modulo assignment. Each annotator's pending tasks are rebuilt from the
+    database once (on first access) via load_completed(annotator_id), and then
+    maintained incrementally.
+    """
+
+    def __init__(self, all_pairs, annotators, load_completed):
+        self._tasks = build_annotator_task_index(all_pairs, annotators)
+        self._load_completed = load_completed
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def _pending_tasks(self, annotator_id):
+        pending = self._pending.get(annotator_id)
+        if pending is not None:
+            return pending
+        with self._lock:
+            pending = self._pending.get(annotator_id)
+            if pending is None:
+                completed = self._load_completed(annotator_id)
+                pending = PendingTaskSet(task for task in self._tasks.get(annotator_id, []) if task not in completed)
+                self._pending[annotator_id] = pending
+        return pending
+
+    def next_tasks(self, annotator_id, n, ttl=None):
+        """Returns up to n random pending tasks, reserving them for ttl seconds when ttl is given."""
+        pending = self._pending_tasks(annotator_id)
+        if ttl is None and n == 1:
+            task = pending.random_choice()
+            return [task] if task is not None else []
+        return pending.reserve_random(n, ttl)
+
+    def release(self, annotator_id):
+        self._pending_tasks(annotator_id).release_all()
+
+    def record(self, annotator_id, task, score_lo):
+        if annotator_id in self._pending:
+            self._pending[annotator_id].discard(task)
+
+    def progress(self, annotator_id):
+        """Returns (completed, pending, total) for the annotator."""
+        total = len(self._tasks.get(annotator_id, []))
+        pending = len(self._pending_tasks(annotator_id))
+        return total - pending, pending, total
+
+    def pending_counts(self):
+        """Pending task counts of the annotators that are already loaded (no database access)."""
+        return {annotator_id: len(pending) for annotator_id, pending in list(self._pending.items())}
+
+
+class AdaptiveScheduler:
+    """
+    Uncertainty-driven scheduling with an overlap quota.
+
+    Each model pair keeps a Beta(1 + score_lo, 1 + score_hi) posterior over the
+    probability that the lexicographically smaller model wins, where a judgment
+    contributes its share of metrics won (ties count half). Its variance is the
+    pair's priority: close matchups with few judgments come first, lopsided or
+    well-measured ones later. When a batch is requested, every pick adds an
+    expected judgment to the chosen pair so that the batch spreads over pairs.
+
+    Within a pair, tasks nobody has judged ('fresh') are preferred; with
+    probability overlap_rate a task already judged by someone else, but fewer
+    than overlap_quota times, is served instead. An annotator never gets a task
+    twice. Each annotator is asked for at most budget judgments.
+
+    Overlap tasks are pooled by the set of annotators who judged them, so the
+    tasks an annotator may still get are whole pools and never have to be
+    filtered one by one. Per-pair and per-annotator counts of overlap tasks
+    already judged are kept up to date on every record, which makes progress
+    and pair availability O(1) / O(pairs) however late the campaign is.
+
+    History is loaded lazily on first use via load_history(), which yields
+    (annotator_id, task, score_lo) for every stored annotation.
+    """
+
+    def __init__(self, all_pairs, annotators, load_history, overlap_quota=2, overlap_rate=0.25, budget=None):
+        self._load_history = load_history
+        self.overlap_quota = max(int(overlap_quota), 1)
+        self.overlap_rate = overlap_rate
+        self.budget = budget if budget is not None else math.ceil(len(all_pairs) / max(len(annotators), 1))
+
+        self._pair_index = {}
+        tasks_by_pair = []
+        for task in all_pairs:
+            models = task[1]
+            if models not in self._pair_index:
+                self._pair_index[models] = len(tasks_by_pair)
+                tasks_by_pair.append([])
+            tasks_by_pair[self._pair_index[models]].append(task)
+        self._tasks_by_pair = tasks_by_pair
+        n_pairs = len(tasks_by_pair)
+        # Beta posterior parameters per model pair: [:, 0] for model_lo, [:, 1] for model_hi
+        self._beta = np.ones((n_pairs, 2))
+        self._fresh = [PendingTaskSet() for _ in range(n_pairs)]
+        self._fresh_total = 0
+        # Per pair: frozenset of judges -> PendingTaskSet of the overlap tasks they judged
+        self._overlap = [{} for _ in range(n_pairs)]
+        self._overlap_size = [0] * n_pairs
+        self._overlap_total = 0
+        # Overlap tasks an annotator has judged, per pair and in total
+        self._overlap_done = [{} for _ in range(n_pairs)]
+        self._overlap_done_total = {}
+        self._judges = {}
+        self._done = {annotator_id: set() for annotator_id in annotators}
+        self._reserved_by = {}
+        self._loaded = False
+        self._lock = threading.RLock()
+
+    def _ensure_loaded(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            for pair_idx, tasks in enumerate(self._tasks_by_pair):
+                for task in tasks:
+                    self._fresh[pair_idx].add(task)
+                self._fresh_total += len(self._fresh[pair_idx])
+            for annotator_id, task, score_lo in self._load_history():
+                self._record(annotator_id, task, score_lo)
+            self._loaded = True
+
+    @staticmethod
+    def _variance(beta):
+        a, b = beta[..., 0], beta[..., 1]
+        total = a + b
+        return a * b / (total * total * (total + 1))
+
+    def _count_overlap(self, pair_idx, judges, delta):
+        self._overlap_size[pair_idx] += delta
+        self._overlap_total += delta
+        done = self._overlap_done[pair_idx]
+        for judge in judges:
+            done[judge] = done.get(judge, 0) + delta
+            self._overlap_done_total[judge] = self._overlap_done_total.get(judge, 0) + delta
+
+    def _record(self, annotator_id, task, score_lo):
+        pair_idx = self._pair_index.get(task[1])
+        if pair_idx is None:
+            return
+        judges = self._judges.setdefault(task, set())
+        if annotator_id in judges:
+            # A re-submission replaces an earlier judgment; the counts stay as they are
+            return
+        previous = frozenset(judges)
+        judges.add(annotator_id)
+        self._done.setdefault(annotator_id, set()).add(task)
+        self._beta[pair_idx] += (score_lo, 1.0 - score_lo)
+        if not previous:
+            if self._fresh[pair_idx].discard(task):
+                self._fresh_total -= 1
+        else:
+            pools = self._overlap[pair_idx]
+            pool = pools.get(previous)
+            if pool is not None and pool.discard(task):
+                self._count_overlap(pair_idx, previous, -1)
+                if not len(pool):
+                    del pools[previous]
+        if len(judges) < self.overlap_quota:
+            key = frozenset(judges)
+            pools = self._overlap[pair_idx]
+            if key not in pools:
+                pools[key] = PendingTaskSet()
+            pools[key].add(task)
+            self._count_overlap(pair_idx, key, 1)
+
+    def record(self, annotator_id, task, score_lo):
+        self._ensure_loaded()
+        with self._lock:
+            self._record(annotator_id, task, score_lo)
+
+    def _pair_eligible(self, pair_idx, annotator_id):
+        """Tasks of the pair the annotator could still be given (reservations aside)."""
+        return (len(self._fresh[pair_idx]) + self._overlap_size[pair_idx]
+                - self._overlap_done[pair_idx].get(annotator_id, 0))
+
+    def _reserve(self, pair_idx, annotator_id, ttl, exclude):
+        """Reserves one task of the pair for the annotator, or returns None when none is free."""
+        overlap = [pool for judges, pool in self._overlap[pair_idx].items() if annotator_id not in judges]
+        if len(overlap) > 1:
+            # Start with a pool picked in proportion to its size, so every eligible task is equally likely
+            first = random.choices(range(len(overlap)), weights=[len(pool) for pool in overlap])[0]
+            overlap.insert(0, overlap.pop(first))
+        pools = [self._fresh[pair_idx], *overlap]
+        if random.random() < self.overlap_rate:
+            pools = overlap + [self._fresh[pair_idx]]
+        for pool in pools:
+            found = pool.reserve_random(1, ttl, exclude=exclude)
+            if found:
+                return found[0]
+        return None
+
+    def next_tasks(self, annotator_id, n, ttl=None):
+        """Returns up to n tasks for the annotator, reserving them for ttl seconds when ttl is given."""
+        self._ensure_loaded()
+        with self._lock:
+            done = self._done.setdefault(annotator_id, set())
+            n = min(n, self.budget - len(done))
+            beta = self._beta.copy()
+            available = np.array(
+                [self._pair_eligible(pair_idx, annotator_id) > 0 for pair_idx in range(len(self._fresh))], dtype=bool
+            )
+            picked = []
+            while len(picked) < n and available.any():
+                priority = np.where(available, self._variance(beta), -1.0)
+                pair_idx = int(np.argmax(priority))
+                task = self._reserve(pair_idx, annotator_id, ttl, exclude=set(picked))
+                if task is None:
+                    available[pair_idx] = False
+                    continue
+                picked.append(task)
+                # Pretend the pick was judged at the current mean so the next pick considers other pairs
+                mean = beta[pair_idx, 0] / beta[pair_idx].sum()
+                beta[pair_idx] += (mean, 1.0 - mean)
+            if ttl:
+                self._reserved_by.setdefault(annotator_id, set()).update(picked)
+            return picked
+
+    def release(self, annotator_id):
+        self._ensure_loaded()
+        with self._lock:
+            for task in self._reserved_by.pop(annotator_id, ()):
+                pair_idx = self._pair_index[task[1]]
+                judges = self._judges.get(task)
+                if not judges:
+                    self._fresh[pair_idx].release(task)
+                    continue
+                pool = self._overlap[pair_idx].get(frozenset(judges))
+                if pool is not None:
+                    pool.release(task)
+
+    def _eligible_count(self, annotator_id, limit):
+        """Number of tasks (capped at limit) the annotator could still be given."""
+        count = self._fresh_total + self._overlap_total - self._overlap_done_total.get(annotator_id, 0)
+        return min(count, limit)
+
+    def progress(self, annotator_id):
+        """Returns (completed, pending, total) for the annotator."""
+        self._ensure_loaded()
+        with self._lock:
+            completed = len(self._done.get(annotator_id, ()))
+            pending = self._eligible_count(annotator_id, max(self.budget - completed, 0))
+            return completed, pending, completed + pending
+
+    def pending_counts(self):
+        if not self._loaded:
+            return {}
+        with self._lock:
+            return {
+                annotator_id: self._eligible_count(annotator_id, max(self.budget - len(done), 0))
+                for annotator_id, done in self._done.items()
+            }
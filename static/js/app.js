@@ -1,6 +1,17 @@
 document.addEventListener('DOMContentLoaded', () => {
+    // 一次预取的任务数，以及队列少于多少个时在后台补充
+    const PREFETCH_SIZE = 5;
+    const REFILL_THRESHOLD = 2;
+    // 提交先进入本地队列，延迟片刻后批量发送；失败时按指数退避重试
+    const FLUSH_DELAY_MS = 300;
+    const MAX_RETRY_DELAY_MS = 30000;
+    // 每个批量请求最多包含的提交数，与服务器端的 SUBMIT_BATCH_MAX 一致（超过时整批被拒绝）
+    const SUBMIT_BATCH_MAX = 200;
+
     const state = {
         annotatorId: null,
+        // 标注活动（URL 中的 campaign 参数），为空时使用服务器的默认活动
+        campaign: new URLSearchParams(window.location.search).get('campaign') || '',
         caseId: null,
         modelA: null,
         modelB: null,
@@ -9,7 +20,21 @@ document.addEventListener('DOMContentLoaded', () => {
             adherence: null,
             clarity: null,
             empathy: null
-        }
+        },
+        // 预取的待标注任务队列
+        queue: [],
+        // 本次会话中已经拿到过的任务，避免重复展示
+        seen: new Set(),
+        // 尚未同步到服务器的提交（key -> payload），同时保存在 localStorage 中
+        outbox: new Map(),
+        exhausted: false,
+        fetching: null,
+        flushing: false,
+        flushTimer: null,
+        retryDelay: FLUSH_DELAY_MS,
+        serverCompleted: 0,
+        flushedSinceFetch: 0,
+        progressTotal: 0
     };
 
     // DOM Elements
@@ -40,8 +65,9 @@ document.addEventListener('DOMContentLoaded', () => {
                 alert("必须提供标注员ID才能开始！");
                 return null;
             }
-            // 更新URL并刷新，以便ID保留
-            window.location.search = `?annotator_id=${id}`;
+            // 更新URL并刷新，以便ID保留（同时保留 campaign 等其他参数）
+            urlParams.set('annotator_id', id);
+            window.location.search = `?${urlParams}`;
         }
         return id;
     };
@@ -71,71 +97,230 @@ document.addEventListener('DOMContentLoaded', () => {
         elements.submitAllBtn.disabled = true;
     };
 
-    const fetchNextPair = async () => {
-        showLoading(true);
-        resetForNextPair();
+    const pairKey = (caseId, modelA, modelB) => `${caseId}|${[modelA, modelB].sort().join('|')}`;
+
+    const outboxStorageKey = () => state.campaign
+        ? `annotation_outbox_${state.campaign}_${state.annotatorId}`
+        : `annotation_outbox_${state.annotatorId}`;
+
+    const saveOutbox = () => {
+        try {
+            localStorage.setItem(outboxStorageKey(), JSON.stringify([...state.outbox.values()]));
+        } catch (error) {
+            console.warn('Failed to persist pending submissions:', error);
+        }
+    };
+
+    const loadOutbox = () => {
         try {
-            const response = await fetch(`/get_comparison_pair?annotator_id=${state.annotatorId}`);
+            const saved = JSON.parse(localStorage.getItem(outboxStorageKey()) || '[]');
+            saved.forEach(payload => {
+                state.outbox.set(pairKey(payload.case_id, payload.model_a, payload.model_b), payload);
+            });
+        } catch (error) {
+            console.warn('Failed to load pending submissions:', error);
+        }
+    };
+
+    const updateProgress = () => {
+        if (state.progressTotal) {
+            const completed = state.serverCompleted + state.flushedSinceFetch + state.outbox.size;
+            elements.progressDisplay.textContent = `${Math.min(completed, state.progressTotal)} / ${state.progressTotal}`;
+        }
+    };
+
+    const fetchMorePairs = (reset = false) => {
+        if (state.fetching) {
+            return state.fetching;
+        }
+        const params = new URLSearchParams({ annotator_id: state.annotatorId, n: PREFETCH_SIZE });
+        if (state.campaign) {
+            params.set('campaign', state.campaign);
+        }
+        if (reset) {
+            params.set('reset', '1');
+        }
+        state.fetching = (async () => {
+            try {
+                const response = await fetch(`/get_comparison_pairs?${params}`);
+                if (!response.ok) {
+                    throw new Error('Network response was not ok');
+                }
+                const data = await response.json();
+                if (data.error) {
+                    alert(`错误: ${data.error}`);
+                    return;
+                }
+                state.serverCompleted = data.progress_completed;
+                state.flushedSinceFetch = 0;
+                state.progressTotal = data.progress_total;
+                data.pairs.forEach(pair => {
+                    const key = pairKey(pair.case_id, pair.model_a_info.name, pair.model_b_info.name);
+                    if (!state.seen.has(key) && !state.outbox.has(key)) {
+                        state.seen.add(key);
+                        // 预取时就开始下载对话，浏览器会缓存同一对话的重复请求
+                        pair.dialogues = Promise.all([
+                            fetchDialogue(pair.model_a_info.dialogue_url),
+                            fetchDialogue(pair.model_b_info.dialogue_url)
+                        ]);
+                        state.queue.push(pair);
+                    }
+                });
+                state.exhausted = data.pending === 0;
+                updateProgress();
+            } catch (error) {
+                console.error('Failed to fetch comparison pairs:', error);
+            } finally {
+                state.fetching = null;
+            }
+        })();
+        return state.fetching;
+    };
+
+    const fetchDialogue = async (url) => {
+        if (!url) {
+            return '';
+        }
+        try {
+            const response = await fetch(url);
             if (!response.ok) {
-                throw new Error('Network response was not ok');
+                throw new Error(`HTTP ${response.status}`);
             }
-            const data = await response.json();
-            if (data.progress_total) {
-                elements.progressDisplay.textContent = `${data.progress_completed} / ${data.progress_total}`;
-           }
+            return await response.text();
+        } catch (error) {
+            console.error('Failed to fetch dialogue:', url, error);
+            return '<div class="error">对话加载失败，请刷新页面重试。</div>';
+        }
+    };
 
-            if (data.message) {
+    const renderPair = async (data) => {
+        // 等两段对话都下载完成后再一起切换页面内容
+        const [dialogueA, dialogueB] = await data.dialogues;
+
+        // 更新状态
+        state.caseId = data.case_id;
+        state.modelA = data.model_a_info.name;
+        state.modelB = data.model_b_info.name;
+
+        elements.caseCategory.textContent = data.category || 'N/A';
+        // elements.diseaseChoices.textContent = data.choices || 'N/A';
+        const choicesData = data.choices;
+        let choicesArray = [];
+        if (typeof choicesData === 'string' && choicesData.trim() !== '') {
+            choicesArray = choicesData.split(',').map(choice => choice.trim());
+        } 
+        // Case 2: The data is already an array with content.
+        else if (Array.isArray(choicesData) && choicesData.length > 0) {
+            choicesArray = choicesData; // Use the array directly
+        }
+
+        // Now, if we have a valid array, format it for display.
+        if (choicesArray.length > 0) {
+            const formattedChoices = choicesArray
+                .map((name, index) => `(${index + 1}) ${name}`)
+                .join(', ');
+            elements.diseaseChoices.textContent = formattedChoices;
+        } else {
+            // This will handle null, undefined, empty string, or empty array cases.
+            elements.diseaseChoices.textContent = 'N/A';
+        }
+
+        // 更新UI
+        elements.modelAName.textContent = `模型 A`;
+        // elements.modelAName.textContent = `模型 A (${state.modelA})`;
+        elements.modelADialogue.innerHTML = dialogueA;
+        elements.modelBName.textContent = `模型 B`;
+        // elements.modelBName.textContent = `模型 B (${state.modelB})`;
+        elements.modelBDialogue.innerHTML = dialogueB;
+    };
+
+    const showNextPair = async () => {
+        resetForNextPair();
+        if (state.queue.length === 0) {
+            showLoading(true);
+            await fetchMorePairs();
+            if (state.queue.length === 0 && !state.exhausted) {
+                // 剩余任务都处于预留状态（例如之前的页面没有用完），重新开始预留
+                await fetchMorePairs(true);
+            }
+        }
+        if (state.queue.length === 0) {
+            if (state.exhausted) {
+                await flushOutbox();
                 displayCompletionScreen(); 
-                return;
+            } else {
+                console.error('No comparison pair available.');
+                showLoading(false);
             }
-            if (data.error) {
-                alert(`错误: ${data.error}`);
+            return;
+        }
+
+        await renderPair(state.queue.shift());
+        showLoading(false);
+        if (state.queue.length < REFILL_THRESHOLD && !state.exhausted) {
+            fetchMorePairs();
+        }
+    };
+
+    const scheduleFlush = (delay = FLUSH_DELAY_MS) => {
+        if (state.flushTimer) {
+            return;
+        }
+        state.flushTimer = setTimeout(() => {
+            state.flushTimer = null;
+            flushOutbox();
+        }, delay);
+    };
+
+    // 把本地队列中的提交按每批最多 SUBMIT_BATCH_MAX 条发送到服务器，每批确认后才从队列中移除，
+    // 剩余的提交紧接着发送。服务器端的写入是幂等的，重试不会产生重复记录。
+    const flushOutbox = async () => {
+        if (state.flushing || state.outbox.size === 0) {
+            return;
+        }
+        state.flushing = true;
+        const batch = [...state.outbox.entries()].slice(0, SUBMIT_BATCH_MAX);
+        try {
+            const response = await fetch('/submit_annotations', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ annotations: batch.map(([, payload]) => payload) })
+            });
+            const result = await response.json();
+            if (response.status === 400 && result.index !== undefined) {
+                // 无效的提交无法通过重试修复，丢弃它以免阻塞其他提交
+                console.error('Dropping invalid annotation:', result.error, batch[result.index][1]);
+                state.outbox.delete(batch[result.index][0]);
+                saveOutbox();
+                updateProgress();
+                scheduleFlush();
                 return;
             }
-
-            // 更新状态
-            state.caseId = data.case_id;
-            state.modelA = data.model_a_info.name;
-            state.modelB = data.model_b_info.name;
-
-            elements.caseCategory.textContent = data.category || 'N/A';
-            // elements.diseaseChoices.textContent = data.choices || 'N/A';
-            const choicesData = data.choices;
-            let choicesArray = [];
-            if (typeof choicesData === 'string' && choicesData.trim() !== '') {
-                choicesArray = choicesData.split(',').map(choice => choice.trim());
-            } 
-            // Case 2: The data is already an array with content.
-            else if (Array.isArray(choicesData) && choicesData.length > 0) {
-                choicesArray = choicesData; // Use the array directly
+            if (!result.success) {
+                throw new Error(result.error || 'Unknown error');
             }
-
-            // Now, if we have a valid array, format it for display.
-            if (choicesArray.length > 0) {
-                const formattedChoices = choicesArray
-                    .map((name, index) => `(${index + 1}) ${name}`)
-                    .join(', ');
-                elements.diseaseChoices.textContent = formattedChoices;
-            } else {
-                // This will handle null, undefined, empty string, or empty array cases.
-                elements.diseaseChoices.textContent = 'N/A';
+            batch.forEach(([key, payload], i) => {
+                // 发送期间同一任务可能又被修改过，只移除已发送的那一版
+                if (state.outbox.get(key) === payload) {
+                    state.outbox.delete(key);
+                }
+                if (result.results[i].status === 'inserted') {
+                    state.flushedSinceFetch += 1;
+                }
+            });
+            saveOutbox();
+            updateProgress();
+            state.retryDelay = FLUSH_DELAY_MS;
+            if (state.outbox.size > 0) {
+                // 离线期间积压的提交：立即发送下一批
+                scheduleFlush(batch.length === SUBMIT_BATCH_MAX ? 0 : FLUSH_DELAY_MS);
             }
-
-            // 更新UI
-            elements.modelAName.textContent = `模型 A`;
-            // elements.modelAName.textContent = `模型 A (${state.modelA})`;
-            // elements.modelADialogue.textContent = data.model_a_info.dialogue;
-            elements.modelADialogue.innerHTML = data.model_a_info.dialogue;
-            elements.modelBName.textContent = `模型 B`;
-            // elements.modelBName.textContent = `模型 B (${state.modelB})`;
-            // elements.modelBDialogue.textContent = data.model_b_info.dialogue;
-            elements.modelBDialogue.innerHTML = data.model_b_info.dialogue;
-            
         } catch (error) {
-            console.error('Failed to fetch comparison pair:', error);
-            // alert('加载下一组对话失败，请检查后端服务是否开启。');
+            console.error('Failed to submit annotations, will retry:', error);
+            state.retryDelay = Math.min(state.retryDelay * 2, MAX_RETRY_DELAY_MS);
+            scheduleFlush(state.retryDelay);
         } finally {
-            showLoading(false);
+            state.flushing = false;
         }
     };
 
@@ -168,35 +353,25 @@ document.addEventListener('DOMContentLoaded', () => {
         elements.submitAllBtn.disabled = !allSelected;
     };
 
-    const submitAnnotation = async (winner) => {
+    const submitAnnotation = () => {
         const payload = {
+            campaign: state.campaign || undefined,
             annotator_id: state.annotatorId,
             case_id: state.caseId,
             model_a: state.modelA,
             model_b: state.modelB,
-            winners: state.choices
+            winners: { ...state.choices }
         };
 
         elements.submitAllBtn.disabled = true; // Prevent double clicks
         elements.submitAllBtn.textContent = '提交所有评测';
 
-        try {
-            const response = await fetch('/submit_annotation', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify(payload)
-            });
-            const result = await response.json();
-            if (result.success) {
-                fetchNextPair(); // 成功后加载下一组
-            } else {
-                throw new Error(result.error || 'Unknown error');
-            }
-        } catch (error) {
-            console.error('Failed to submit annotation:', error);
-            alert('提交标注失败，请稍后重试。');
-            elements.submitAllBtn.disabled = false;
-        }
+        // 先放入本地队列并立即展示下一组，提交在后台批量发送
+        state.outbox.set(pairKey(payload.case_id, payload.model_a, payload.model_b), payload);
+        saveOutbox();
+        updateProgress();
+        scheduleFlush();
+        showNextPair();
     };
 
     const showLoading = (isLoading) => {
@@ -217,9 +392,26 @@ document.addEventListener('DOMContentLoaded', () => {
     state.annotatorId = getAnnotatorId();
     if (state.annotatorId) {
         elements.annotatorDisplay.textContent = state.annotatorId;
-        fetchNextPair();
+        loadOutbox();
+        scheduleFlush(0);
+        showLoading(true);
+        fetchMorePairs(true).then(showNextPair);
     }
 
+    // 关闭页面时尽量把未同步的提交发出去；即使失败，下次打开页面也会从 localStorage 恢复并重试
+    window.addEventListener('pagehide', () => {
+        if (state.outbox.size > 0 && navigator.sendBeacon) {
+            const payloads = [...state.outbox.values()];
+            for (let start = 0; start < payloads.length; start += SUBMIT_BATCH_MAX) {
+                const body = JSON.stringify({ annotations: payloads.slice(start, start + SUBMIT_BATCH_MAX) });
+                // 浏览器限制了待发送 beacon 的总大小，排不进去的留待下次打开页面时重试
+                if (!navigator.sendBeacon('/submit_annotations', new Blob([body], { type: 'application/json' }))) {
+                    break;
+                }
+            }
+        }
+    });
+
     // 绑定事件
     // elements.chooseABtn.addEventListener('click', () => submitAnnotation(state.modelA));
     // elements.chooseBBtn.addEventListener('click', () => submitAnnotation(state.modelB));
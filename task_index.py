@@ -0,0 +1,116 @@
+import time
+import random
+import threading
+
+
+def build_annotator_task_index(all_pairs, annotator_list):
+    """
+    Splits the sorted list of theoretical pairs between annotators once.
+    Pair i is assigned to annotator (i % len(annotator_list)), which is the
+    same fixed rule get_comparison_pair used to re-evaluate on every request.
+    """
+    num_annotators = len(annotator_list)
+    index = {annotator_id: [] for annotator_id in annotator_list}
+    if num_annotators == 0:
+        return index
+    for i, task in enumerate(all_pairs):
+        index[annotator_list[i % num_annotators]].append(task)
+    return index
+
+
+class PendingTaskSet:
+    """
+    A set of pending tasks supporting O(1) add, remove and random pick.
+    Items live in a list; a dict maps each item to its position so that
+    removal can swap the item with the last element and pop.
+    """
+
+    def __init__(self, tasks=()):
+        self._items = []
+        self._positions = {}
+        # task -> reservation expiry (time.monotonic()); reserved tasks are skipped by reserve_random
+        self._reserved = {}
+        self._lock = threading.Lock()
+        for task in tasks:
+            self._add(task)
+
+    def _add(self, task):
+        if task in self._positions:
+            return
+        self._positions[task] = len(self._items)
+        self._items.append(task)
+
+    def add(self, task):
+        with self._lock:
+            self._add(task)
+
+    def discard(self, task):
+        """Removes a task if present. Returns True when something was removed."""
+        with self._lock:
+            self._reserved.pop(task, None)
+            pos = self._positions.pop(task, None)
+            if pos is None:
+                return False
+            last = self._items.pop()
+            if pos < len(self._items):
+                self._items[pos] = last
+                self._positions[last] = pos
+            return True
+
+    def random_choice(self):
+        """Returns a random pending task, or None when the set is empty."""
+        with self._lock:
+            if not self._items:
+                return None
+            return self._items[random.randrange(len(self._items))]
+
+    def reserve_random(self, n, ttl, exclude=()):
+        """
+        Picks up to n distinct random tasks that are not currently reserved and
+        reserves them for ttl seconds (no reservation is recorded when ttl is
+        falsy). Tasks in exclude are never picked. Random probing keeps this O(n)
+        while most tasks are free; when the free tasks run low it falls back to one scan.
+        """
+        now = time.monotonic()
+        with self._lock:
+            picked = []
+            seen = set()
+
+            def is_free(task):
+                return task not in seen and task not in exclude and self._reserved.get(task, 0) <= now
+
+            for _ in range(4 * n):
+                if len(picked) >= n or not self._items:
+                    break
+                task = self._items[random.randrange(len(self._items))]
+                if is_free(task):
+                    picked.append(task)
+                    seen.add(task)
+            if len(picked) < n:
+                free = [task for task in self._items if is_free(task)]
+                picked.extend(random.sample(free, min(n - len(picked), len(free))))
+
+            if ttl:
+                for task in picked:
+                    self._reserved[task] = now + ttl
+            return picked
+
+    def release(self, task):
+        """Drops the reservation of a single task."""
+        with self._lock:
+            self._reserved.pop(task, None)
+
+    def release_all(self):
+        """Drops every reservation, e.g. when a client starts a fresh session."""
+        with self._lock:
+            self._reserved.clear()
+
+    def __contains__(self, task):
+        return task in self._positions
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._items))
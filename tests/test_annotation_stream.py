@@ -0,0 +1,57 @@
+import json
+
+import pandas as pd
+import pytest
+
+from annotation_stream import RankingStats, AgreementStats, load_dataframe, read_chunks, reduce_files
+from calculate_agreement import calculate_agreements_from_df
+from calculate_ranking import calculate_win_rates_from_df, encode_pairs
+
+WINNERS = ('winner_coherence', 'winner_adherence', 'winner_clarity', 'winner_empathy')
+
+
+def row(annotator_id, case_id, model_a, model_b, winner):
+    return {'annotator_id': annotator_id, 'case_id': case_id, 'model_a': model_a, 'model_b': model_b,
+            **{metric_key: winner for metric_key in WINNERS}}
+
+
+@pytest.fixture
+def dump_with_missing_model(tmp_path):
+    rows = [
+        row('u1', 1, 'X', 'Y', 'Y'),
+        row('u2', 1, 'X', 'Y', 'X'),
+        row('u1', 2, None, 'Y', 'Y'),
+        row('u2', 2, 'Y', None, 'tie'),
+    ]
+    path = tmp_path / 'annotations.jsonl'
+    path.write_text(''.join(json.dumps(r) + '\n' for r in rows), encoding='utf-8')
+    return str(path)
+
+
+def test_rows_without_a_model_are_dropped(dump_with_missing_model):
+    chunks = list(read_chunks(dump_with_missing_model, chunk_rows=3))
+    assert sum(len(chunk) for chunk in chunks) == 2
+    assert all(chunk['model_a'].notna().all() and chunk['model_b'].notna().all() for chunk in chunks)
+
+
+def test_streaming_and_in_memory_rankings_agree(dump_with_missing_model):
+    streamed = reduce_files([dump_with_missing_model], RankingStats, chunk_rows=3).rankings()
+    in_memory = calculate_win_rates_from_df(load_dataframe([dump_with_missing_model], chunk_rows=3))
+    assert streamed == in_memory
+    y = next(entry for entry in streamed['coherence'] if entry['model'] == 'Y')
+    assert y['comparisons'] == 2 and y['win_rate'] == 0.5
+
+
+def test_streaming_and_in_memory_agreement_agree(dump_with_missing_model):
+    streamed = reduce_files([dump_with_missing_model], AgreementStats, chunk_rows=3).agreement()
+    in_memory = calculate_agreements_from_df(load_dataframe([dump_with_missing_model], chunk_rows=3))
+    assert json.dumps(streamed, sort_keys=True, default=str) == json.dumps(in_memory, sort_keys=True, default=str)
+
+
+def test_missing_models_are_ignored_or_rejected():
+    df = pd.DataFrame([row('u1', 1, 'X', 'Y', 'Y'), row('u1', 2, None, 'Y', 'Y')])
+    assert calculate_win_rates_from_df(df) == calculate_win_rates_from_df(df.iloc[:1])
+    with pytest.raises(ValueError):
+        encode_pairs(df)
+    with pytest.raises(ValueError):
+        RankingStats().update(df)
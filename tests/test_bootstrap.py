@@ -0,0 +1,19 @@
+import numpy as np
+
+from bootstrap import (
+    batch_fleiss_kappa, batch_krippendorff_alpha, weighted_fleiss_kappa, weighted_krippendorff_alpha,
+)
+
+
+def test_task_weights_match_repeated_tasks():
+    rng = np.random.default_rng(0)
+    counts = rng.integers(0, 4, size=(30, 3)).astype(float)
+    counts[:3] = [[1, 0, 0], [0, 0, 0], [2, 0, 0]]
+    weights = rng.integers(0, 3, size=(5, 30)).astype(float)
+
+    fleiss = weighted_fleiss_kappa(counts, weights)
+    alpha = weighted_krippendorff_alpha(counts, weights)
+    for r, w in enumerate(weights):
+        repeated = np.repeat(counts, w.astype(int), axis=0)[None]
+        assert np.allclose(fleiss[r], batch_fleiss_kappa(repeated)[0])
+        assert np.allclose(alpha[r], batch_krippendorff_alpha(repeated)[0])
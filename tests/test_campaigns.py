@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+
+from campaigns import Campaign, CampaignRegistry
+
+
+def write_corpus(data_dir, n_cases=40, models=('model_a', 'model_b', 'model_c')):
+    os.makedirs(data_dir)
+    for model in models:
+        with open(os.path.join(data_dir, f'{model}.jsonl'), 'w', encoding='utf-8') as f:
+            for case_id in range(n_cases):
+                record = {
+                    'case_id': case_id,
+                    'category': 'cardiology',
+                    'choices': ['a', 'b'],
+                    'interactions': [[f'question {t} from {model} on case {case_id} ' * 20, f'answer {t}'] for t in range(6)],
+                }
+                f.write(json.dumps(record) + '\n')
+
+
+def test_snapshot_campaigns_are_not_reopened_under_a_tight_budget(tmp_path):
+    campaigns = []
+    for name in ('first', 'second'):
+        data_dir = str(tmp_path / name)
+        write_corpus(data_dir)
+        campaigns.append(Campaign(name, data_dir, ['u1', 'u2'], store_mode='snapshot'))
+    snapshot_bytes = []
+    for campaign in campaigns:
+        store = campaign.open_store()
+        snapshot_bytes.append(os.path.getsize(campaign.snapshot_path))
+        assert store.memory_bytes() < snapshot_bytes[-1]
+        del store
+
+    # Smaller than the two snapshots together, larger than their private tables
+    registry = CampaignRegistry(campaigns, make_scheduler=None, memory_budget=max(snapshot_bytes))
+    opened = []
+    for campaign in campaigns:
+        open_store = campaign.open_store
+        campaign.open_store = lambda open_store=open_store, name=campaign.name: opened.append(name) or open_store()
+
+    for _ in range(10):
+        for campaign in campaigns:
+            assert campaign.store.get('3', 'model_b') is not None
+    assert sorted(opened) == ['first', 'second']
+    assert set(registry.resident_bytes()) == {'first', 'second'}
+
+
+def test_eager_campaigns_are_still_evicted(tmp_path):
+    campaigns = []
+    for name in ('first', 'second'):
+        data_dir = str(tmp_path / name)
+        write_corpus(data_dir)
+        campaigns.append(Campaign(name, data_dir, ['u1', 'u2']))
+    registry = CampaignRegistry(campaigns, make_scheduler=None, memory_budget=1)
+    for campaign in campaigns:
+        campaign.store
+    assert list(registry.resident_bytes()) == ['second']
+
+
+def test_opening_a_corpus_does_not_block_other_campaigns(tmp_path):
+    campaigns = []
+    for name in ('slow', 'open'):
+        data_dir = str(tmp_path / name)
+        write_corpus(data_dir, n_cases=4)
+        campaigns.append(Campaign(name, data_dir, ['u1', 'u2']))
+    slow, already_open = campaigns
+    registry = CampaignRegistry(campaigns, make_scheduler=None)
+    already_open.store
+
+    started, release = threading.Event(), threading.Event()
+    open_store = slow.open_store
+
+    def blocking_open_store():
+        started.set()
+        release.wait(5)
+        return open_store()
+
+    slow.open_store = blocking_open_store
+    opener = threading.Thread(target=lambda: slow.store)
+    opener.start()
+    try:
+        assert started.wait(5)
+        # Must not wait for the slow campaign's corpus
+        result = []
+        reader = threading.Thread(target=lambda: result.append(already_open.store.get('1', 'model_a')))
+        reader.start()
+        reader.join(2)
+        assert result and result[0] is not None
+    finally:
+        release.set()
+        opener.join(5)
+    assert set(registry.resident_bytes()) == {'slow', 'open'}
@@ -0,0 +1,25 @@
+import json
+
+from dialogue_store import EagerDialogueStore, LazyDialogueStore, SnapshotDialogueStore
+
+
+def test_empty_dialogue_matches_eager_store(tmp_path):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    records = [
+        {'case_id': 1, 'category': 'cardiology', 'choices': ['a', 'b'], 'interactions': []},
+        {'case_id': 2, 'category': 'cardiology', 'choices': ['a'], 'interactions': [['question', 'answer']]},
+    ]
+    (data_dir / 'model_a.jsonl').write_text(''.join(json.dumps(r) + '\n' for r in records), encoding='utf-8')
+
+    eager = EagerDialogueStore(str(data_dir))
+    others = [
+        SnapshotDialogueStore(str(data_dir), str(tmp_path / 'dialogues.snapshot')),
+        LazyDialogueStore(str(data_dir), index_path=str(tmp_path / 'dialogues.index')),
+    ]
+    for store in others:
+        for case_id in ('1', '2'):
+            assert store.get(case_id, 'model_a') == eager.get(case_id, 'model_a')
+            expected, fragment = eager.fragment(case_id, 'model_a'), store.fragment(case_id, 'model_a')
+            assert (fragment.digest, fragment.bodies) == (expected.digest, expected.bodies)
+    assert eager.get('1', 'model_a')['dialogue'] == ''
@@ -0,0 +1,29 @@
+import time
+
+from flask import Flask, g
+from sqlalchemy import create_engine, text
+
+import metrics
+from metrics import stage, STAGE_DB, STAGE_SET_ARITHMETIC
+
+SLOW_QUERY = text("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 300000) SELECT count(*) FROM n")
+
+
+def test_sql_inside_a_stage_is_not_counted_twice():
+    app = Flask(__name__)
+    metrics.init_app(app)
+    engine = create_engine('sqlite://')
+
+    @app.route('/work')
+    def work():
+        with stage(STAGE_SET_ARITHMETIC):
+            with engine.connect() as connection:
+                connection.execute(SLOW_QUERY).scalar()
+            time.sleep(0.02)
+        return dict(g.metrics_stages, total=time.perf_counter() - g.metrics_start)
+
+    stages = app.test_client().get('/work').get_json()
+    total = stages.pop('total')
+    assert stages[STAGE_DB] > 0
+    assert 0.02 <= stages[STAGE_SET_ARITHMETIC] < 0.02 + stages[STAGE_DB]
+    assert sum(stages.values()) <= total
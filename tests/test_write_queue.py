@@ -0,0 +1,60 @@
+import threading
+
+import pytest
+
+from write_queue import GroupCommitQueue, WriterStopped, _Submission
+
+
+def test_groups_are_committed_and_acknowledged():
+    groups = []
+    q = GroupCommitQueue(lambda items: groups.append(list(items)) or [item * 2 for item in items], max_delay=0.05)
+    results = {}
+    threads = [threading.Thread(target=lambda i=i: results.update({i: q.submit([i, i + 100])})) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    q.close()
+    assert results == {i: [2 * i, 2 * (i + 100)] for i in range(5)}
+    assert sum(len(group) for group in groups) == 10
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_submit_fails_instead_of_hanging_when_the_writer_dies():
+    def write(items):
+        raise SystemExit  # not an Exception: kills the writer thread
+
+    q = GroupCommitQueue(write, liveness_interval=0.05)
+    with pytest.raises(WriterStopped):
+        q.submit([1])
+    # The next submission gets a fresh writer
+    q.write = lambda items: list(items)
+    assert q.submit([2]) == [2]
+    q.close()
+
+
+def test_close_fails_submissions_queued_after_stop():
+    writing, release = threading.Event(), threading.Event()
+
+    def write(items):
+        writing.set()
+        release.wait()
+        return list(items)
+
+    q = GroupCommitQueue(write, max_rows=1)
+    first = threading.Thread(target=q.submit, args=([1],))
+    first.start()
+    writing.wait()
+    thread, pending = q._thread, q._queue
+    closer = threading.Thread(target=q.close)
+    closer.start()
+    while not pending.qsize():  # wait for close() to queue its stop marker
+        pass
+    # A submission that lost the race with close() lands behind the stop marker
+    late = _Submission([2])
+    pending.put(late)
+    release.set()
+    closer.join()
+    first.join()
+    assert not thread.is_alive()
+    assert isinstance(late.error, WriterStopped)
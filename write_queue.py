@@ -0,0 +1,189 @@
+# write_queue.py
+"""
+Group commit for annotation submissions.
+
+Request threads hand their rows to a bounded in-process queue and block until
+a single writer thread has committed them. The writer collects submissions
+for up to max_delay seconds or max_rows rows, writes them in one transaction
+and only then wakes the waiting requests, so an acknowledgment still means
+the row is durable, while the commit (and its fsync) is shared by everyone
+in the group.
+
+A submission is all-or-nothing: when a group fails, its submissions are
+retried one transaction each so that a single bad submission does not fail
+the others. When the queue is full, submit() raises WriteQueueFull instead of
+letting requests pile up.
+
+The writer thread is started on first use and restarted after a fork, so the
+queue works with gunicorn's --preload. Should it stop (close() or an
+unexpected error), waiting submissions fail with WriterStopped instead of
+blocking their request, and the next submit() starts a new writer.
+"""
+import os
+import time
+import queue
+import atexit
+import threading
+
+_STOP = object()
+
+
+class WriteQueueFull(Exception):
+    """Raised by submit() when the queue stays full for longer than enqueue_timeout."""
+
+
+class WriterStopped(Exception):
+    """Raised by submit() when the writer thread stopped before committing the submission."""
+
+
+class _Submission:
+    __slots__ = ('items', 'done', 'results', 'error')
+
+    def __init__(self, items):
+        self.items = items
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+    def resolve(self, results=None, error=None):
+        self.results = results
+        self.error = error
+        self.done.set()
+
+
+class GroupCommitQueue:
+    """
+    write(items) runs on the writer thread and must write and commit the items
+    of a group in one transaction, returning one result per item (or raise, in
+    which case nothing of the group may have been committed).
+    """
+
+    def __init__(self, write, max_rows=64, max_delay=0.005, max_pending=1024, enqueue_timeout=1.0,
+                 on_commit=None, liveness_interval=1.0):
+        self.write = write
+        self.max_rows = max(int(max_rows), 1)
+        self.max_delay = max(float(max_delay), 0.0)
+        self.max_pending = max(int(max_pending), 1)
+        self.enqueue_timeout = enqueue_timeout
+        # on_commit(rows, submissions, seconds) is called after every successful group commit
+        self.on_commit = on_commit
+        # How often a waiting submit() checks that the writer thread is still alive
+        self.liveness_interval = liveness_interval
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _running(self):
+        return self._pid == os.getpid() and self._thread is not None and self._thread.is_alive()
+
+    def _ensure_started(self):
+        """Returns the (thread, queue) of a live writer, starting one when needed."""
+        with self._lock:
+            if not self._running():
+                # The thread of a parent process does not survive fork(), and a stopped one is replaced
+                self._queue = queue.Queue(maxsize=self.max_pending)
+                self._thread = threading.Thread(target=self._run, args=(self._queue,), name='group-commit', daemon=True)
+                self._thread.start()
+                if self._pid is None:
+                    atexit.register(self.close)
+                self._pid = os.getpid()
+            return self._thread, self._queue
+
+    def submit(self, items):
+        """Queues the items as one submission and returns their results once committed (re-raises write errors)."""
+        thread, q = self._ensure_started()
+        submission = _Submission(list(items))
+        try:
+            q.put(submission, timeout=self.enqueue_timeout)
+        except queue.Full:
+            raise WriteQueueFull(f"write queue is full ({self.max_pending} pending submissions)") from None
+        while not submission.done.wait(self.liveness_interval):
+            if not thread.is_alive():
+                # The writer may have resolved the submission just before exiting
+                if submission.done.is_set():
+                    break
+                raise WriterStopped("the group-commit writer stopped before committing the submission")
+        if submission.error is not None:
+            raise submission.error
+        return submission.results
+
+    def depth(self):
+        """Submissions waiting for the writer (0 before the writer has been started in this process)."""
+        q = self._queue
+        return q.qsize() if q is not None and self._pid == os.getpid() else 0
+
+    def close(self, timeout=5.0):
+        """
+        Commits what was queued before the call, stops the writer thread and
+        fails the submissions that arrived too late with WriterStopped.
+        """
+        with self._lock:
+            if not self._running():
+                return
+            thread, q = self._thread, self._queue
+            self._thread = None
+        try:
+            q.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        thread.join(timeout)
+        if thread.is_alive():
+            # Still committing; submissions left behind fail once their waiters see the writer gone
+            return
+        while True:
+            try:
+                submission = q.get_nowait()
+            except queue.Empty:
+                break
+            if submission is not _STOP:
+                submission.resolve(error=WriterStopped("the group-commit queue was closed"))
+
+    def _collect(self, q):
+        """Blocks for a first submission, then gathers more until max_rows or max_delay. Returns (group, stop)."""
+        first = q.get()
+        if first is _STOP:
+            return None, True
+        group, rows = [first], len(first.items)
+        deadline = time.monotonic() + self.max_delay
+        while rows < self.max_rows:
+            remaining = deadline - time.monotonic()
+            try:
+                submission = q.get(timeout=remaining) if remaining > 0 else q.get_nowait()
+            except queue.Empty:
+                break
+            if submission is _STOP:
+                return group, True
+            group.append(submission)
+            rows += len(submission.items)
+        return group, False
+
+    def _run(self, q):
+        while True:
+            group, stop = self._collect(q)
+            if group:
+                self._commit(group)
+            if stop:
+                break
+
+    def _commit(self, group):
+        items = [item for submission in group for item in submission.items]
+        start = time.perf_counter()
+        try:
+            results = self.write(items)
+        except Exception as e:
+            if len(group) == 1:
+                group[0].resolve(error=e)
+            else:
+                for submission in group:
+                    self._commit([submission])
+            return
+        if self.on_commit is not None:
+            try:
+                self.on_commit(len(items), len(group), time.perf_counter() - start)
+            except Exception as e:
+                print(f"Error in group commit callback: {e}")
+        offset = 0
+        for submission in group:
+            submission.resolve(results=results[offset:offset + len(submission.items)])
+            offset += len(submission.items)